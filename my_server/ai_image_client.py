@@ -0,0 +1,261 @@
+"""
+AIImageServer 的异步客户端
+
+所有请求共用一个 httpx 连接池（长连接），同时进行的请求数由 concurrency 限制：
+    - 上传前先按MD5查询服务器上是否已有相同的图像（/api/search），没有时才上传
+    - 批量提交（/api/enqueue/batch）
+    - 长轮询任务状态（/api/jobs 的 wait 参数），状态变化时立即返回
+    - 大文件按范围（Range）分块并发下载，直接写入磁盘
+
+httpx 只有客户端需要，不在服务器的 requirements.txt 中，使用前另外安装:
+    pip install httpx
+
+用法:
+    async with AIImageClient('http://127.0.0.1:8000', concurrency=8) as client:
+        image = await client.upload('photo.jpg')
+        results = await client.generate([{'workflow': 't2i', 'prompt': 'a cat'}], 'output')
+"""
+import asyncio
+import hashlib
+import os
+
+try:
+    import httpx
+except ImportError as e:
+    raise ImportError("AIImageClient 需要 httpx：pip install httpx") from e
+
+_FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+# 提交后可以等待结果的状态（conflict: 相同的请求已经在队列中）
+_ACCEPTED_STATUSES = ('queued', 'cached', 'conflict')
+
+
+def calculate_file_md5(file_path):
+    """与服务器 /api/search 使用的哈希一致"""
+    hash_func = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hash_func.update(chunk)
+    return hash_func.hexdigest()
+
+
+def _read_file(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+
+class AIImageClient:
+    """
+    AIImageServer 的异步客户端
+
+    Args:
+        base_url: 服务器地址，如 http://127.0.0.1:8000
+        concurrency: 同时进行的请求数（也是连接池的大小）
+        timeout: 单个请求的超时（秒），长轮询另加 poll_wait
+        poll_wait: 长轮询每次在服务器上最多等待的秒数
+        part_size: 分块下载的块大小（字节），小于两块的文件整个下载
+        batch_size: 批量提交时每个请求包含的条数（不超过服务器的 batch_max_items）
+    """
+
+    def __init__(self, base_url, concurrency=8, timeout=60.0, poll_wait=20.0,
+                 part_size=8 * 1024 * 1024, batch_size=100):
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.poll_wait = poll_wait
+        self.part_size = part_size
+        self.batch_size = batch_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+        # MD5: 上传任务（同一文件并发上传时只上传一次）
+        self.uploads: dict = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def _request(self, method, path, **kwargs):
+        async with self.semaphore:
+            return await self.client.request(method, path, **kwargs)
+
+    async def _request_json(self, method, path, **kwargs):
+        response = await self._request(method, path, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    async def upload(self, file_path):
+        """
+        上传输入图像，服务器上已有相同内容的文件时直接使用
+
+        返回值:
+            str: 服务器上的文件名（请求的 images 中使用）
+        """
+        md5 = await asyncio.to_thread(calculate_file_md5, file_path)
+        task = self.uploads.get(md5)
+        if task is None:
+            task = asyncio.ensure_future(self._upload(file_path, md5))
+            self.uploads[md5] = task
+        try:
+            return await task
+        except Exception:
+            self.uploads.pop(md5, None)
+            raise
+
+    async def _upload(self, file_path, md5):
+        response = await self._request('GET', f'/api/search/{md5}')
+        if response.status_code == 200:
+            return response.json()['file_name']
+        if response.status_code != 404:
+            response.raise_for_status()
+        # 文件名带上哈希，不会与服务器上其他内容的同名文件冲突
+        stem, ext = os.path.splitext(os.path.basename(file_path))
+        data = await asyncio.to_thread(_read_file, file_path)
+        result = await self._request_json('POST', '/api/upload', files={'file': (f'{stem}_{md5[:8]}{ext}', data)})
+        if result.get('status') != 'success':
+            raise RuntimeError(f"上传失败：{file_path} {result.get('message')}")
+        return result['filename']
+
+    async def enqueue(self, request):
+        """提交一个请求（QueueRequest 的字段），返回服务器的响应"""
+        return await self._request_json('POST', '/api/enqueue', json=request)
+
+    async def enqueue_batch(self, requests):
+        """
+        批量提交，按 batch_size 分成多个批次并发提交
+
+        返回值:
+            list: 每个请求的结果，顺序与 requests 相同
+        """
+        batches = [requests[i:i + self.batch_size] for i in range(0, len(requests), self.batch_size)]
+        results = await asyncio.gather(*[
+            self._request_json('POST', '/api/enqueue/batch', json={'requests': batch}) for batch in batches
+        ])
+        return [item for result in results for item in result['items']]
+
+    async def iter_status(self, prompt_id):
+        """长轮询任务状态，每次状态变化（开始执行等）时返回一次，直到任务结束"""
+        while True:
+            response = await self._request('GET', f'/api/jobs/{prompt_id}', params={'wait': self.poll_wait},
+                                           timeout=self.timeout + self.poll_wait)
+            response.raise_for_status()
+            result = response.json()
+            yield result
+            if result.get('status') in _FINISHED_STATUSES:
+                return
+
+    async def wait(self, prompt_id):
+        """等待任务结束，返回最后的状态"""
+        result = None
+        async for result in self.iter_status(prompt_id):
+            pass
+        return result
+
+    async def download(self, prompt_id, dest_dir, index=None):
+        """
+        下载任务的输出文件到 dest_dir
+
+        Args:
+            index: 只下载第几个文件，为None时下载全部
+
+        返回值:
+            list: 保存的文件路径
+        """
+        result = await self._request_json('GET', f'/api/results/{prompt_id}')
+        files = result['files'] if index is None else [result['files'][index]]
+        os.makedirs(dest_dir, exist_ok=True)
+        return await asyncio.gather(*[
+            self.download_file(item['url'], os.path.join(dest_dir, item['name']), item.get('size')) for item in files
+        ])
+
+    async def download_file(self, url, file_path, size=None):
+        """
+        下载一个文件，大小已知且不小于两块时按范围分块并发下载
+
+        先写到临时文件，完成后改名；服务器不支持范围请求时整个下载
+        """
+        tmp_file = file_path + '.part'
+        try:
+            if size is None or size < 2 * self.part_size or not await self._download_parts(url, tmp_file, size):
+                await self._download_whole(url, tmp_file)
+            os.replace(tmp_file, file_path)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        return file_path
+
+    async def _download_whole(self, url, file_path):
+        async with self.semaphore:
+            async with self.client.stream('GET', url) as response:
+                response.raise_for_status()
+                with open(file_path, 'wb') as f:
+                    async for chunk in response.aiter_bytes():
+                        f.write(chunk)
+
+    async def _download_parts(self, url, file_path, size):
+        """按范围分块下载到预先分配的文件中，服务器不支持范围请求时返回False"""
+        with open(file_path, 'wb') as f:
+            f.truncate(size)
+        ranges = [(start, min(start + self.part_size, size) - 1) for start in range(0, size, self.part_size)]
+
+        async def download_part(start, end):
+            async with self.semaphore:
+                headers = {'Range': f'bytes={start}-{end}'}
+                async with self.client.stream('GET', url, headers=headers) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        return False
+                    with open(file_path, 'r+b') as f:
+                        f.seek(start)
+                        async for chunk in response.aiter_bytes():
+                            f.write(chunk)
+            return True
+
+        return all(await asyncio.gather(*[download_part(start, end) for start, end in ranges]))
+
+    async def generate(self, requests, dest_dir):
+        """
+        批量生成并下载结果
+
+        按提交顺序逐个长轮询（服务器按顺序执行，同时只占用一个连接等待），
+        完成的任务立即开始下载，下载与后续任务的等待并发进行。
+
+        返回值:
+            list: 每个请求的结果 {'prompt_id', 'status', 'message', 'files'}，顺序与 requests 相同
+        """
+        items = await self.enqueue_batch(requests)
+        results = [{
+            'prompt_id': item.get('prompt_id'),
+            'status': item.get('status'),
+            'message': item.get('message'),
+            'files': [],
+        } for item in items]
+
+        # prompt_id: 下载任务（重复的请求只下载一次）
+        downloads = {}
+        for result in results:
+            if result['status'] not in _ACCEPTED_STATUSES:
+                continue
+            prompt_id = result['prompt_id']
+            if result['status'] != 'cached' and prompt_id not in downloads:
+                status = await self.wait(prompt_id)
+                result['status'] = status.get('status')
+                result['message'] = status.get('message')
+                if result['status'] != 'completed':
+                    continue
+            if prompt_id not in downloads:
+                downloads[prompt_id] = asyncio.ensure_future(self.download(prompt_id, dest_dir))
+
+        for result in results:
+            task = downloads.get(result['prompt_id'])
+            if task is not None:
+                result['files'] = await task
+                result['status'] = 'completed'
+        return results
@@ -1,27 +1,51 @@
 # ai_image_server_thread.py
+import asyncio
 import hashlib
 import http.client
+import io
+import itertools
 import json
 import logging
+import math
 import os.path
 import shutil
 import socket
 import threading
+import time
 import urllib
+import urllib.error
 import urllib.parse
 import urllib.request
 import uuid
+import zipfile
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Optional, List
 
 import uvicorn
-from fastapi import FastAPI, HTTPException, Form, UploadFile, File
+from fastapi import FastAPI, HTTPException, Form, UploadFile, File, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 
 import folder_paths
 import workflows as wf
+from comfy_bridge import comfy_bridge
+from eta import EtaModel, get_eta_features
+from history_pruner import HistoryPruner
+from image_hash import PerceptualIndex
+from image_normalizer import VARIANT_DIR, input_normalizer
+from job_watcher import JobWatcher
+from model_catalog import model_catalog, make_etag
+from model_fingerprint import model_fingerprints
+from node_profiler import NodeProfiler
+from preflight import PromptValidator
+from prewarm import ModelPrewarmer, RequestMix
+from request_aliases import request_aliases
+from result_index import result_index, get_media_type
+from scheduler import PromptScheduler, ScheduledJob
+from server_config import get_config
+from slo import plan_degradation
+from traffic import TrafficRecorder, is_body_recorded_path, is_recorded_path
 from comfy_execution.jobs import JobStatus
 
 common_functions = {}
@@ -56,7 +80,11 @@ def find_file_by_hash(directory, target_hash, algorithm='md5'):
 
     hash_map_changed = False
     found_file_path = None
+    variant_dir = os.path.join(directory, VARIANT_DIR)
     for root, dirs, files in os.walk(directory):
+        if root == directory:
+            # 规范化的图像是原图的副本，不用计算哈希
+            dirs[:] = [d for d in dirs if d != VARIANT_DIR]
         for filename in files:
             file_path = os.path.join(root, filename)
             if file_path in hash_map:
@@ -80,10 +108,11 @@ def find_file_by_hash(directory, target_hash, algorithm='md5'):
     # 清理无效的项
     invalid_keys = []
     for key in hash_map:
-        if not os.path.exists(key):
+        if not os.path.exists(key) or key.startswith(variant_dir + os.sep):
             invalid_keys.append(key)
     for key in invalid_keys:
         del hash_map[key]
+        hash_map_changed = True
 
     # 反映更新
     if hash_map_changed:
@@ -113,14 +142,290 @@ def _get_request_id(prompt_id):
     return prompt_id[:8]
 
 
+def get_workflow_params(request):
+    """请求参数转换为工作流生成函数的参数"""
+    return dict(
+        model=request.model,
+        prompt_p=request.prompt,
+        seed=request.seed,
+        width=request.img_width,
+        height=request.img_height,
+        step=request.step,
+        cfg=request.cfg,
+        upscale_factor=request.upscale_factor,
+        seconds=request.seconds,
+        megapixels=request.megapixels,
+        image1=request.images[0],
+        image2=request.images[1],
+        image3=request.images[2],
+    )
+
+
+def get_legacy_prompt_id(request):
+    """按原始请求参数生成的参数ID（规范化之前的算法，用于查找旧结果）"""
+    return generate_prompt_id(
+        request.workflow,
+        request.model,
+        request.prompt,
+        request.seed,
+        request.img_width,
+        request.img_height,
+        request.upscale_factor,
+        request.step,
+        request.cfg,
+        request.seconds,
+        request.megapixels,
+        request.images[0],
+        request.images[1],
+        request.images[2],
+    )
+
+
+def get_request_prompt_id(request):
+    """根据规范化的请求参数生成参数ID，生成相同工作流的请求得到相同的ID"""
+    wf.load_workflows()
+    canonical = wf.canonicalize_params(request.workflow, **get_workflow_params(request))
+    if canonical is None:
+        return get_legacy_prompt_id(request)
+    # 规范化的输入图像与原图像素不同（旋转、缩小），记录规范化到的像素；
+    # 不记录实际使用的图像名称，否则规范化是否已完成（时间）会改变参数ID
+    if get_config('upload_normalize_enabled') and any(
+            canonical.get(key) is not None for key in ('image1', 'image2', 'image3')):
+        canonical['normalize_megapixels'] = get_normalize_megapixels()
+    return generate_prompt_id(
+        'v2',
+        request.workflow,
+        json.dumps(canonical, sort_keys=True, ensure_ascii=False),
+    )
+
+
+def get_profile_bucket(request):
+    """耗时统计的参数分组：分辨率、步数、时长（只取工作流实际使用的参数）"""
+    wf.load_workflows()
+    canonical = wf.canonicalize_params(request.workflow, **get_workflow_params(request)) or {}
+    bucket = {}
+    if canonical.get('width') is not None and canonical.get('height') is not None:
+        bucket['resolution'] = f"{canonical['width']}x{canonical['height']}"
+    for key in ('step', 'seconds'):
+        if canonical.get(key) is not None:
+            bucket[key] = canonical[key]
+    return bucket
+
+
+def get_request_eta_features(request):
+    """执行时间模型的特征"""
+    wf.load_workflows()
+    canonical = wf.canonicalize_params(request.workflow, **get_workflow_params(request)) or {}
+    return get_eta_features(canonical)
+
+
+def get_normalize_megapixels():
+    """上传的图像规范化到的像素（百万）：配置值，或需要输入图像的工作流默认参数中最大的 megapixels"""
+    megapixels = get_config('upload_normalize_megapixels')
+    if megapixels is not None:
+        return megapixels
+    wf.load_workflows()
+    values = [info.get('defaultParameters', {}).get('megapixels') for info in wf.workflow_list.values()
+              if info.get('inputType') == 'image']
+    return max([x for x in values if x is not None], default=1.0)
+
+
+def resolve_input_images(request, wait=True):
+    """
+    输入图像使用上传时规范化的版本（已旋转、缩小），还在规范化时等待完成（wait 为False时不等待，使用原图）；
+    工作流至少按1百万像素使用输入图像（ImageScaleToTotalPixels 的默认值、编辑模型的参考图像）
+    """
+    megapixels = max(request.megapixels or 0, 1.0)
+    target_megapixels = get_normalize_megapixels()
+    return {
+        key: input_normalizer.resolve(name, megapixels, target_megapixels, None if wait else 0)
+        for key, name in zip(('image1', 'image2', 'image3'), request.images)
+    }
+
+
+def build_prompt(request, base_image=None):
+    """
+    根据请求生成工作流，工作流不存在时返回None
+
+    base_image: 已生成的基础图像，指定时放大请求只执行放大阶段
+    """
+    wf.load_workflows()
+    workflow_prompt_func = wf.workflow_func_map.get(request.workflow)
+    if workflow_prompt_func is None:
+        return None
+    params = get_workflow_params(request)
+    # 提交时在锁外已经等待过规范化，这里不再等待
+    params.update(resolve_input_images(request, wait=False))
+    return workflow_prompt_func(base_image=base_image, **params)
+
+
+def get_base_request(request):
+    """放大请求对应的不放大的请求"""
+    return request.model_copy(update={'upscale_factor': None})
+
+
+def get_output_image_path(file_path):
+    """输出目录中的文件转换为 LoadImage 可以读取的路径"""
+    relative_path = os.path.relpath(file_path, folder_paths.get_output_directory())
+    return relative_path.replace(os.sep, '/') + ' [output]'
+
+
+__local = threading.local()
+
+
+def _post_json_keep_alive(path, payload):
+    """通过线程内复用的长连接向ComfyUI发送POST请求，非200时抛出HTTPError"""
+    data = json.dumps(payload).encode('utf-8')
+    headers = {'Content-Type': 'application/json', 'Connection': 'keep-alive'}
+    for attempt in range(2):
+        conn = getattr(__local, 'conn', None)
+        if conn is None or getattr(__local, 'address', None) != server_address:
+            conn = http.client.HTTPConnection(server_address, timeout=30)
+            __local.conn = conn
+            __local.address = server_address
+        try:
+            conn.request('POST', path, body=data, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError):
+            # 连接被服务端关闭，重建后重试一次
+            conn.close()
+            __local.conn = None
+            if attempt == 1:
+                raise
+            continue
+        if response.status != 200:
+            raise urllib.error.HTTPError(f"http://{server_address}{path}", response.status, response.reason,
+                                         response.headers, io.BytesIO(body))
+        return json.loads(body) if body else {}
+    return {}
+
+
 def queue_prompt(prompt, client_id, prompt_id):
+    if comfy_bridge.is_available():
+        return comfy_bridge.queue_prompt(prompt, client_id, prompt_id)
     p = {"prompt": prompt, "client_id": client_id, "prompt_id": prompt_id}
-    data = json.dumps(p).encode('utf-8')
-    req = urllib.request.Request("http://{}/prompt".format(server_address), data=data)
-    return urllib.request.urlopen(req)
+    return _post_json_keep_alive('/prompt', p)
+
+
+def get_queue_remaining():
+    """获取ComfyUI中的任务数（运行中+排队）"""
+    if comfy_bridge.is_available():
+        return comfy_bridge.get_queue_remaining()
+    with urllib.request.urlopen("http://{}/prompt".format(server_address)) as response:
+        return json.loads(response.read())['exec_info']['queue_remaining']
+
+
+def get_queue():
+    """获取ComfyUI的队列，queue_running / queue_pending 中每项的第2个元素是 prompt_id"""
+    if comfy_bridge.is_available():
+        return comfy_bridge.get_queue()
+    with urllib.request.urlopen("http://{}/queue".format(server_address)) as response:
+        return json.loads(response.read())
+
+
+def delete_queued_prompts(prompt_ids):
+    """从ComfyUI队列中删除还没有开始执行的任务"""
+    if comfy_bridge.is_available():
+        return comfy_bridge.delete_queued_prompts(prompt_ids)
+    return _post_json_keep_alive('/queue', {'delete': list(prompt_ids)})
+
+
+def interrupt_prompt(prompt_id):
+    """中断ComfyUI正在执行的任务，正在执行的不是该任务时ComfyUI不做处理，为None时中断当前任务"""
+    if comfy_bridge.is_available():
+        return comfy_bridge.interrupt_prompt(prompt_id)
+    return _post_json_keep_alive('/interrupt', {'prompt_id': prompt_id} if prompt_id is not None else {})
+
+
+def cancel_comfy_prompt(prompt_id):
+    """取消ComfyUI中的任务：等待中的从队列删除，正在执行的中断（对其他任务都不生效）"""
+    delete_queued_prompts([prompt_id])
+    interrupt_prompt(prompt_id)
+
+
+def delete_history(prompt_ids):
+    """删除ComfyUI中的任务历史"""
+    if comfy_bridge.is_available():
+        return comfy_bridge.delete_history(prompt_ids)
+    return _post_json_keep_alive('/history', {'delete': list(prompt_ids)})
+
+
+def _remove_job_outputs(job, include_temp=False):
+    """
+    删除被中断的任务已经写入输出目录的文件（视频及其首尾帧、保存的图像）
+
+    include_temp: 同时删除写入临时目录的图像（PreviewImage）
+    """
+    removed = []
+    for node_output in (job.get('outputs') or {}).values():
+        paths = []
+        for video in node_output.get('gifs', []):
+            if 'fullpath' in video:
+                base = os.path.splitext(video['fullpath'])[0]
+                paths.extend([video['fullpath'], base + '.png', base + '_.png'])
+        for image in node_output.get('images', []):
+            if image.get('type') == 'output':
+                paths.append(os.path.join(folder_paths.get_output_directory(),
+                                          image.get('subfolder', ''), image['filename']))
+            elif image.get('type') == 'temp' and include_temp:
+                paths.append(os.path.join(folder_paths.get_temp_directory(),
+                                          image.get('subfolder', ''), image['filename']))
+        for path in paths:
+            try:
+                if os.path.isfile(path):
+                    os.remove(path)
+                    removed.append(path)
+            except Exception as e:
+                print(f"中断任务的输出清理失败：{path} {e}")
+    return removed
+
+
+def strip_output_nodes(prompt):
+    """
+    去掉工作流中保存结果的节点（预热用）：有图像输入的输出节点（SaveImage、VHS_VideoCombine等）
+    改为 PreviewImage（只写临时目录，结束后删除），其他输出节点删除
+
+    返回值:
+        dict: 新的工作流，没有图像输出节点时返回None
+    """
+    linked = set()
+    for node in prompt.values():
+        for value in node.get('inputs', {}).values():
+            if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str):
+                linked.add(value[0])
+    result = {}
+    has_output = False
+    for x, node in prompt.items():
+        if x in linked:
+            result[x] = node
+        elif isinstance(node.get('inputs', {}).get('images'), list):
+            result[x] = {
+                'class_type': 'PreviewImage',
+                'inputs': {'images': node['inputs']['images']},
+                '_meta': {'title': 'Warm Up Preview'},
+            }
+            has_output = True
+    return result if has_output else None
+
+
+def finish_warmup(prompt_id):
+    """预热任务结束后删除它写出的文件和ComfyUI中的历史"""
+    job = get_jobs(prompt_id)
+    if job is not None:
+        for path in _remove_job_outputs(job, include_temp=True):
+            logger.debug(f"已删除预热任务的输出: {path}")
+    delete_history([prompt_id])
+
+
+def get_object_info():
+    with urllib.request.urlopen("http://{}/object_info".format(server_address)) as response:
+        return json.loads(response.read())
 
 
 def get_image(filename, subfolder, folder_type):
+    if comfy_bridge.is_available():
+        return comfy_bridge.get_image(filename, subfolder, folder_type)
     data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
     url_values = urllib.parse.urlencode(data)
     with urllib.request.urlopen("http://{}/view?{}".format(server_address, url_values)) as response:
@@ -137,6 +442,11 @@ def get_history(prompt_id=None):
 
 
 def get_jobs(prompt_id=None):
+    if prompt_id is not None and comfy_bridge.is_available() and comfy_bridge.has_jobs_api():
+        job = comfy_bridge.get_job(prompt_id)
+        if job is None:
+            raise urllib.error.HTTPError(f"/api/jobs/{prompt_id}", 404, 'Not Found', None, io.BytesIO(b'{}'))
+        return job
     if prompt_id is None:
         url = f"http://{server_address}/api/jobs"
     else:
@@ -248,6 +558,16 @@ net_params = NetParams()
 net_result = NetResult()
 
 
+def _etag_response(request: Request, content: dict, etag: str):
+    """带ETag的JSON响应，客户端ETag一致时返回304"""
+    from fastapi.responses import JSONResponse, Response
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None and etag in [t.strip() for t in if_none_match.split(',')]:
+        return Response(status_code=http.client.NOT_MODIFIED, headers=headers)
+    return JSONResponse(content, headers=headers)
+
+
 def _get_job_status(job):
     if job is not None and isinstance(job, dict) and 'status' in job:
         return job['status']
@@ -266,6 +586,37 @@ def _get_output_video_from_job(job):
     return output_videos
 
 
+def _move_job_video(ori_file, dest_file_no_ext):
+    """
+    转移ComfyUI输出的视频和尾帧图像（SaveImage 保存的 *_.png），清理自动生成的首帧图像
+
+    返回值:
+        (视频路径, 尾帧图像路径)，没有尾帧图像时为None
+    """
+    filepath = dest_file_no_ext + '.mp4'
+    os.rename(ori_file, filepath)
+    ori_file_without_ext = os.path.splitext(ori_file)[0]
+    dest_last_frame = None
+    try:
+        # 转移尾帧图像
+        last_frame = ori_file_without_ext + '_.png'
+        if os.path.exists(last_frame):
+            dest_last_frame = dest_file_no_ext + '_[-1].png'
+            os.rename(last_frame, dest_last_frame)
+    except Exception as e:
+        print(f"尾帧图像转移失败：{e}")
+        dest_last_frame = None
+
+    try:
+        # 清理自动生成的首帧图像
+        first_frame = ori_file_without_ext + '.png'
+        if os.path.exists(first_frame):
+            os.remove(first_frame)
+    except Exception as e:
+        print(f"首帧图像清理失败：{e}")
+    return filepath, dest_last_frame
+
+
 def _get_output_images_from_job(job):
     """提取图片数据"""
     output_images = {}
@@ -284,6 +635,55 @@ def _get_output_images_from_job(job):
     return output_images
 
 
+_thumbnail_dir = os.path.join(os.path.dirname(__file__), 'cache', 'thumbnails')
+
+
+def make_thumbnail(src_path, dst_path, size):
+    """生成JPEG缩略图（长边不超过 size），已生成时直接返回"""
+    if os.path.isfile(dst_path):
+        return dst_path
+    from PIL import Image
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    with Image.open(src_path) as image:
+        image.thumbnail((size, size))
+        tmp_path = dst_path + '.tmp'
+        image.convert('RGB').save(tmp_path, 'JPEG', quality=85)
+    os.replace(tmp_path, dst_path)
+    return dst_path
+
+
+class _ZipStream:
+    """zipfile 的输出目标：写入的数据暂存在内存中，由生成器逐块取走（不需要seek，也不落盘）"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def iter_zip_files(files, chunk_size=1024 * 1024):
+    """边读文件边生成zip数据（不压缩，图像和视频本身已压缩）"""
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as zf:
+        for file_path in files:
+            with open(file_path, 'rb') as src, zf.open(os.path.basename(file_path), 'w', force_zip64=True) as dst:
+                for chunk in iter(lambda: src.read(chunk_size), b""):
+                    dst.write(chunk)
+                    yield stream.pop()
+            yield stream.pop()
+    yield stream.pop()
+
+
 class AIImageServer:
     def __init__(self, host=None, port=0, local_ip: str = None, is_v6: bool = False):
         """
@@ -304,6 +704,42 @@ class AIImageServer:
         self.client_id = str(uuid.uuid4())
         self.prompt_id = None
         self.running_request: dict[str, AIImageServer.QueueRequest] = {}
+        # 已取消的任务 prompt_id -> 取消时间
+        self.cancelled_prompts: dict[str, int] = {}
+        self.validator = PromptValidator(get_object_info)
+        self.phash_index = PerceptualIndex(folder_paths.get_input_directory)
+        self.scheduler = PromptScheduler(
+            lambda job: queue_prompt(job.prompt, job.client_id, job.prompt_id),
+            get_queue_remaining
+        )
+        self.history_pruner = HistoryPruner(delete_history)
+        self.node_profiler = NodeProfiler()
+        self.eta_model = EtaModel()
+        # prompt_id: 执行时间模型的特征（本服务器提交的任务）
+        self.eta_features = {}
+        # prompt_id: 第一次看到任务在ComfyUI中执行的时间
+        self.eta_started = {}
+        # 任务结束后在后台转移结果、提交后续任务（放大阶段等），不等客户端查询状态
+        self.job_watcher = JobWatcher()
+        # 查询状态会转移结果，客户端和后台线程同时查询时需要串行
+        self.status_lock = threading.RLock()
+        # 等待基础图像的放大任务 prompt_id: 基础图像的 prompt_id
+        self.upscale_bases: dict = {}
+        # 后续任务提交失败的原因 prompt_id: 失败原因
+        self.chain_errors: dict = {}
+        # 等待中的长轮询 (事件循环, asyncio.Event)，ComfyUI事件时唤醒
+        self.status_waiters = set()
+        self.status_waiters_lock = threading.Lock()
+        # 提交在线程池中执行，同时提交的相同请求需要串行（冲突检查）
+        self.enqueue_lock = threading.RLock()
+        self.prewarmer = ModelPrewarmer(
+            RequestMix(),
+            self.scheduler,
+            self.build_warmup_prompt,
+            lambda prompt_id, prompt: queue_prompt(prompt, self.client_id, prompt_id),
+            cancel_comfy_prompt,
+            finish_warmup
+        )
 
         # 创建FastAPI应用
         self.app = FastAPI(
@@ -321,6 +757,32 @@ class AIImageServer:
             allow_headers=["*"],
         )
 
+        # 请求记录（traffic_record_enabled），用于按真实流量重放
+        self.traffic_recorder = TrafficRecorder()
+
+        @self.app.middleware("http")
+        async def record_traffic(request: Request, call_next):
+            if not is_recorded_path(request.url.path) or not self.traffic_recorder.is_enabled():
+                return await call_next(request)
+            started = time.time()
+            t0 = time.perf_counter()
+            body = None
+            if request.method == 'POST' and is_body_recorded_path(request.url.path):
+                try:
+                    body = json.loads(await request.body())
+                except ValueError:
+                    body = None
+            response = await call_next(request)
+            path = request.url.path + (f"?{request.url.query}" if request.url.query else '')
+            request_size = request.headers.get('content-length')
+            response_size = response.headers.get('content-length')
+            self.traffic_recorder.record(
+                started, request.method, path, response.status_code, time.perf_counter() - t0, body,
+                int(request_size) if request_size else None,
+                int(response_size) if response_size else None,
+            )
+            return response
+
         # 注册路由
         self.setup_routes()
 
@@ -357,6 +819,9 @@ class AIImageServer:
         seconds: int = Field(0, description="视频时长（秒）")
         megapixels: float = Field(1.0, description="图像像素（百万）")
         images: Optional[list] = Field([None, None, None], description="图像名称")
+        client_id: Optional[str] = Field(None, description="调用方ID（用于按调用方批量取消）")
+        allow_degrade: bool = Field(False, description="负载过高时允许降低质量（步数、分辨率、放大）或改用更快的工作流")
+        segmented: bool = Field(False, description="长视频分段生成（暂不支持，请求会被拒绝）")
 
     # 响应模型
     class ImageResponse(BaseModel):
@@ -369,9 +834,78 @@ class AIImageServer:
         created_at: str
         processing_time: Optional[float] = None
 
+    class SweepSpec(BaseModel):
+        base: dict = Field(..., description="基础参数（QueueRequest 字段）")
+        fields: dict[str, list] = Field(..., description="扫描的参数及取值列表")
+
+    class BatchQueueRequest(BaseModel):
+        requests: Optional[List["AIImageServer.QueueRequest"]] = Field(None, description="请求列表")
+        sweep: Optional["AIImageServer.SweepSpec"] = Field(None, description="参数扫描")
+
     class InterruptRequest(BaseModel):
         prompt_id: str = Field(None, description='ID')
 
+    class CancelRequest(BaseModel):
+        prompt_ids: Optional[List[str]] = Field(None, description="要取消的任务")
+        client_id: Optional[str] = Field(None, description="取消该调用方提交的全部任务")
+
+    def learn_duration(self, prompt_id, workflow, job):
+        """用完成的任务更新执行时间模型（ComfyUI记录的开始、结束时间，没有时用观察到的开始时间）"""
+        features = self.eta_features.pop(prompt_id, None)
+        started = self.eta_started.pop(prompt_id, None)
+        if features is None:
+            return
+        duration_ms = None
+        if job.get('execution_start_time') and job.get('execution_end_time'):
+            duration_ms = job['execution_end_time'] - job['execution_start_time']
+        elif started is not None:
+            duration_ms = (time.monotonic() - started) * 1000
+        self.eta_model.add(workflow, features, duration_ms)
+
+    def on_comfy_event(self, message):
+        """ComfyUI的任务结束后立即唤醒调度器提交下一个任务、唤醒后续处理线程和长轮询，不等下一次轮询"""
+        if message.get('type') in ('execution_success', 'execution_error', 'execution_interrupted'):
+            self.scheduler.notify()
+            self.job_watcher.notify()
+            self.notify_status_waiters()
+        elif message.get('type') == 'execution_start':
+            self.notify_status_waiters()
+
+    def notify_status_waiters(self):
+        """任务状态可能变化时唤醒等待中的长轮询（可在任意线程中调用）"""
+        with self.status_waiters_lock:
+            waiters = list(self.status_waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def prefetch_fingerprints(self):
+        """启动时在后台计算各工作流可用模型的采样指纹，查询模型列表时不用等待"""
+        try:
+            wf.load_workflows()
+            model_types = {model_type for workflow_info in wf.workflow_list.values()
+                           for model_type in workflow_info.get('modelTypes', [])}
+            for model_type in model_types:
+                models, _ = model_catalog.get(model_type)
+                model_fingerprints.get_fingerprints(model_type, [m['name'] for m in models])
+        except Exception as e:
+            logger.error(f"预先计算模型指纹失败: {e}")
+
+    def build_warmup_prompt(self, workflow, model):
+        """
+        预热用的最小工作流（64x64、1步、不放大），需要输入图像的工作流不预热
+
+        保存结果的节点改为 PreviewImage，预热不会在输出目录中留下文件
+        """
+        wf.load_workflows()
+        workflow_info = wf.workflow_list.get(workflow)
+        if workflow_info is None or workflow_info.get('inputType') == 'image':
+            return None
+        params = dict(workflow=workflow, prompt='warm up', img_width=64, img_height=64, step=1)
+        if model is not None:
+            params['model'] = model
+        prompt = build_prompt(AIImageServer.QueueRequest(**params))
+        return strip_output_nodes(prompt) if prompt is not None else None
+
     def setup_routes(self):
         """设置API路由"""
 
@@ -403,11 +937,59 @@ class AIImageServer:
                 "model_types": model_types
             }
 
+        @self.app.get("/api/workflows/{key}/models")
+        async def workflow_model_list(key: str, request: Request):
+            """获取工作流可用的模型（服务端按关键字过滤）"""
+            if len(wf.workflow_list) == 0:
+                wf.load_workflows()
+            if key not in wf.workflow_list:
+                raise HTTPException(status_code=404, detail=f"workflow {key} not found")
+            # 校验目录修改时间、重新扫描会访问磁盘（可能是网络存储），不在事件循环中执行
+            models, etag = await asyncio.to_thread(model_catalog.get_for_workflow, wf.workflow_list[key])
+            return _etag_response(request, {
+                "models": [m['name'] for m in models],
+                "files": models,
+            }, etag)
+
         @self.app.get("/api/models/{model_type}")
-        async def model_list(model_type: str):
-            files = folder_paths.get_filename_list(model_type)
+        async def model_list(model_type: str, request: Request, with_hash: int = 0, full_hash: int = 0):
+            """
+            获取模型列表
+
+            with_hash=1 时附带已经计算好的采样指纹（未计算的在后台计算，之后ETag会改变），
+            full_hash=1 时另外在后台计算完整sha256
+            """
+            models, etag = await asyncio.to_thread(model_catalog.get, model_type)
+            if with_hash:
+                fingerprints = await asyncio.to_thread(model_fingerprints.get_fingerprints, model_type,
+                                                       [m['name'] for m in models], bool(full_hash))
+                models = [dict(m, **fingerprints.get(m['name'], {})) for m in models]
+                etag = make_etag(etag, [fingerprints.get(m['name']) for m in models])
+            return _etag_response(request, {
+                "models": [m['name'] for m in models],
+                "files": models,
+            }, etag)
+
+        @self.app.get("/api/search/similar")
+        async def search_similar_files(phash: str, max_distance: int = Query(6, ge=0, le=16),
+                                       limit: int = Query(10, ge=1, le=100)):
+            """
+            按感知哈希（64位 dHash，16位十六进制）查找相似的输入图像，
+            客户端可以直接使用已有的图像，不需要重新上传
+            """
+            try:
+                int(phash, 16)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="phash 格式错误")
+            if len(phash) != 16:
+                raise HTTPException(status_code=400, detail="phash 格式错误")
+            matches = await asyncio.to_thread(self.phash_index.search, phash, max_distance, limit)
+            if len(matches) == 0:
+                raise HTTPException(status_code=404, detail="文件未找到")
             return {
-                "models": files
+                'file_name': matches[0][1],
+                'distance': matches[0][0],
+                'matches': [{'file_name': name, 'distance': d} for d, name in matches],
             }
 
         @self.app.get("/api/search/{file_hash}")
@@ -439,6 +1021,11 @@ class AIImageServer:
                 # 保存文件
                 with open(file_location, "wb") as buffer:
                     shutil.copyfileobj(file.file, buffer)
+                # 计算感知哈希，用于相似图像查询
+                phash = await asyncio.to_thread(self.phash_index.add_file, file_location)
+                # 在后台规范化，生成时不再解码、缩小原图
+                input_normalizer.submit(os.path.relpath(file_location, _input_dir).replace(os.sep, '/'),
+                                        get_normalize_megapixels())
 
                 # 返回响应
                 return JSONResponse({
@@ -447,6 +1034,7 @@ class AIImageServer:
                     "filename": file.filename,
                     "file_url": f"/uploads/{file.filename}",
                     "file_size": os.path.getsize(file_location),
+                    "phash": phash,
                     "uploaded_at": datetime.now().isoformat()
                 })
             except Exception as e:
@@ -455,36 +1043,335 @@ class AIImageServer:
                     status_code=500
                 )
 
-        @self.app.post("/api/enqueue")
-        async def enqueue(request: AIImageServer.QueueRequest):
-            """ 提交并入列 """
+        def find_output_request_ids():
+            """一次列出今天的输出目录，返回已有结果的请求ID"""
+            func = common_functions['get_today_output_directory']
+            request_ids = set()
+            for f in Path(func()).glob("*_*_*_*.*"):
+                if f.name.endswith("[-1].png"):
+                    continue
+                if f.name.endswith(".png") or f.name.endswith(".mp4"):
+                    parts = f.name.split('_')
+                    if len(parts) >= 5:
+                        request_ids.add(parts[-2])
+            return request_ids
+
+        def has_output(request_id, existing_request_ids=None):
+            if existing_request_ids is None:
+                _files, is_video = find_output_file(request_id)
+                return len(_files) > 0
+            return any(x in existing_request_ids or len(result_index.get_files(x)) > 0
+                       for x in request_aliases.resolve(request_id))
+
+        queue_snapshot = {'time': None, 'queue': None}
+        queue_snapshot_lock = threading.Lock()
+
+        def get_queue_snapshot(refresh=False):
+            """ComfyUI的队列，eta_queue_cache_seconds 内复用，避免每次查询状态都请求ComfyUI"""
+            with queue_snapshot_lock:
+                now = time.monotonic()
+                if refresh or queue_snapshot['time'] is None or \
+                        now - queue_snapshot['time'] >= get_config('eta_queue_cache_seconds'):
+                    queue_snapshot['queue'] = get_queue()
+                    queue_snapshot['time'] = now
+                    running_ids = {item[1] for item in queue_snapshot['queue'].get('queue_running', [])}
+                    for running_id in running_ids:
+                        self.eta_started.setdefault(running_id, now)
+                    for started_id in list(self.eta_started):
+                        if started_id not in running_ids:
+                            self.eta_started.pop(started_id, None)
+                return queue_snapshot['queue']
+
+        def invalidate_queue_snapshot():
+            """完成任务后队列已经变化"""
+            with queue_snapshot_lock:
+                queue_snapshot['time'] = None
+
+        def add_to_queue_snapshot(prompt_id):
+            """
+            提交任务后在本地更新缓存的队列，不用重新获取：
+            已提交到ComfyUI的任务加到排队的末尾，还在调度器中的任务由 get_queue_order 从调度器取得
+            """
+            if self.scheduler.is_pending(prompt_id):
+                return
+            with queue_snapshot_lock:
+                queue = queue_snapshot['queue']
+                if queue is None:
+                    return
+                items = queue.get('queue_running', []) + queue.get('queue_pending', [])
+                if any(item[1] == prompt_id for item in items):
+                    return
+                number = max((item[0] for item in items), default=0) + 1
+                queue.setdefault('queue_pending', []).append([number, prompt_id])
+
+        def predict_duration_ms(prompt_id):
+            request = self.running_request.get(prompt_id)
+            features = self.eta_features.get(prompt_id)
+            if request is not None and features is not None:
+                duration = self.eta_model.predict(request.workflow, features)
+                if duration is not None:
+                    return duration
+            return self.eta_model.default_ms()
+
+        def get_queue_order(prompt_ids=()):
+            """
+            执行顺序：ComfyUI中执行和排队的任务，然后是调度器中等待的任务
+
+            prompt_ids: 需要包含的任务，有不在缓存的队列中的任务时重新获取一次
+            """
+            for refresh in (False, True):
+                queue = get_queue_snapshot(refresh)
+                running = [item[1] for item in queue.get('queue_running', [])]
+                pending = [item[1] for item in sorted(queue.get('queue_pending', []), key=lambda x: x[0])]
+                order = running + pending
+                order += [x for x in self.scheduler.pending_ids() if x not in order]
+                if all(x in order for x in prompt_ids):
+                    break
+            return order
+
+        def get_remaining_ms(prompt_id, now):
+            """任务的预计剩余执行时间"""
+            duration = predict_duration_ms(prompt_id)
+            if prompt_id in self.eta_started:
+                duration = max(0.0, duration - (now - self.eta_started[prompt_id]) * 1000)
+            return duration
+
+        def predict_queue_wait_ms():
+            """新任务的预计等待时间：队列中所有任务的预计剩余执行时间之和"""
+            now = time.monotonic()
+            return sum(get_remaining_ms(x, now) for x in get_queue_order())
+
+        def estimate_etas(prompt_ids):
+            """
+            预计完成时间：前面的任务（ComfyUI中执行和排队的、调度器中等待的）加上本任务的预计执行时间，
+            多个任务（批量提交）使用同一个队列
+
+            返回值:
+                dict: prompt_id -> {'queue_position': 前面的任务数, 'eta_ms': 预计多少毫秒后完成}，不包含不在队列中的任务
+            """
+            prompt_ids = {x for x in prompt_ids if x is not None}
+            if len(prompt_ids) == 0:
+                return {}
+            try:
+                order = get_queue_order(prompt_ids)
+            except Exception as e:
+                print(f"获取ComfyUI队列失败：{e}")
+                return {}
+            now = time.monotonic()
+            eta_ms = 0.0
+            results = {}
+            for position, _prompt_id in enumerate(order):
+                eta_ms += get_remaining_ms(_prompt_id, now)
+                if _prompt_id in prompt_ids:
+                    results[_prompt_id] = {'queue_position': position, 'eta_ms': int(eta_ms)}
+                    if len(results) == len(prompt_ids):
+                        break
+            return results
+
+        def estimate_eta(prompt_id):
+            """单个任务的预计完成时间，不在队列中时为空"""
+            return estimate_etas([prompt_id]).get(prompt_id, {})
+
+        def degrade_for_load(request):
+            """
+            预计等待时间超过 slo_max_wait_seconds 时按工作流设置的范围降低请求质量
+
+            返回值:
+                (降低后的请求, 降低说明)，不需要或不能降低时返回None
+            """
+            if not get_config('slo_enabled'):
+                return None
+            max_wait_ms = get_config('slo_max_wait_seconds') * 1000
+            try:
+                wait_ms = predict_queue_wait_ms()
+            except Exception as e:
+                print(f"获取ComfyUI队列失败：{e}")
+                return None
+            if wait_ms <= max_wait_ms:
+                return None
+            wf.load_workflows()
+            canonical = wf.canonicalize_params(request.workflow, **get_workflow_params(request))
+            if canonical is None:
+                return None
+            updates, changes = plan_degradation(request.workflow, wf.workflow_list, canonical,
+                                                wait_ms / max_wait_ms, self.eta_model.predict)
+            if len(updates) == 0:
+                return None
+            degraded = request.model_copy(update={**updates, 'allow_degrade': False})
+            return degraded, {
+                'queue_wait_ms': int(wait_ms),
+                'max_wait_ms': int(max_wait_ms),
+                'changes': changes,
+            }
+
+        def estimate_upscale_eta(prompt_id):
+            """等待基础图像的放大任务的预计完成时间：基础图像的预计完成时间加上本任务的预计执行时间"""
+            eta = estimate_eta(self.upscale_bases.get(prompt_id))
+            if 'eta_ms' in eta:
+                eta['eta_ms'] += int(predict_duration_ms(prompt_id))
+            return eta
+
+        def enqueue_upscale_chain(request, prompt_id, base_request, existing_request_ids=None):
+            """
+            基础图像还没有生成的放大请求：先提交基础图像（已在队列中时等待它），
+            基础图像完成后由后台线程提交只执行放大阶段的任务，基础图像可以先下载
+
+            返回值:
+                dict: 响应，基础图像不能提交时返回None（执行完整的放大工作流）
+            """
+            base_result = enqueue_request(base_request.model_copy(update={'allow_degrade': False}),
+                                          existing_request_ids)
+            if base_result['status'] not in ('queued', 'conflict'):
+                return None
+            base_prompt_id = base_result['prompt_id']
+            with self.status_lock:
+                self.running_request[prompt_id] = request
+                self.cancelled_prompts.pop(prompt_id, None)
+                self.upscale_bases[prompt_id] = base_prompt_id
+                self.eta_features[prompt_id] = get_request_eta_features(request)
+            self.job_watcher.watch(prompt_id, submit_upscale_stage)
+            return {
+                "prompt_id": prompt_id,
+                "code": http.client.OK,
+                "message": "OK",
+                "status": 'queued',
+                "parameters": request.model_dump(),
+                "utc_timestamp": f"{_get_datetime_now_utc()}",
+                "base_prompt_id": base_prompt_id,
+                **estimate_upscale_eta(prompt_id),
+            }
+
+        def submit_upscale_stage(prompt_id):
+            """
+            后台线程：基础图像完成（结果已转移）后提交只执行放大阶段的任务，基础图像失败时放大任务也失败
+
+            返回值:
+                bool: 是否结束监视
+            """
+            with self.status_lock:
+                request = self.running_request.get(prompt_id)
+                base_prompt_id = self.upscale_bases.get(prompt_id)
+                if request is None or base_prompt_id is None:
+                    # 已取消
+                    return True
+                base_result = get_job_status(base_prompt_id)
+                if base_result['status'] in (JobStatus.PENDING, JobStatus.IN_PROGRESS):
+                    return False
+                error_msg = None
+                if base_result['status'] == JobStatus.COMPLETED:
+                    error_msg = submit_upscale_job(prompt_id, request, base_prompt_id)
+                else:
+                    error_msg = f"base image {base_result['status']}: {base_result.get('message')}"
+                self.upscale_bases.pop(prompt_id, None)
+                if error_msg is not None:
+                    self.chain_errors[prompt_id] = error_msg
+                return True
+
+        def submit_upscale_job(prompt_id, request, base_prompt_id):
+            """
+            以已生成的基础图像提交只执行放大阶段的任务
+
+            返回值:
+                str: 失败原因，成功时返回None
+            """
+            base_files, _ = find_output_file(_get_request_id(base_prompt_id))
+            if len(base_files) == 0:
+                return "base image not found"
+            prompt_json = build_prompt(request, get_output_image_path(base_files[0]))
+            if prompt_json is None:
+                return f"workflow {request.workflow} build failed"
+            errors = self.validator.validate(prompt_json, folder_paths.get_input_directory())
+            if len(errors) > 0:
+                return "; ".join(errors)
+            job = ScheduledJob(prompt_id, prompt_json, self.client_id, request.workflow)
+            if not self.scheduler.schedule(job):
+                return "internal server error"
+            self.node_profiler.track(prompt_id, prompt_json, request.workflow, get_profile_bucket(request))
+            add_to_queue_snapshot(prompt_id)
+            logger.info(f"基础图像已完成，提交放大阶段：{prompt_id}")
+            return None
+
+        def check_request(request):
+            """
+            提交前检查请求与工作流是否匹配：工作流存在、不是分段生成、需要输入图像时有输入图像
+
+            返回值:
+                (status, code, message)，通过时返回None
+            """
+            wf.load_workflows()
+            workflow_info = wf.workflow_list.get(request.workflow)
+            if workflow_info is None or request.workflow not in wf.workflow_func_map:
+                return 'not_found', http.client.NOT_FOUND, f"workflow {request.workflow} not found"
+            if request.segmented:
+                # 没有能以上一段的尾帧作为起始图像的视频工作流（文生视频的模型没有图像输入）
+                return 'invalid', http.client.BAD_REQUEST, "segmented generation is not supported"
+            if workflow_info.get('inputType') == 'image' and all(x is None for x in request.images):
+                return 'invalid', http.client.BAD_REQUEST, f"workflow {request.workflow} requires input images"
+            return None
+
+        def check_degraded_request(request, degraded_request):
+            """
+            降低质量后的请求与正常提交做相同的检查（改用的工作流可能不接受原请求的分段、输入图像等），
+            并生成工作流在本地预检
+
+            返回值:
+                str: 不能使用的原因，可以使用时返回None
+            """
+            error = check_request(degraded_request)
+            if error is not None:
+                return error[2]
+            input_type = wf.workflow_list[request.workflow].get('inputType')
+            if wf.workflow_list[degraded_request.workflow].get('inputType') != input_type:
+                return f"workflow {degraded_request.workflow} does not take {input_type} input"
+            prompt_json = build_prompt(degraded_request)
+            if prompt_json is None:
+                return f"workflow {degraded_request.workflow} build failed"
+            errors = self.validator.validate(prompt_json, folder_paths.get_input_directory())
+            if len(errors) > 0:
+                return "; ".join(errors)
+            return None
+
+        def enqueue_request(request: AIImageServer.QueueRequest, existing_request_ids=None, with_eta=True):
+            """
+            生成工作流并交给调度器
+
+            Args:
+                request: 请求参数
+                existing_request_ids: 已有结果的请求ID集合，为None时查找输出目录
+                with_eta: 响应中是否包含预计完成时间（批量提交时全部提交后一起计算）
+
+            返回值:
+                dict: 响应，status 为 cached / conflict / queued / invalid / not_found / error
+            """
             # 创建参数ID
-            prompt_id = generate_prompt_id(
-                request.workflow,
-                request.model,
-                request.prompt,
-                request.seed,
-                request.img_width,
-                request.img_height,
-                request.upscale_factor,
-                request.step,
-                request.cfg,
-                request.seconds,
-                request.megapixels,
-                request.images[0],
-                request.images[1],
-                request.images[2],
-            )
+            prompt_id = get_request_prompt_id(request)
             # 通过参数ID获取请求ID
             request_id = _get_request_id(prompt_id)
-            # 查找图像文件
-            _files, is_video = find_output_file(request_id)
-            if _files and len(_files) > 0:
+            error = check_request(request)
+            if error is not None:
+                status, code, message = error
+                return {
+                    "prompt_id": prompt_id,
+                    "code": code,
+                    "message": message,
+                    "status": status,
+                    "parameters": request.model_dump(),
+                    "utc_timestamp": f"{_get_datetime_now_utc()}",
+                }
+            # 查找图像文件（包括按旧参数ID生成的结果）
+            file_exists = has_output(request_id, existing_request_ids)
+            if not file_exists:
+                legacy_request_id = _get_request_id(get_legacy_prompt_id(request))
+                if legacy_request_id != request_id and has_output(legacy_request_id, existing_request_ids):
+                    request_aliases.add(request_id, legacy_request_id)
+                    file_exists = True
+            if file_exists:
                 self.running_request[prompt_id] = request
                 return {
                     "prompt_id": prompt_id,
                     "code": http.client.OK,
                     "message": 'success',
+                    "status": 'cached',
                     "parameters": request.model_dump(),
                     "utc_timestamp": f"{_get_datetime_now_utc()}",
                     "file_exists": True,
@@ -495,98 +1382,431 @@ class AIImageServer:
                     "prompt_id": prompt_id,
                     "code": http.client.CONFLICT,
                     "message": f"request is already in queue.",
+                    "status": 'conflict',
                     "parameters": request.model_dump(),
                     "utc_timestamp": f"{_get_datetime_now_utc()}",
                 }
 
+            # 负载过高时，允许降低质量的请求改用较少的步数、较低的分辨率、不放大或更快的工作流
+            if request.allow_degrade:
+                degraded = degrade_for_load(request)
+                if degraded is not None:
+                    degraded_request, degradation = degraded
+                    error_msg = check_degraded_request(request, degraded_request)
+                    if error_msg is None:
+                        result = enqueue_request(degraded_request, existing_request_ids, with_eta)
+                        result['degradation'] = degradation
+                        return result
+                    logger.info(f"降低质量后的请求无效，按原请求提交：{error_msg}")
+
             self.prompt_id = prompt_id
 
+            # 放大请求：相同参数的基础图像已经生成时只执行放大阶段，基础图像可以先下载
+            base_prompt_id = None
+            base_image = None
+            if wf.has_upscale_stage(request.workflow, **get_workflow_params(request)):
+                base_request = get_base_request(request)
+                _base_prompt_id = get_request_prompt_id(base_request)
+                base_files, _ = find_output_file(_get_request_id(_base_prompt_id))
+                if len(base_files) > 0:
+                    base_prompt_id = _base_prompt_id
+                    base_image = get_output_image_path(base_files[0])
+                elif get_config('upscale_chain_enabled'):
+                    result = enqueue_upscale_chain(request, prompt_id, base_request, existing_request_ids)
+                    if result is not None:
+                        return result
+
             # 准备提示词
-            if len(wf.workflow_func_map) == 0:
-                wf.load_workflows()
-            workflow_prompt_func = wf.workflow_func_map[request.workflow]
-            if workflow_prompt_func is None:
-                return {
-                    "prompt_id": self.prompt_id,
-                    "code": http.client.NOT_FOUND,
-                    "message": f"workflow {request.workflow} not found",
-                    "parameters": request.model_dump(),
-                    "utc_timestamp": f"{_get_datetime_now_utc()}",
-                }
+            prompt_json = build_prompt(request, base_image)
 
-            prompt_json = workflow_prompt_func(
-                model=request.model,
-                prompt_p=request.prompt,
-                seed=request.seed,
-                width=request.img_width,
-                height=request.img_height,
-                step=request.step,
-                cfg=request.cfg,
-                upscale_factor=request.upscale_factor,
-                seconds=request.seconds,
-                megapixels=request.megapixels,
-                image1=request.images[0],
-                image2=request.images[1],
-                image3=request.images[2],
-            )
+            # 提交前在本地校验，避免无效任务占用ComfyUI队列
+            if prompt_json is not None:
+                errors = self.validator.validate(prompt_json, folder_paths.get_input_directory())
+                if len(errors) > 0:
+                    return {
+                        "prompt_id": prompt_id,
+                        "code": http.client.BAD_REQUEST,
+                        "message": "; ".join(errors),
+                        "status": 'invalid',
+                        "errors": errors,
+                        "parameters": request.model_dump(),
+                        "utc_timestamp": f"{_get_datetime_now_utc()}",
+                    }
 
-            # 通过 HTTP 提交任务
-            response = queue_prompt(prompt_json, self.client_id, prompt_id)
-            if response is not None:
-                if response.code == 200:
-                    self.running_request[prompt_id] = request
-                # response_body = response.read()
-                return {
-                    "prompt_id": self.prompt_id,
-                    "code": response.code,
-                    "message": response.msg,
+            # 交给调度器，按模型亲和提交到ComfyUI
+            job = ScheduledJob(prompt_id, prompt_json, self.client_id, request.workflow) if prompt_json else None
+            if job is not None:
+                self.prewarmer.on_enqueue(request.workflow, request.model, job.model_key)
+            if job is not None and self.scheduler.schedule(job):
+                self.running_request[prompt_id] = request
+                self.cancelled_prompts.pop(prompt_id, None)
+                self.node_profiler.track(prompt_id, prompt_json, request.workflow, get_profile_bucket(request))
+                if len(self.eta_features) > 1000:
+                    # 失败、取消的任务不会更新模型，清理掉
+                    for _prompt_id in [x for x in self.eta_features if x not in self.running_request]:
+                        self.eta_features.pop(_prompt_id, None)
+                self.eta_features[prompt_id] = get_request_eta_features(request)
+                add_to_queue_snapshot(prompt_id)
+                result = {
+                    "prompt_id": prompt_id,
+                    "code": http.client.OK,
+                    "message": "OK",
+                    "status": 'queued',
                     "parameters": request.model_dump(),
                     "utc_timestamp": f"{_get_datetime_now_utc()}",
+                    **(estimate_eta(prompt_id) if with_eta else {}),
                 }
+                if base_prompt_id is not None:
+                    result["base_prompt_id"] = base_prompt_id
+                return result
 
             return {
-                "prompt_id": self.prompt_id,
+                "prompt_id": prompt_id,
                 "code": http.client.INTERNAL_SERVER_ERROR,
                 "message": f"internal server error",
+                "status": 'error',
                 "parameters": request.model_dump(),
                 "utc_timestamp": f"{_get_datetime_now_utc()}",
             }
 
+        @self.app.post("/api/enqueue")
+        async def enqueue(request: AIImageServer.QueueRequest):
+            """ 提交并入列 """
+            return await asyncio.to_thread(enqueue_locked, request)
+
+        @self.app.post("/api/enqueue/batch")
+        async def enqueue_batch(batch: AIImageServer.BatchQueueRequest):
+            """
+            批量提交：请求列表或参数扫描（sweep 的 fields 做笛卡尔积，覆盖 base 中的同名参数）
+            """
+            from pydantic import ValidationError
+            entries = list(batch.requests or [])
+            total = len(entries)
+            if batch.sweep is not None:
+                names = list(batch.sweep.fields.keys())
+                total += math.prod(len(batch.sweep.fields[n]) for n in names)
+            max_items = get_config('batch_max_items')
+            if total > max_items:
+                raise HTTPException(status_code=413, detail=f"too many items (max {max_items})")
+
+            if batch.sweep is not None:
+                for values in itertools.product(*[batch.sweep.fields[n] for n in names]):
+                    params = dict(batch.sweep.base)
+                    params.update(zip(names, values))
+                    try:
+                        entries.append(AIImageServer.QueueRequest(**params))
+                    except ValidationError as e:
+                        entries.append({
+                            "prompt_id": None,
+                            "code": http.client.BAD_REQUEST,
+                            "message": str(e),
+                            "status": 'invalid',
+                            "parameters": params,
+                        })
+
+            def enqueue_entries():
+                items = []
+                existing_request_ids = find_output_request_ids()
+                for entry in entries:
+                    if isinstance(entry, dict):
+                        items.append(entry)
+                        continue
+                    result = enqueue_locked(entry, existing_request_ids, with_eta=False)
+                    result.pop('utc_timestamp', None)
+                    items.append(result)
+                return items
+
+            items = await asyncio.to_thread(enqueue_entries)
+
+            # 全部提交后按同一个队列计算预计完成时间
+            etas = estimate_etas([item['prompt_id'] for item in items
+                                  if item['status'] == 'queued' and 'eta_ms' not in item])
+            for item in items:
+                if item['status'] == 'queued' and 'eta_ms' not in item:
+                    item.update(etas.get(item['prompt_id'], {}))
+
+            counts = {}
+            for item in items:
+                counts[item['status']] = counts.get(item['status'], 0) + 1
+            return {
+                "code": http.client.OK,
+                "prompt_ids": [item['prompt_id'] for item in items],
+                "items": items,
+                "counts": counts,
+                "utc_timestamp": f"{_get_datetime_now_utc()}",
+            }
+
+        def enqueue_locked(request, existing_request_ids=None, with_eta=True):
+            """
+            在线程池中提交（等待输入图像规范化、请求ComfyUI不阻塞事件循环）
+
+            先在锁外等待输入图像规范化完成，锁内生成工作流时不再等待；提交过程加锁，同时提交的相同请求不会重复入列
+            """
+            resolve_input_images(request)
+            with self.enqueue_lock:
+                return enqueue_request(request, existing_request_ids, with_eta)
+
+        def cleanup_cancelled(prompt_id):
+            """等待被中断的任务结束，删除它已经写出的文件和ComfyUI中的历史"""
+            deadline = time.monotonic() + get_config('cancel_cleanup_timeout')
+            while time.monotonic() < deadline:
+                try:
+                    job = get_jobs(prompt_id)
+                except Exception as e:
+                    print(f"获取被取消的任务失败：{prompt_id} {e}")
+                    return
+                if _get_job_status(job) not in (JobStatus.PENDING, JobStatus.IN_PROGRESS):
+                    for path in _remove_job_outputs(job):
+                        logger.info(f"已删除被取消任务的输出: {path}")
+                    try:
+                        delete_history([prompt_id])
+                    except Exception as e:
+                        print(f"删除被取消任务的历史失败：{prompt_id} {e}")
+                    return
+                time.sleep(1)
+            print(f"等待被取消的任务结束超时：{prompt_id}")
+
+        def cancel_prompts(prompt_ids):
+            """
+            按 prompt_id 取消任务
+
+            还在调度器中的任务直接移除；已提交到ComfyUI还没开始执行的从ComfyUI队列中删除；
+            正在执行的只中断该任务本身，结束后清理已写出的文件。
+
+            返回值:
+                list: 每个任务的结果，status 为 removed / interrupted / completed / not_found / error
+            """
+            results = {}
+            remaining = []
+            for prompt_id in prompt_ids:
+                # 等待基础图像的放大任务（基础图像是独立的结果，继续生成）
+                with self.status_lock:
+                    if self.upscale_bases.pop(prompt_id, None) is not None:
+                        self.job_watcher.unwatch(prompt_id)
+                        results[prompt_id] = 'removed'
+                        continue
+                if self.scheduler.remove(prompt_id) is not None:
+                    results[prompt_id] = 'removed'
+                    continue
+                # 调度器正在提交该任务，等提交完成后从ComfyUI队列中删除
+                for _ in range(20):
+                    if not self.scheduler.is_pending(prompt_id):
+                        break
+                    time.sleep(0.1)
+                remaining.append(prompt_id)
+
+            if len(remaining) > 0:
+                try:
+                    queue = get_queue()
+                    running_ids = {item[1] for item in queue.get('queue_running', [])}
+                    pending_ids = {item[1] for item in queue.get('queue_pending', [])}
+                    to_delete = [x for x in remaining if x in pending_ids]
+                    if len(to_delete) > 0:
+                        delete_queued_prompts(to_delete)
+                    for prompt_id in remaining:
+                        if prompt_id in pending_ids:
+                            results[prompt_id] = 'removed'
+                        elif prompt_id in running_ids:
+                            interrupt_prompt(prompt_id)
+                            threading.Thread(target=cleanup_cancelled, args=(prompt_id,),
+                                             name='Cancel-Cleanup-Thread', daemon=True).start()
+                            results[prompt_id] = 'interrupted'
+                        elif prompt_id in self.running_request:
+                            # 已经执行完，结果还没有转移到输出目录
+                            results[prompt_id] = 'completed'
+                        else:
+                            _files, _ = find_output_file(_get_request_id(prompt_id))
+                            results[prompt_id] = 'completed' if len(_files) > 0 else 'not_found'
+                except Exception as e:
+                    print(f"取消任务失败：{e}")
+                    for prompt_id in remaining:
+                        results.setdefault(prompt_id, 'error')
+
+            items = []
+            for prompt_id in prompt_ids:
+                status = results[prompt_id]
+                if status in ('removed', 'interrupted'):
+                    self.job_watcher.unwatch(prompt_id)
+                    with self.status_lock:
+                        self.running_request.pop(prompt_id, None)
+                        self.chain_errors.pop(prompt_id, None)
+                    self.cancelled_prompts[prompt_id] = _get_datetime_now_utc()
+                items.append({"prompt_id": prompt_id, "status": status})
+            # 只保留最近的取消记录
+            for prompt_id in list(self.cancelled_prompts)[:-1000]:
+                del self.cancelled_prompts[prompt_id]
+            return items
+
+        @self.app.post("/api/cancel")
+        async def cancel(request: AIImageServer.CancelRequest):
+            """
+            取消任务：指定 prompt_ids，或取消 client_id 提交的全部未完成任务
+            """
+            prompt_ids = list(request.prompt_ids or [])
+            if request.client_id is not None:
+                prompt_ids.extend(x for x, r in list(self.running_request.items())
+                                  if r.client_id == request.client_id and x not in prompt_ids)
+            items = await asyncio.to_thread(cancel_prompts, prompt_ids)
+            counts = {}
+            for item in items:
+                counts[item['status']] = counts.get(item['status'], 0) + 1
+            return {
+                "code": http.client.OK,
+                "items": items,
+                "counts": counts,
+                "utc_timestamp": f"{_get_datetime_now_utc()}",
+            }
+
         @self.app.post("/api/interrupt")
         async def interrupt(request: AIImageServer.InterruptRequest):
-            data = json.dumps(request.model_dump()).encode('utf-8')
-            req = urllib.request.Request(f"http://{server_address}/interrupt", data=data)
-            with urllib.request.urlopen(req) as response:
-                if response.code == 200 and request.prompt_id in self.running_request:
-                    self.running_request.pop(request.prompt_id)
+            if request.prompt_id is not None:
+                # 只取消指定的任务，不影响其他人正在执行的任务
+                items = await asyncio.to_thread(cancel_prompts, [request.prompt_id])
                 return {
-                    "status_code": response.code,
-                    "message": response.msg,
+                    "status_code": 200,
+                    "message": items[0]['status'],
                     "prompt_id": request.prompt_id,
+                    "status": items[0]['status'],
                 }
+            await asyncio.to_thread(interrupt_prompt, None)
+            return {
+                "status_code": 200,
+                "message": "OK",
+                "prompt_id": request.prompt_id,
+            }
 
         def find_output_file(request_id: str):
-            # 查找图像文件
+            """
+            查找请求的全部输出文件（按输出顺序），先查结果索引，没有记录时查找今天的输出目录
+
+            返回值:
+                (files, is_video)
+            """
             func = common_functions['get_today_output_directory']
-            files = list(Path(func()).glob(f"*_{request_id}_*.*"))
-            found_files = []
-            is_video = False
-            for f in files:
-                if f.name.endswith("[-1].png"):
-                    continue
-                if f.name.endswith(".png") or f.name.endswith(".mp4"):
-                    found_files.append(f)
-                    is_video = f.name.endswith(".mp4")
-                    break
+            for _request_id in request_aliases.resolve(request_id):
+                indexed_files = result_index.get_files(_request_id)
+                if len(indexed_files) > 0:
+                    found_files = [Path(file_path) for file_path, _ in indexed_files]
+                    return found_files, found_files[0].name.endswith(".mp4")
+
+                found_files = []
+                for f in sorted(Path(func()).glob(f"*_{_request_id}_*.*"), key=lambda x: x.name):
+                    if f.name.endswith("[-1].png"):
+                        continue
+                    if f.name.endswith(".png") or f.name.endswith(".mp4"):
+                        found_files.append(f)
+                if len(found_files) > 0:
+                    return found_files, found_files[0].name.endswith(".mp4")
+
+            return [], False
+
+        def describe_output_files(prompt_id, files):
+            """输出文件列表（含大小），客户端可以按 index 单独下载"""
+            items = []
+            for i, f in enumerate(files):
+                items.append({
+                    "index": i,
+                    "name": f.name,
+                    "size": f.stat().st_size,
+                    "media_type": get_media_type(f.name),
+                    "url": f"/api/download/{prompt_id}?index={i}",
+                })
+            return items
+
+        def describe_result(entry):
+            """结果索引中的记录转换为列表项（不访问文件系统）"""
+            prompt_id = entry['prompt_id']
+            parameters = entry.get('parameters') or {}
+            files = []
+            for i, item in enumerate(entry['files']):
+                files.append({
+                    "index": i,
+                    "name": item['name'],
+                    "size": item['size'],
+                    "width": item.get('width'),
+                    "height": item.get('height'),
+                    "media_type": item['media_type'],
+                    "url": f"/api/download/{prompt_id}?index={i}",
+                    "thumbnail_url": f"/api/thumbnail/{prompt_id}?index={i}",
+                })
+            return {
+                "prompt_id": prompt_id,
+                "request_id": entry['request_id'],
+                "workflow": entry.get('workflow'),
+                "media_type": entry.get('media_type'),
+                "created": entry.get('created'),
+                "seed": parameters.get('seed'),
+                "prompt": parameters.get('prompt'),
+                "parameters": parameters,
+                "files": files,
+                "thumbnail_url": f"/api/thumbnail/{prompt_id}",
+            }
+
+        @self.app.get("/api/results")
+        async def list_results(cursor: Optional[int] = None, limit: int = Query(50, ge=1, le=200),
+                               workflow: Optional[str] = None, media: Optional[str] = None):
+            """
+            结果列表（按时间从新到旧），用返回的 next_cursor 获取下一页
+
+            media: image / video
+            """
+            entries, next_cursor = result_index.page(cursor, limit, workflow, media)
+            return {
+                "code": http.client.OK,
+                "items": [describe_result(entry) for entry in entries],
+                "next_cursor": next_cursor,
+                "utc_timestamp": f"{_get_datetime_now_utc()}",
+            }
+
+        @self.app.get("/api/thumbnail/{prompt_id}")
+        async def get_thumbnail(prompt_id: str, index: int = 0, size: int = Query(256, ge=64, le=1024)):
+            """
+            结果的缩略图（视频使用尾帧图像），生成后缓存在磁盘上
+            """
+            from fastapi.responses import FileResponse
+
+            request_id = _get_request_id(prompt_id)
+            output_files, _ = find_output_file(request_id)
+            if index < 0 or index >= len(output_files):
+                raise HTTPException(status_code=404, detail="文件未找到")
+            source = output_files[index]
+            if source.name.endswith(".mp4"):
+                source = source.with_name(source.stem + "_[-1].png")
+                if not source.is_file():
+                    raise HTTPException(status_code=404, detail="没有可用的视频帧")
+            thumbnail = os.path.join(_thumbnail_dir, f"{source.stem}_{size}.jpg")
+            try:
+                await asyncio.to_thread(make_thumbnail, source, thumbnail, size)
+            except Exception as e:
+                logger.error(f"缩略图生成失败：{source} {e}")
+                raise HTTPException(status_code=500, detail="缩略图生成失败")
+            return FileResponse(path=thumbnail, media_type="image/jpeg")
 
-            return found_files, is_video
+        @self.app.get("/api/results/{prompt_id}")
+        async def get_result_files(prompt_id: str):
+            """
+            列出请求的全部输出文件
+            """
+            output_files, is_video = find_output_file(_get_request_id(prompt_id))
+            if not output_files:
+                raise HTTPException(status_code=404, detail="文件未找到")
+            return {
+                "prompt_id": prompt_id,
+                "code": http.client.OK,
+                "media_type": "video/mp4" if is_video else "image/png",
+                "files": describe_output_files(prompt_id, output_files),
+                "total_size": sum(f.stat().st_size for f in output_files),
+                "utc_timestamp": f"{_get_datetime_now_utc()}",
+            }
 
         @self.app.get("/api/download/{prompt_id}")
-        async def _download(prompt_id: str):
+        async def _download(prompt_id: str, index: int = 0, download_all: int = Query(0, alias='all')):
             """
             获取生成的图像
+
+            index: 下载第几个输出文件；all=1: 以zip流的形式下载全部输出文件
             """
-            from fastapi.responses import FileResponse
+            from fastapi.responses import FileResponse, StreamingResponse
 
             request_id = _get_request_id(prompt_id)
             # 查找图像文件
@@ -595,22 +1815,45 @@ class AIImageServer:
             if not output_files:
                 raise HTTPException(status_code=404, detail="文件未找到")
 
-            output_file = output_files[0]
+            if download_all:
+                return StreamingResponse(
+                    iter_zip_files(output_files),
+                    media_type="application/zip",
+                    headers={"Content-Disposition": f'attachment; filename="{request_id}.zip"'},
+                )
+
+            if index < 0 or index >= len(output_files):
+                raise HTTPException(status_code=404, detail="文件未找到")
+            output_file = output_files[index]
             file_name = os.path.basename(output_file)
             return FileResponse(
                 path=output_file,
-                media_type="video/mp4" if is_video else "image/png",
+                media_type=get_media_type(file_name),
                 filename=file_name
             )
 
-        @self.app.get("/api/jobs/{prompt_id}")
-        async def get_jobs_status(prompt_id: str):
+        def get_job_status(prompt_id: str):
             """
-            检查生成状态
+            检查生成状态，完成时把结果转移到输出目录
+
+            客户端和后台线程（JobWatcher）都会调用，加锁避免重复转移结果
             """
+            with self.status_lock:
+                return check_job_status(prompt_id)
+
+        def check_job_status(prompt_id: str):
 
             request_id = _get_request_id(prompt_id)
 
+            if prompt_id in self.cancelled_prompts and not prompt_id in self.running_request:
+                return {
+                    'prompt_id': prompt_id,
+                    'code': http.client.OK,
+                    'message': "cancelled",
+                    'status': JobStatus.CANCELLED,
+                    "utc_timestamp": f"{self.cancelled_prompts[prompt_id]}",
+                }
+
             if not prompt_id in self.running_request:
                 file_names, is_video = find_output_file(request_id)
                 if file_names is not None and len(file_names) > 0:
@@ -621,6 +1864,7 @@ class AIImageServer:
                         'status': JobStatus.COMPLETED,
                         'media_type': "video/mp4" if is_video else "image/png",
                         'filename': file_names[0].name,
+                        'files': describe_output_files(prompt_id, file_names),
                         "utc_timestamp": f"{_get_datetime_now_utc()}",
                     }
                 return {
@@ -633,6 +1877,41 @@ class AIImageServer:
 
             _request = self.running_request[prompt_id]
 
+            # 放大任务等待基础图像完成
+            if prompt_id in self.upscale_bases:
+                return {
+                    'prompt_id': prompt_id,
+                    'code': http.client.ACCEPTED,
+                    'message': "pending",
+                    'status': JobStatus.PENDING,
+                    "utc_timestamp": f"{_get_datetime_now_utc()}",
+                    "base_prompt_id": self.upscale_bases[prompt_id],
+                    **estimate_upscale_eta(prompt_id),
+                }
+
+            # 还在调度器中等待提交
+            if self.scheduler.is_pending(prompt_id):
+                return {
+                    'prompt_id': prompt_id,
+                    'code': http.client.ACCEPTED,
+                    'message': "pending",
+                    'status': JobStatus.PENDING,
+                    "utc_timestamp": f"{_get_datetime_now_utc()}",
+                    **estimate_eta(prompt_id),
+                }
+            error_msg = self.scheduler.pop_error(prompt_id)
+            if error_msg is None:
+                error_msg = self.chain_errors.pop(prompt_id, None)
+            if error_msg is not None:
+                self.running_request.pop(prompt_id)
+                return {
+                    'prompt_id': prompt_id,
+                    'code': http.client.EXPECTATION_FAILED,
+                    'message': error_msg,
+                    'status': JobStatus.FAILED,
+                    "utc_timestamp": f"{_get_datetime_now_utc()}",
+                }
+
             job = get_jobs(prompt_id)
             _status = _get_job_status(job)
             if _status == JobStatus.COMPLETED:
@@ -643,6 +1922,7 @@ class AIImageServer:
                     end_time = f"{job['execution_end_time']}"
                 filename = ''
                 filepath = ''
+                saved_files = []
                 is_video = _request.seconds > 0
                 if is_video:
                     # videos, _ = await get_output_video_from_history(prompt_id, history=history[prompt_id])
@@ -651,33 +1931,12 @@ class AIImageServer:
                         no = 0
                         for node_id in videos:
                             for video_data in videos[node_id]:
-                                # 转移视频
-                                ori_file = video_data['fullpath']
+                                # 转移视频和尾帧图像
                                 filename_no_ext = f'{datetime.now().strftime("%Y%m%d_%H%M%S")}_{_request.seed}_{request_id}_{no:05d}'
-                                filename = f'{filename_no_ext}.mp4'
                                 func = common_functions['get_today_output_directory']
-                                filepath = os.path.join(func(), filename)
-                                os.rename(ori_file, filepath)
+                                filepath, _ = _move_job_video(video_data['fullpath'], os.path.join(func(), filename_no_ext))
+                                saved_files.append(filepath)
                                 no += 1
-
-                                try:
-                                    # 转移尾帧图像
-                                    ori_file_without_ext = os.path.splitext(ori_file)[0]
-                                    last_frame = ori_file_without_ext + '_.png'
-                                    if os.path.exists(last_frame):
-                                        dest_last_frame = os.path.join(func(), filename_no_ext + '_[-1].png')
-                                        os.rename(last_frame, dest_last_frame)
-                                except Exception as e:
-                                    print(f"首帧图像清理失败：{e}")
-
-                                try:
-                                    # 清理自动生成的首帧图像
-                                    ori_file_without_ext = os.path.splitext(ori_file)[0]
-                                    first_frame = ori_file_without_ext + '.png'
-                                    if os.path.exists(first_frame):
-                                        os.remove(first_frame)
-                                except Exception as e:
-                                    print(f"首帧图像清理失败：{e}")
                 else:
                     # images, _ = await get_output_images_from_history(prompt_id, history=history[prompt_id])
                     images = _get_output_images_from_job(job)
@@ -696,17 +1955,23 @@ class AIImageServer:
 
                                 image.save(filepath, "PNG")
                                 logger.info(f"图像已保存: {filepath}")
+                                saved_files.append(filepath)
                                 no += 1
 
                 if os.path.exists(filepath) and os.path.isfile(filepath):
                     self.running_request.pop(prompt_id)
+                    result_index.add(request_id, prompt_id, saved_files, _request.workflow, _request.model_dump())
+                    self.learn_duration(prompt_id, _request.workflow, job)
+                    invalidate_queue_snapshot()
+                    self.history_pruner.add(prompt_id)
                     return {
                         'prompt_id': prompt_id,
                         'code': http.client.OK,
                         'message': f"OK",
                         'status': _status,
                         'media_type': "video/mp4" if is_video else "image/png",
-                        'filename': filename,
+                        'filename': os.path.basename(saved_files[0]),
+                        'files': describe_output_files(prompt_id, [Path(f) for f in saved_files]),
                         "utc_timestamp": end_time,
                     }
             elif _status == JobStatus.PENDING:
@@ -719,6 +1984,7 @@ class AIImageServer:
                     'message': "pending",
                     'status': _status,
                     "utc_timestamp": end_time,
+                    **estimate_eta(prompt_id),
                 }
             elif _status == JobStatus.FAILED:
                 end_time = f"{_get_datetime_now_utc()}"
@@ -741,6 +2007,56 @@ class AIImageServer:
                 'message': f"processing",
                 'status': _status,
                 "utc_timestamp": f"{_get_datetime_now_utc()}",
+                **estimate_eta(prompt_id),
+            }
+
+        @self.app.get("/api/jobs/{prompt_id}")
+        async def get_jobs_status(prompt_id: str, wait: float = Query(0, ge=0, le=60)):
+            """
+            检查生成状态
+
+            wait: 长轮询，任务还在等待或执行时最多等待的秒数，状态变化（开始执行、完成、失败）后立即返回
+
+            查询状态会请求ComfyUI、转移结果，在线程池中执行，不阻塞事件循环；
+            在ComfyUI进程中时由执行事件唤醒，否则每 jobs_long_poll_interval 秒检查一次
+            """
+            result = await asyncio.to_thread(get_job_status, prompt_id)
+            deadline = time.monotonic() + wait
+            status = result['status']
+            if status not in (JobStatus.PENDING, JobStatus.IN_PROGRESS) or wait <= 0:
+                return result
+            if comfy_bridge.is_available():
+                # 有执行事件时只需偶尔检查（调度器提交、放大阶段提交等没有事件）
+                interval = get_config('job_watch_interval')
+            else:
+                interval = get_config('jobs_long_poll_interval')
+            waiter = (asyncio.get_running_loop(), asyncio.Event())
+            with self.status_waiters_lock:
+                self.status_waiters.add(waiter)
+            try:
+                while time.monotonic() < deadline:
+                    try:
+                        await asyncio.wait_for(waiter[1].wait(), min(interval, max(0.0, deadline - time.monotonic())))
+                    except asyncio.TimeoutError:
+                        pass
+                    waiter[1].clear()
+                    result = await asyncio.to_thread(get_job_status, prompt_id)
+                    if result['status'] != status:
+                        break
+            finally:
+                with self.status_waiters_lock:
+                    self.status_waiters.discard(waiter)
+            return result
+
+        @self.app.get("/api/profile/workflows")
+        async def get_workflow_profile(workflow: Optional[str] = None):
+            """
+            各工作流的节点耗时统计（按模板结构和分辨率、步数、时长分组）
+            """
+            return {
+                "code": http.client.OK,
+                "items": self.node_profiler.summary(workflow),
+                "utc_timestamp": f"{_get_datetime_now_utc()}",
             }
 
         @self.app.get("/api/stats")
@@ -758,6 +2074,7 @@ class AIImageServer:
                 "storage_used_mb": total_size / (1024 * 1024),
                 "server_status": "running" if self.is_running else "stopped",
                 "uptime": self.get_uptime(),
+                "history_pruned": self.history_pruner.deleted_count,
                 "server_address": f"http://[{self.local_ip}]:{self.port}" if self.is_v6 else f"http://{self.local_ip}:{self.port}"
             }
 
@@ -814,6 +2131,14 @@ class AIImageServer:
         )
 
         self.thread.start()
+        self.prewarmer.start()
+        threading.Thread(target=self.prefetch_fingerprints, name='Model-Fingerprint-Prefetch', daemon=True).start()
+        if comfy_bridge.is_available():
+            # 在ComfyUI进程中，直接接收执行事件
+            comfy_bridge.add_listener(self.on_comfy_event)
+            self.node_profiler.start(lambda: server_address, self.client_id, comfy_bridge.add_listener)
+        else:
+            self.node_profiler.start(lambda: server_address, self.client_id)
 
         # 等待服务器启动
         import time
@@ -838,6 +2163,7 @@ class AIImageServer:
         if self.thread and self.thread.is_alive():
             self.thread.join(timeout=5)
 
+        self.node_profiler.flush()
         logger.info("服务器已停止")
 
     def get_uptime(self):
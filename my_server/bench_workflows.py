@@ -0,0 +1,84 @@
+"""
+工作流生成耗时的微基准
+
+按 model_map.json 中的每个工作流调用 build_workflow，输出每次生成的平均耗时（微秒），
+修改 workflows.py 后可以重新运行比较。指定 --baseline 时同时测试 git 中该版本的 workflows.py
+（模板和 model_map.json 使用当前目录中的），与当前代码对照。
+
+用法（在 my_server 目录中）:
+    python bench_workflows.py
+    python bench_workflows.py --number 5000 --repeat 5 --upscale-factor 2 t2i t2v_wan22
+    python bench_workflows.py --baseline HEAD~1
+"""
+import argparse
+import os
+import subprocess
+import timeit
+import types
+
+import workflows as wf
+
+
+def load_baseline(rev):
+    """从 git 中取出指定版本的 workflows.py，作为独立的模块加载"""
+    source = subprocess.run(
+        ['git', 'show', f'{rev}:./workflows.py'],
+        cwd=os.path.dirname(os.path.abspath(wf.__file__)),
+        capture_output=True, text=True, encoding='utf-8', check=True
+    ).stdout
+    module = types.ModuleType('workflows_baseline')
+    # 模板目录按 __file__ 查找
+    module.__file__ = wf.__file__
+    exec(compile(source, f'{rev}:workflows.py', 'exec'), module.__dict__)
+    module.load_workflows()
+    return module
+
+
+def get_build_func(module, key):
+    """生成工作流的函数：有 build_workflow 时使用它，否则使用旧版按工作流名称定义的函数"""
+    if hasattr(module, 'build_workflow'):
+        return lambda **kwargs: module.build_workflow(key, **kwargs)
+    return module.workflow_func_map.get(key)
+
+
+def bench_workflow(build_func, number, repeat, **kwargs):
+    """返回 build_func 的最短平均耗时（微秒），生成失败时返回None"""
+    if build_func is None or build_func(**kwargs) is None:
+        return None
+    times = timeit.repeat(lambda: build_func(**kwargs), number=number, repeat=repeat)
+    return min(times) / number * 1e6
+
+
+def format_elapsed(elapsed):
+    return 'failed' if elapsed is None else f'{elapsed:.1f}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='工作流生成耗时的微基准')
+    parser.add_argument('workflows', nargs='*', help='要测试的工作流，默认全部')
+    parser.add_argument('--number', type=int, default=2000, help='每轮生成的次数')
+    parser.add_argument('--repeat', type=int, default=5, help='轮数，取最快的一轮')
+    parser.add_argument('--upscale-factor', type=float, default=2.0, help='请求的放大倍数')
+    parser.add_argument('--baseline', help='对照的 git 版本（如 HEAD~1），测试该版本的 workflows.py')
+    args = parser.parse_args()
+
+    wf.load_workflows()
+    baseline = load_baseline(args.baseline) if args.baseline else None
+    keys = args.workflows or list(wf.workflow_list.keys())
+    header = f"{'workflow':<28}{'us/build':>10}"
+    if baseline is not None:
+        header += f"{'baseline':>10}"
+    print(header)
+    for key in keys:
+        kwargs = dict(prompt_p='a cat sitting on a chair', seed=1, upscale_factor=args.upscale_factor)
+        if wf.workflow_list[key].get('inputType') == 'image':
+            kwargs['image1'] = 'example.png'
+        line = f"{key:<28}{format_elapsed(bench_workflow(get_build_func(wf, key), args.number, args.repeat, **kwargs)):>10}"
+        if baseline is not None:
+            elapsed = bench_workflow(get_build_func(baseline, key), args.number, args.repeat, **kwargs)
+            line += f"{format_elapsed(elapsed):>10}"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
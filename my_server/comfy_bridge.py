@@ -0,0 +1,181 @@
+import asyncio
+import inspect
+import io
+import json
+import os
+import threading
+import time
+import urllib.error
+
+from server_config import get_config
+
+
+class ComfyBridge:
+    """
+    ComfyUI进程内接口
+
+    服务器作为插件运行在ComfyUI进程中时，直接操作 PromptServer.instance.prompt_queue：
+    提交任务、查询队列和任务状态、删除历史、读取输出图像都不经过HTTP和JSON序列化；
+    并截获 send_sync 推送的执行事件，转发给登记的监听函数（节点耗时统计、任务完成通知）。
+    不在ComfyUI进程中（找不到 PromptServer.instance）时 is_available() 返回False，调用方使用HTTP接口。
+    """
+
+    def __init__(self):
+        self.server = None
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.hooked = False
+
+    def _get_server(self):
+        if self.server is None:
+            try:
+                import server
+                self.server = getattr(server.PromptServer, 'instance', None)
+            except Exception:
+                return None
+        return self.server
+
+    def is_available(self):
+        if not get_config('comfy_bridge_enabled'):
+            return False
+        prompt_server = self._get_server()
+        return prompt_server is not None and getattr(prompt_server, 'prompt_queue', None) is not None
+
+    def add_listener(self, func):
+        """
+        登记执行事件的监听函数，参数为 {'type': 事件, 'data': 数据}
+
+        监听函数在ComfyUI的执行线程中调用，不能阻塞；已登记的函数不会重复登记
+        """
+        with self.lock:
+            if func not in self.listeners:
+                self.listeners.append(func)
+            if not self.hooked:
+                self._hook()
+
+    def _hook(self):
+        prompt_server = self._get_server()
+        send_sync = prompt_server.send_sync
+        bridge = self
+
+        def hooked_send_sync(event, data, sid=None):
+            send_sync(event, data, sid)
+            # 二进制消息（预览图像）的事件类型是整数
+            if isinstance(event, str):
+                bridge._dispatch({'type': event, 'data': data})
+
+        prompt_server.send_sync = hooked_send_sync
+        self.hooked = True
+
+    def _dispatch(self, message):
+        for func in list(self.listeners):
+            try:
+                func(message)
+            except Exception as e:
+                print(f"执行事件处理失败：{message.get('type')} {e}")
+
+    def _run_in_loop(self, coroutine):
+        """在ComfyUI的事件循环中执行（与HTTP接口的处理方式一致）"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.server.loop).result()
+
+    async def _queue_prompt(self, prompt, client_id, prompt_id):
+        import execution
+
+        # 与HTTP提交一样交给ComfyUI一份独立的副本：on_prompt 处理器和执行过程可能就地修改工作流，
+        # 不能影响调用方（调度器中的任务、缓存的模板）
+        prompt = json.loads(json.dumps(prompt))
+        json_data = {"prompt": prompt, "client_id": client_id, "prompt_id": prompt_id}
+        if hasattr(self.server, 'trigger_on_prompt'):
+            json_data = self.server.trigger_on_prompt(json_data)
+        prompt = json_data['prompt']
+        if len(inspect.signature(execution.validate_prompt).parameters) >= 3:
+            valid = execution.validate_prompt(prompt_id, prompt, None)
+        else:
+            valid = execution.validate_prompt(prompt)
+        if inspect.isawaitable(valid):
+            valid = await valid
+        if not valid[0]:
+            body = json.dumps({"error": valid[1], "node_errors": valid[3]}).encode('utf-8')
+            raise urllib.error.HTTPError('/prompt', 400, 'Bad Request', None, io.BytesIO(body))
+
+        number = self.server.number
+        self.server.number += 1
+        extra_data = {"client_id": client_id}
+        if hasattr(execution, 'SENSITIVE_EXTRA_DATA_KEYS'):
+            extra_data["create_time"] = int(time.time() * 1000)
+            self.server.prompt_queue.put((number, prompt_id, prompt, extra_data, valid[2], {}))
+        else:
+            self.server.prompt_queue.put((number, prompt_id, prompt, extra_data, valid[2]))
+        return {"prompt_id": prompt_id, "number": number, "node_errors": valid[3]}
+
+    def queue_prompt(self, prompt, client_id, prompt_id):
+        """校验并加入ComfyUI队列，校验失败时抛出 HTTPError(400)，与HTTP接口一致"""
+        return self._run_in_loop(self._queue_prompt(prompt, client_id, prompt_id))
+
+    def _get_current_queue(self):
+        prompt_queue = self.server.prompt_queue
+        if hasattr(prompt_queue, 'get_current_queue_volatile'):
+            # 不复制任务内容
+            return prompt_queue.get_current_queue_volatile()
+        return prompt_queue.get_current_queue()
+
+    def get_queue_remaining(self):
+        return self.server.prompt_queue.get_tasks_remaining()
+
+    def get_queue(self):
+        """与 /queue 的格式相同，每项只有 [number, prompt_id]"""
+        running, pending = self._get_current_queue()
+        return {
+            'queue_running': [[item[0], item[1]] for item in running],
+            'queue_pending': [[item[0], item[1]] for item in sorted(pending, key=lambda x: x[0])],
+        }
+
+    def delete_queued_prompts(self, prompt_ids):
+        prompt_ids = set(prompt_ids)
+        for prompt_id in prompt_ids:
+            self.server.prompt_queue.delete_queue_item(lambda item: item[1] == prompt_id)
+
+    def interrupt_prompt(self, prompt_id=None):
+        """中断正在执行的任务，prompt_id 不是正在执行的任务时不做处理，为None时中断当前任务"""
+        import nodes
+
+        if prompt_id is not None:
+            running, _ = self._get_current_queue()
+            if not any(item[1] == prompt_id for item in running):
+                return
+        nodes.interrupt_processing()
+
+    def delete_history(self, prompt_ids):
+        for prompt_id in prompt_ids:
+            self.server.prompt_queue.delete_history_item(prompt_id)
+
+    def has_jobs_api(self):
+        try:
+            from comfy_execution.jobs import get_job
+        except ImportError:
+            return False
+        return True
+
+    def get_job(self, prompt_id):
+        """与 /api/jobs/{prompt_id} 的格式相同，任务不存在时返回None"""
+        from comfy_execution.jobs import get_job
+
+        running, pending = self._get_current_queue()
+        history = self.server.prompt_queue.get_history(prompt_id=prompt_id)
+        return get_job(prompt_id, running, pending, history)
+
+    def get_image(self, filename, subfolder, folder_type):
+        """直接读取 /view 对应的文件"""
+        import folder_paths
+
+        directory = folder_paths.get_directory_by_type(folder_type)
+        if directory is None:
+            raise FileNotFoundError(f"unknown folder type {folder_type}")
+        file_path = os.path.abspath(os.path.join(directory, subfolder or '', filename))
+        if os.path.commonpath([file_path, os.path.abspath(directory)]) != os.path.abspath(directory):
+            raise FileNotFoundError(file_path)
+        with open(file_path, 'rb') as f:
+            return f.read()
+
+
+comfy_bridge = ComfyBridge()
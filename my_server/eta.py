@@ -0,0 +1,143 @@
+import json
+import math
+import os
+import threading
+
+from server_config import get_config
+
+_cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
+_model_file = os.path.join(_cache_dir, 'eta_model.json')
+
+# 特征数：常数项、生成工作量、放大工作量
+_FEATURES = 3
+# 样本少于该数量时只使用平均值
+_MIN_REGRESSION_SAMPLES = 3
+
+
+def get_eta_features(params):
+    """
+    由规范化的请求参数（canonicalize_params 的结果）计算执行时间的特征
+
+    生成工作量 = 百万像素 × 步数 × 时长（秒，图像为1），放大工作量 = 百万像素 × 放大倍数²（不放大为0）
+    """
+    width, height = params.get('width'), params.get('height')
+    if width and height:
+        megapixels = width * height / 1e6
+    else:
+        megapixels = params.get('megapixels') or 1.0
+    steps = params.get('step') or 1
+    length = params.get('seconds') or 1
+    upscale_factor = params.get('upscale_factor') or 1
+    upscale_work = megapixels * upscale_factor * upscale_factor if upscale_factor > 1 else 0.0
+    return [1.0, megapixels * steps * length, upscale_work]
+
+
+def _solve(a, b):
+    """高斯消元（部分主元）求解 a·x = b，奇异时返回None"""
+    n = len(b)
+    m = [list(a[i]) + [b[i]] for i in range(n)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        if abs(m[pivot][col]) < 1e-12:
+            return None
+        m[col], m[pivot] = m[pivot], m[col]
+        for r in range(col + 1, n):
+            f = m[r][col] / m[col][col]
+            for c in range(col, n + 1):
+                m[r][c] -= f * m[col][c]
+    x = [0.0] * n
+    for r in range(n - 1, -1, -1):
+        x[r] = (m[r][n] - sum(m[r][c] * x[c] for c in range(r + 1, n))) / m[r][r]
+    return x
+
+
+class EtaModel:
+    """
+    执行时间模型
+
+    每个工作流一个线性模型：执行时间 = θ·(1, 生成工作量, 放大工作量)，
+    用完成的任务在线更新（加权最小二乘，旧样本的权重每次乘以 eta_decay，适应模板和硬件的变化），保存到磁盘。
+    样本较少时使用加权平均值。
+    """
+
+    def __init__(self, model_file=None):
+        self.model_file = model_file or _model_file
+        self.lock = threading.Lock()
+        self.models: dict = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.model_file):
+            return
+        try:
+            with open(self.model_file, 'r', encoding='utf-8') as f:
+                self.models = json.loads(f.read())
+        except Exception as e:
+            print(f"执行时间模型读取失败：{e}")
+            self.models = {}
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.model_file), exist_ok=True)
+            tmp_file = self.model_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(self.models))
+            os.replace(tmp_file, self.model_file)
+        except Exception as e:
+            print(f"执行时间模型保存失败：{e}")
+
+    def add(self, workflow, features, duration_ms):
+        """记录一个完成的任务"""
+        if duration_ms is None or duration_ms <= 0:
+            return
+        decay = get_config('eta_decay')
+        with self.lock:
+            model = self.models.get(workflow)
+            if model is None:
+                model = {
+                    'a': [[0.0] * _FEATURES for _ in range(_FEATURES)],
+                    'b': [0.0] * _FEATURES,
+                    'weight': 0.0,
+                    'sum': 0.0,
+                    'count': 0,
+                }
+                self.models[workflow] = model
+            for i in range(_FEATURES):
+                model['b'][i] = model['b'][i] * decay + features[i] * duration_ms
+                for j in range(_FEATURES):
+                    model['a'][i][j] = model['a'][i][j] * decay + features[i] * features[j]
+            model['weight'] = model['weight'] * decay + 1.0
+            model['sum'] = model['sum'] * decay + duration_ms
+            model['count'] += 1
+            self._save()
+
+    def predict(self, workflow, features):
+        """
+        返回值:
+            float: 预计执行时间（毫秒），没有该工作流的样本时返回None
+        """
+        with self.lock:
+            model = self.models.get(workflow)
+            if model is None or model['count'] == 0:
+                return None
+            mean = model['sum'] / model['weight']
+            if model['count'] < _MIN_REGRESSION_SAMPLES:
+                return mean
+            # 加一点岭回归项，特征共线（如参数一直相同）时也能求解
+            ridge = 1e-6 * sum(model['a'][i][i] for i in range(_FEATURES)) + 1e-9
+            a = [[model['a'][i][j] + (ridge if i == j else 0.0) for j in range(_FEATURES)] for i in range(_FEATURES)]
+            theta = _solve(a, model['b'])
+        if theta is None:
+            return mean
+        value = sum(t * x for t, x in zip(theta, features))
+        if not math.isfinite(value) or value <= 0:
+            return mean
+        return value
+
+    def default_ms(self):
+        """未知工作流（或其他客户端提交的任务）的执行时间：各工作流平均值的平均"""
+        with self.lock:
+            means = [m['sum'] / m['weight'] for m in self.models.values() if m['count'] > 0]
+        if len(means) > 0:
+            return sum(means) / len(means)
+        return get_config('eta_default_seconds') * 1000
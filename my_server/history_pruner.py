@@ -0,0 +1,82 @@
+import collections
+import threading
+import time
+
+from server_config import get_config
+
+
+class HistoryPruner:
+    """
+    ComfyUI历史清理
+
+    结果转移到输出目录并记录到结果索引后，任务在ComfyUI中的历史就不再需要。
+    保留 history_retention_seconds 秒（便于调试）后，按 history_prune_batch_size 分批删除，
+    避免ComfyUI的 /history、/api/jobs 响应和内存占用随任务数增长。
+    """
+
+    def __init__(self, delete_func):
+        """
+        Args:
+            delete_func: 删除ComfyUI中的历史，参数为 prompt_id 列表
+        """
+        self.delete_func = delete_func
+        self.condition = threading.Condition()
+        self.pending = collections.deque()
+        self.deleted_count = 0
+        self.thread = None
+
+    def add(self, prompt_id):
+        """记录已完成转移的任务，保留时间过后删除"""
+        if not get_config('history_prune_enabled'):
+            return
+        with self.condition:
+            was_empty = len(self.pending) == 0
+            self.pending.append((time.monotonic(), prompt_id))
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._run,
+                    name='History-Pruner-Thread',
+                    daemon=True
+                )
+                self.thread.start()
+            # 只在队列由空变为非空时唤醒，之后的任务等到间隔结束一起删除
+            if was_empty:
+                self.condition.notify()
+
+    def _pop_expired(self, now):
+        retention = get_config('history_retention_seconds')
+        batch = []
+        while len(self.pending) > 0 and len(batch) < get_config('history_prune_batch_size'):
+            added_at, prompt_id = self.pending[0]
+            if now - added_at < retention:
+                break
+            self.pending.popleft()
+            batch.append(prompt_id)
+        return batch
+
+    def flush(self):
+        """删除所有已过保留时间的历史，返回删除的数量"""
+        deleted = 0
+        while True:
+            with self.condition:
+                batch = self._pop_expired(time.monotonic())
+            if len(batch) == 0:
+                return deleted
+            try:
+                self.delete_func(batch)
+                deleted += len(batch)
+                self.deleted_count += len(batch)
+            except Exception as e:
+                print(f"删除ComfyUI历史失败：{e}")
+                with self.condition:
+                    # 放回队列，下次重试
+                    self.pending.extendleft(reversed([(0, x) for x in batch]))
+                return deleted
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while len(self.pending) == 0:
+                    self.condition.wait()
+                self.condition.wait(get_config('history_prune_interval'))
+            self.flush()
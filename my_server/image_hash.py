@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+import time
+
+from PIL import Image, ImageOps
+
+from image_normalizer import VARIANT_DIR
+from server_config import get_config
+
+_cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
+_phash_file = os.path.join(_cache_dir, 'input_phash.json')
+
+_image_extensions = {'.png', '.jpg', '.jpeg', '.webp', '.bmp'}
+
+
+def calculate_dhash(image):
+    """
+    计算图像的感知哈希（64位 dHash）
+
+    按EXIF方向旋转后转为灰度，缩放到 9x8，每行相邻像素左边比右边亮记为1。
+    重新编码、缩放后的同一张图像哈希值相同或只差几位。
+
+    参数:
+        image: PIL.Image 或文件路径
+
+    返回值:
+        str: 16位十六进制字符串
+    """
+    if not isinstance(image, Image.Image):
+        with Image.open(image) as f:
+            return calculate_dhash(ImageOps.exif_transpose(f))
+    small = image.convert('L').resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (1 if pixels[row * 9 + col] > pixels[row * 9 + col + 1] else 0)
+    return f"{value:016x}"
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """按汉明距离组织的BK树，查询距离不超过 max_distance 的哈希时只访问少量节点"""
+
+    def __init__(self):
+        # 节点: [哈希值, 值列表, {距离: 子节点}]
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            d = hamming_distance(value, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """
+        返回值:
+            list: [(距离, 值)]，按距离从小到大
+        """
+        results = []
+        if self.root is None:
+            return results
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = hamming_distance(value, node[0])
+            if d <= max_distance:
+                results.extend((d, item) for item in node[1])
+            # 三角不等式：只有距离在 [d-max, d+max] 内的子树可能有结果
+            for child_d, child in node[2].items():
+                if d - max_distance <= child_d <= d + max_distance:
+                    stack.append(child)
+        results.sort(key=lambda x: (x[0], x[1]))
+        return results
+
+
+class PerceptualIndex:
+    """
+    输入图像的感知哈希索引
+
+    输入目录中图像的 dHash 持久化到磁盘（按文件大小和修改时间判断是否需要重新计算），
+    并组织成BK树用于相似图像查询。上传时直接加入索引，其余改动最多每 phash_refresh_interval 秒扫描一次。
+    """
+
+    def __init__(self, directory_func, cache_file=None):
+        """
+        Args:
+            directory_func: 获取输入目录
+        """
+        self.directory_func = directory_func
+        self.cache_file = cache_file or _phash_file
+        self.lock = threading.Lock()
+        self.entries: dict = {}
+        self.tree = BKTree()
+        self.refreshed_at = None
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                self.entries = json.loads(f.read())
+        except Exception as e:
+            print(f"感知哈希缓存读取失败：{e}")
+            self.entries = {}
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp_file = self.cache_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(self.entries, ensure_ascii=False))
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            print(f"感知哈希缓存保存失败：{e}")
+
+    def _rebuild_tree(self):
+        tree = BKTree()
+        for name, entry in self.entries.items():
+            tree.add(int(entry['phash'], 16), name)
+        self.tree = tree
+
+    def _hash_entry(self, file_path, st):
+        return {
+            'phash': calculate_dhash(file_path),
+            'size': st.st_size,
+            'mtime': st.st_mtime_ns,
+        }
+
+    def refresh(self, force=False):
+        """扫描输入目录，计算新增或修改的图像的哈希，移除已删除的图像"""
+        with self.lock:
+            now = time.monotonic()
+            if not force and self.refreshed_at is not None and \
+                    now - self.refreshed_at < get_config('phash_refresh_interval'):
+                return
+            directory = self.directory_func()
+            found = {}
+            for root, dirs, files in os.walk(directory):
+                if root == directory:
+                    # 规范化的图像是原图的副本
+                    dirs[:] = [d for d in dirs if d != VARIANT_DIR]
+                for filename in files:
+                    if os.path.splitext(filename)[1].lower() not in _image_extensions:
+                        continue
+                    file_path = os.path.join(root, filename)
+                    name = os.path.relpath(file_path, directory).replace(os.sep, '/')
+                    try:
+                        st = os.stat(file_path)
+                        entry = self.entries.get(name)
+                        if entry is None or entry['size'] != st.st_size or entry['mtime'] != st.st_mtime_ns:
+                            entry = self._hash_entry(file_path, st)
+                        found[name] = entry
+                    except Exception as e:
+                        print(f"感知哈希计算失败：{file_path} {e}")
+            changed = found != self.entries
+            self.entries = found
+            if changed or self.tree.size != len(found):
+                self._rebuild_tree()
+            if changed:
+                self._save()
+            self.refreshed_at = now
+
+    def add_file(self, file_path):
+        """加入新上传的图像，返回其哈希，不是图像时返回None"""
+        directory = self.directory_func()
+        name = os.path.relpath(file_path, directory).replace(os.sep, '/')
+        try:
+            entry = self._hash_entry(file_path, os.stat(file_path))
+        except Exception as e:
+            print(f"感知哈希计算失败：{file_path} {e}")
+            return None
+        with self.lock:
+            replaced = name in self.entries
+            self.entries[name] = entry
+            if replaced:
+                self._rebuild_tree()
+            else:
+                self.tree.add(int(entry['phash'], 16), name)
+            self._save()
+        return entry['phash']
+
+    def search(self, phash, max_distance, limit=10):
+        """
+        查找相似图像
+
+        返回值:
+            list: [(距离, 文件名)]，按距离从小到大
+        """
+        self.refresh()
+        with self.lock:
+            results = self.tree.search(int(phash, 16), max_distance)
+        return results[:limit]
@@ -0,0 +1,196 @@
+import json
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from PIL import Image, ImageOps
+
+import folder_paths
+from server_config import get_config
+
+_cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
+_variant_file = os.path.join(_cache_dir, 'input_variants.json')
+
+# 输入目录中保存规范化图像的子目录（感知哈希索引不扫描）
+VARIANT_DIR = '_normalized'
+
+# EXIF 方向标签
+_ORIENTATION = 0x0112
+
+
+def get_scaled_size(width, height, megapixels):
+    """与 ImageScaleToTotalPixels 相同的尺寸算法（百万像素按 1024×1024 计）"""
+    scale = math.sqrt(megapixels * 1024 * 1024 / (width * height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def normalize_image(src_path, dst_path, megapixels):
+    """
+    解码一次，按EXIF方向旋转，像素超过 megapixels 时按面积缩小，保存为PNG
+
+    返回值:
+        dict: {'width', 'height', 'downscaled'}，不需要规范化（没有旋转、不需要缩小）时不保存，返回None
+    """
+    with Image.open(src_path) as image:
+        orientation = image.getexif().get(_ORIENTATION, 1)
+        rotated = orientation != 1
+        width, height = image.size
+        if orientation in (5, 6, 7, 8):
+            width, height = height, width
+        downscaled = width * height > megapixels * 1024 * 1024
+        if not rotated and not downscaled:
+            return None
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            has_alpha = 'A' in image.mode or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        if downscaled:
+            width, height = get_scaled_size(width, height, megapixels)
+            image = image.resize((width, height), Image.Resampling.LANCZOS)
+        # 只读一次，压缩级别低一些，保存更快
+        image.save(dst_path, 'PNG', compress_level=1)
+    return {'width': width, 'height': height, 'downscaled': downscaled}
+
+
+class InputNormalizer:
+    """
+    输入图像的规范化
+
+    上传后在后台线程池中解码一次：按EXIF方向旋转、缩小到工作流需要的像素，保存到输入目录的 _normalized 子目录；
+    生成工作流时 LoadImage 引用规范化的图像，不用每次生成都重新解码、缩小原图（如1200万像素的手机照片）。
+    规范化的图像按原图的 文件大小+修改时间 持久化记录，原图改变或还没有规范化完成时使用原图。
+    """
+
+    def __init__(self, directory_func=None, cache_file=None, max_workers=None):
+        self.directory_func = directory_func or folder_paths.get_input_directory
+        self.cache_file = cache_file or _variant_file
+        self.lock = threading.Lock()
+        # 原图名称（相对输入目录）: 规范化记录
+        self.entries: dict = {}
+        # 正在规范化的原图名称: Future
+        self.pending: dict = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or get_config('upload_normalize_workers'),
+            thread_name_prefix='Input-Normalizer'
+        )
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                self.entries = json.loads(f.read())
+        except Exception as e:
+            print(f"规范化图像记录读取失败：{e}")
+            self.entries = {}
+
+    def _save(self):
+        with self.lock:
+            data = json.dumps(self.entries, ensure_ascii=False)
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp_file = self.cache_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            print(f"规范化图像记录保存失败：{e}")
+
+    def submit(self, name, megapixels):
+        """
+        在后台规范化输入目录中的图像
+
+        Args:
+            name: 相对输入目录的名称（请求 images 中的值）
+            megapixels: 缩小到的像素（百万）
+        """
+        if not get_config('upload_normalize_enabled'):
+            return None
+        with self.lock:
+            if name in self.pending:
+                return None
+            future = self.executor.submit(self._normalize, name, megapixels)
+            self.pending[name] = future
+        return future
+
+    def _normalize(self, name, megapixels):
+        try:
+            directory = self.directory_func()
+            src_path = os.path.join(directory, name)
+            st = os.stat(src_path)
+            # 按原图的子目录保存（a/b.png 与 a_b.png 不会冲突）
+            variant = f"{VARIANT_DIR}/{name}.png"
+            dst_path = os.path.join(directory, variant)
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            tmp_path = dst_path + '.tmp'
+            try:
+                info = normalize_image(src_path, tmp_path, megapixels)
+                if info is not None:
+                    os.replace(tmp_path, dst_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            entry = {
+                'size': st.st_size,
+                'mtime': st.st_mtime_ns,
+                'megapixels': megapixels,
+                # 不需要规范化时为None，直接使用原图
+                'variant': variant if info is not None else None,
+                'downscaled': info is not None and info['downscaled'],
+            }
+            if info is not None:
+                entry['width'] = info['width']
+                entry['height'] = info['height']
+            with self.lock:
+                self.entries[name] = entry
+            self._save()
+        except Exception as e:
+            print(f"图像规范化失败：{name} {e}")
+        finally:
+            with self.lock:
+                self.pending.pop(name, None)
+
+    def resolve(self, name, megapixels, target_megapixels, timeout=None):
+        """
+        生成工作流时使用的输入图像
+
+        有规范化的图像且像素不少于 megapixels（只旋转没有缩小的图像总是可以使用）时返回它，
+        否则返回原图；没有记录、原图已改变或目标像素改变时按 target_megapixels 规范化，
+        最多等待 timeout 秒（默认为 upload_normalize_wait_seconds，为0时不等待），超时后使用原图，规范化在后台继续。
+        """
+        if name is None or not get_config('upload_normalize_enabled'):
+            return name
+        resolved = self._resolve(name, megapixels, target_megapixels)
+        future = self.pending.get(name)
+        if future is not None:
+            wait([future], get_config('upload_normalize_wait_seconds') if timeout is None else timeout)
+            if future.done():
+                resolved = self._resolve(name, megapixels, target_megapixels)
+        return resolved
+
+    def _resolve(self, name, megapixels, target_megapixels):
+        directory = self.directory_func()
+        try:
+            st = os.stat(os.path.join(directory, name))
+        except OSError:
+            return name
+        entry = self.entries.get(name)
+        if entry is None or entry['size'] != st.st_size or entry['mtime'] != st.st_mtime_ns:
+            self.submit(name, target_megapixels)
+            return name
+        if entry['megapixels'] != target_megapixels:
+            self.submit(name, target_megapixels)
+        if entry['variant'] is None:
+            return name
+        # 宽高取整后像素会比目标略少，留1%的余量
+        if entry['downscaled'] and entry['width'] * entry['height'] < megapixels * 1024 * 1024 * 0.99:
+            return name
+        if not os.path.isfile(os.path.join(directory, entry['variant'])):
+            self.submit(name, target_megapixels)
+            return name
+        return entry['variant']
+
+
+input_normalizer = InputNormalizer()
@@ -0,0 +1,73 @@
+import threading
+
+from server_config import get_config
+
+
+class JobWatcher:
+    """
+    任务结束后的后续处理（转移结果、提交后续任务）
+
+    在后台线程中执行，不依赖客户端查询状态：在ComfyUI进程内时收到任务结束事件后立即检查（notify），
+    否则每 job_watch_interval 秒检查一次。
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        # prompt_id: 检查函数
+        self.watches: dict = {}
+        # 检查期间收到的通知，检查完后不再等待
+        self.notified = False
+        self.thread = None
+
+    def watch(self, prompt_id, check_func):
+        """
+        监视任务
+
+        Args:
+            check_func: 在后台线程中调用，参数为 prompt_id，返回True时结束监视
+        """
+        with self.condition:
+            self.watches[prompt_id] = check_func
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._run,
+                    name='Job-Watcher-Thread',
+                    daemon=True
+                )
+                self.thread.start()
+            self.notified = True
+            self.condition.notify()
+
+    def unwatch(self, prompt_id):
+        with self.condition:
+            return self.watches.pop(prompt_id, None) is not None
+
+    def __contains__(self, prompt_id):
+        with self.condition:
+            return prompt_id in self.watches
+
+    def notify(self):
+        """任务结束时唤醒检查线程"""
+        with self.condition:
+            self.notified = True
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while len(self.watches) == 0:
+                    self.condition.wait()
+                if not self.notified:
+                    self.condition.wait(get_config('job_watch_interval'))
+                self.notified = False
+                watches = list(self.watches.items())
+            for prompt_id, check_func in watches:
+                try:
+                    finished = check_func(prompt_id)
+                except Exception as e:
+                    print(f"任务后续处理失败：{prompt_id} {e}")
+                    finished = True
+                if finished:
+                    with self.condition:
+                        if self.watches.get(prompt_id) is check_func:
+                            del self.watches[prompt_id]
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import threading
+
+import folder_paths
+
+_cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
+_catalog_file = os.path.join(_cache_dir, 'model_catalog.json')
+# 缓存格式版本，扫描结果的规则改变时增加，旧的缓存重新扫描
+_CATALOG_VERSION = 2
+
+
+def _get_model_dirs(model_type):
+    """获取模型类型对应的目录和扩展名"""
+    if model_type not in folder_paths.folder_names_and_paths:
+        return [], set()
+    paths, extensions = folder_paths.folder_names_and_paths[model_type][:2]
+    return list(paths), set(extensions)
+
+
+def _stat_dirs(dirs):
+    """获取目录（含子目录）的修改时间，目录不存在时记为None"""
+    dir_mtimes = {}
+    for d in dirs:
+        try:
+            dir_mtimes[d] = os.stat(d).st_mtime_ns
+        except OSError:
+            dir_mtimes[d] = None
+    return dir_mtimes
+
+
+def _match_extension(filename, extensions):
+    if len(extensions) == 0:
+        return True
+    return os.path.splitext(filename)[1].lower() in extensions
+
+
+def _scan_dir(base_dir, extensions):
+    """递归扫描目录，返回文件信息和所有子目录"""
+    files = []
+    sub_dirs = [base_dir]
+    stack = [base_dir]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=True):
+                            stack.append(entry.path)
+                            sub_dirs.append(entry.path)
+                        elif _match_extension(entry.name, extensions):
+                            st = entry.stat(follow_symlinks=True)
+                            files.append({
+                                'name': os.path.relpath(entry.path, base_dir),
+                                'size': st.st_size,
+                                'mtime': int(st.st_mtime * 1000),
+                            })
+                    except OSError as e:
+                        print(f"Error processing {entry.path}: {e}")
+        except OSError as e:
+            print(f"Error scanning {current}: {e}")
+    return files, sub_dirs
+
+
+def make_etag(*parts):
+    data = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return '"' + hashlib.sha1(data.encode('utf-8')).hexdigest() + '"'
+
+
+def filter_models(models, keywords=None, exclude_keywords=None):
+    """按工作流的关键字过滤模型列表（不区分大小写）"""
+    keywords = [k.lower() for k in (keywords or []) if k]
+    exclude_keywords = [k.lower() for k in (exclude_keywords or []) if k]
+    filtered = []
+    for m in models:
+        name = m['name'].lower()
+        if keywords and not any(k in name for k in keywords):
+            continue
+        if any(k in name for k in exclude_keywords):
+            continue
+        filtered.append(m)
+    return filtered
+
+
+class ModelCatalog:
+    """
+    模型目录缓存
+
+    按模型类型缓存文件列表（含大小和修改时间），只在目录修改时间变化时重新扫描，
+    并持久化到磁盘，避免每次启动都重新扫描网络存储上的模型目录。
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file or _catalog_file
+        self.lock = threading.Lock()
+        self.entries: dict = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                self.entries = json.loads(f.read())
+        except Exception as e:
+            print(f"模型目录缓存读取失败：{e}")
+            self.entries = {}
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp_file = self.cache_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(self.entries, ensure_ascii=False))
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            print(f"模型目录缓存保存失败：{e}")
+
+    def _is_valid(self, entry, base_dirs):
+        if entry is None or entry.get('version') != _CATALOG_VERSION or entry.get('base_dirs') != base_dirs:
+            return False
+        dir_mtimes = entry.get('dir_mtimes', {})
+        return _stat_dirs(dir_mtimes.keys()) == dir_mtimes
+
+    def _rescan(self, model_type, base_dirs, extensions):
+        """重新扫描，多个目录中有同名的模型时与 folder_paths 一样只保留第一个目录中的"""
+        models = []
+        names = set()
+        dirs = []
+        for base_dir in base_dirs:
+            if not os.path.isdir(base_dir):
+                dirs.append(base_dir)
+                continue
+            files, sub_dirs = _scan_dir(base_dir, extensions)
+            for file in files:
+                if file['name'] not in names:
+                    names.add(file['name'])
+                    models.append(file)
+            dirs.extend(sub_dirs)
+        models.sort(key=lambda m: m['name'].lower())
+        dir_mtimes = _stat_dirs(dirs)
+        return {
+            'version': _CATALOG_VERSION,
+            'base_dirs': base_dirs,
+            'dir_mtimes': dir_mtimes,
+            'models': models,
+            'etag': make_etag(model_type, models),
+        }
+
+    def get(self, model_type):
+        """
+        获取模型列表
+
+        返回值:
+            (models, etag): 模型信息列表（name/size/mtime）和对应的ETag
+        """
+        base_dirs, extensions = _get_model_dirs(model_type)
+        with self.lock:
+            entry = self.entries.get(model_type)
+            if not self._is_valid(entry, base_dirs):
+                entry = self._rescan(model_type, base_dirs, extensions)
+                self.entries[model_type] = entry
+                self._save()
+            return entry['models'], entry['etag']
+
+    def get_for_workflow(self, workflow):
+        """
+        获取工作流可用的模型列表（按 modelTypes/modelKeywords/excludeModelKeywords 过滤）
+
+        返回值:
+            (models, etag): 模型信息列表（附带model_type）和对应的ETag
+        """
+        models = []
+        etags = []
+        for model_type in workflow.get('modelTypes', []):
+            _models, _etag = self.get(model_type)
+            _models = filter_models(_models,
+                                    workflow.get('modelKeywords'),
+                                    workflow.get('excludeModelKeywords'))
+            models.extend(dict(m, model_type=model_type) for m in _models)
+            etags.append(_etag)
+        return models, make_etag(workflow.get('modelTypes', []),
+                                 workflow.get('modelKeywords', []),
+                                 workflow.get('excludeModelKeywords', []),
+                                 etags)
+
+    def invalidate(self, model_type=None):
+        with self.lock:
+            if model_type is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(model_type, None)
+            self._save()
+
+
+model_catalog = ModelCatalog()
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import mmap
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import folder_paths
+
+_cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
+_fingerprint_file = os.path.join(_cache_dir, 'model_fingerprints.json')
+
+# 快速指纹的采样大小：文件头（safetensors头部包含张量元数据）、中部、尾部
+_SAMPLE_SIZE = 1024 * 1024
+# 完整哈希的分块大小
+_CHUNK_SIZE = 16 * 1024 * 1024
+# 后台计算采样指纹时合并保存的间隔（秒），队列清空时也会保存
+_SAVE_INTERVAL = 5
+
+
+def _read_samples(mm, size):
+    """读取文件头、中部、尾部的采样数据"""
+    if size <= _SAMPLE_SIZE * 3:
+        return [mm[:size]]
+    middle = (size - _SAMPLE_SIZE) // 2
+    return [mm[:_SAMPLE_SIZE], mm[middle:middle + _SAMPLE_SIZE], mm[size - _SAMPLE_SIZE:]]
+
+
+def calculate_fast_fingerprint(file_path):
+    """计算采样指纹（文件大小 + 头/中/尾采样的sha256）"""
+    size = os.path.getsize(file_path)
+    hash_func = hashlib.sha256()
+    hash_func.update(f'{size}:'.encode())
+    if size > 0:
+        with open(file_path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for sample in _read_samples(mm, size):
+                    hash_func.update(sample)
+    return hash_func.hexdigest()
+
+
+def calculate_full_hash(file_path):
+    """计算完整的sha256"""
+    size = os.path.getsize(file_path)
+    hash_func = hashlib.sha256()
+    if size > 0:
+        with open(file_path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for offset in range(0, size, _CHUNK_SIZE):
+                    hash_func.update(mm[offset:offset + _CHUNK_SIZE])
+    return hash_func.hexdigest()
+
+
+class ModelFingerprintCatalog:
+    """
+    模型文件指纹目录
+
+    采样指纹和完整sha256都在后台线程中计算（完整sha256只在需要时计算），查询时只返回已经计算好的结果，
+    结果按 文件路径+大小+修改时间 持久化到磁盘。
+    """
+
+    def __init__(self, cache_file=None, max_workers=4):
+        self.cache_file = cache_file or _fingerprint_file
+        self.lock = threading.Lock()
+        # 请求线程和完整哈希线程都会保存，写同一个临时文件，需要串行
+        self.save_lock = threading.Lock()
+        self.entries: dict = {}
+        # 正在计算采样指纹的文件
+        self.pending = set()
+        # 有还没保存的采样指纹、上次保存的时间
+        self.dirty = False
+        self.last_save = time.monotonic()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='Model-Fingerprint')
+        self.full_hash_queue = queue.Queue()
+        self.full_hash_pending = set()
+        self.full_hash_thread = None
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                self.entries = json.loads(f.read())
+        except Exception as e:
+            print(f"模型指纹缓存读取失败：{e}")
+            self.entries = {}
+
+    def _save(self):
+        with self.save_lock:
+            with self.lock:
+                data = json.dumps(self.entries, ensure_ascii=False)
+            try:
+                os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+                tmp_file = self.cache_file + '.tmp'
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                os.replace(tmp_file, self.cache_file)
+            except Exception as e:
+                print(f"模型指纹缓存保存失败：{e}")
+
+    def _get_valid_entry(self, file_path, st):
+        with self.lock:
+            entry = self.entries.get(file_path)
+            if entry is not None and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+                return entry
+        return None
+
+    def _fingerprint(self, file_path, full_hash):
+        try:
+            st = os.stat(file_path)
+            entry = {
+                'size': st.st_size,
+                'mtime_ns': st.st_mtime_ns,
+                'fingerprint': calculate_fast_fingerprint(file_path),
+                'sha256': None,
+            }
+            with self.lock:
+                self.entries[file_path] = entry
+                self.dirty = True
+            if full_hash:
+                self.request_full_hash(file_path)
+        except Exception as e:
+            print(f"Error processing {file_path}: {e}")
+        finally:
+            with self.lock:
+                self.pending.discard(file_path)
+                # 每个文件都重写整个缓存文件时，模型很多的目录写入次数是 O(n²)
+                save = self.dirty and (len(self.pending) == 0
+                                       or time.monotonic() - self.last_save >= _SAVE_INTERVAL)
+                if save:
+                    self.dirty = False
+                    self.last_save = time.monotonic()
+            if save:
+                self._save()
+
+    def request_fingerprint(self, file_path, full_hash=False):
+        """将文件加入后台采样指纹队列"""
+        with self.lock:
+            if file_path in self.pending:
+                return
+            self.pending.add(file_path)
+        self.executor.submit(self._fingerprint, file_path, full_hash)
+
+    def get_fingerprints(self, model_type, names, full_hash=False):
+        """
+        获取已经计算好的模型文件指纹，不等待计算
+
+        没有缓存（或文件已改变）的文件在后台计算采样指纹，下次查询时返回
+
+        参数:
+            model_type: 模型类型
+            names: 模型文件名列表
+            full_hash: 是否在后台排队计算完整sha256（读取整个文件，默认不计算）
+
+        返回值:
+            dict: 文件名 -> {'fingerprint', 'sha256'}，只包含已计算的文件，sha256未计算时为None
+        """
+        fingerprints = {}
+        for name in names:
+            file_path = folder_paths.get_full_path(model_type, name)
+            if file_path is None:
+                continue
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            entry = self._get_valid_entry(file_path, st)
+            if entry is None:
+                self.request_fingerprint(file_path, full_hash)
+                continue
+            fingerprints[name] = {
+                'fingerprint': entry['fingerprint'],
+                'sha256': entry['sha256'],
+            }
+            if full_hash and entry['sha256'] is None:
+                self.request_full_hash(file_path)
+        return fingerprints
+
+    def request_full_hash(self, file_path):
+        """将文件加入后台完整哈希队列"""
+        with self.lock:
+            if file_path in self.full_hash_pending:
+                return
+            self.full_hash_pending.add(file_path)
+            if self.full_hash_thread is None or not self.full_hash_thread.is_alive():
+                self.full_hash_thread = threading.Thread(
+                    target=self._full_hash_worker,
+                    name='Model-Full-Hash-Thread',
+                    daemon=True
+                )
+                self.full_hash_thread.start()
+            self.full_hash_queue.put(file_path)
+
+    def _full_hash_worker(self):
+        while True:
+            try:
+                file_path = self.full_hash_queue.get(timeout=30)
+            except queue.Empty:
+                with self.lock:
+                    if self.full_hash_queue.empty():
+                        self.full_hash_thread = None
+                        return
+                continue
+            try:
+                st = os.stat(file_path)
+                sha256 = calculate_full_hash(file_path)
+                with self.lock:
+                    entry = self.entries.get(file_path)
+                    # 计算期间文件被修改则丢弃结果
+                    if entry is not None and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+                        entry['sha256'] = sha256
+                self._save()
+            except Exception as e:
+                print(f"Error processing {file_path}: {e}")
+            finally:
+                with self.lock:
+                    self.full_hash_pending.discard(file_path)
+
+
+model_fingerprints = ModelFingerprintCatalog()
@@ -0,0 +1,291 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+
+from server_config import get_config
+
+_cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
+_profile_file = os.path.join(_cache_dir, 'node_profile.json')
+
+# 连接断开后重连的间隔（秒）
+_RECONNECT_INTERVAL = 5.0
+
+
+def get_structure_hash(prompt):
+    """工作流结构（节点ID和类型）的哈希，修改模板增删或替换节点后得到不同的值"""
+    nodes = sorted((str(node_id), node.get('class_type', '')) for node_id, node in prompt.items())
+    return hashlib.sha1(json.dumps(nodes).encode('utf-8')).hexdigest()[:8]
+
+
+class NodeProfiler:
+    """
+    节点耗时统计
+
+    接收ComfyUI推送的 execution_start / executing / execution_cached / execution_success 事件，
+    一个节点的耗时为它开始执行到下一个节点开始执行（或任务结束）的时间。
+    只统计本服务器提交并登记过的任务，完成的任务按 工作流 + 模板结构 + 参数分组（分辨率、步数、时长）累计，
+    保存到磁盘，修改模板前后的统计分开记录。
+
+    事件可能在ComfyUI的执行线程中处理（comfy_bridge），统计只在内存中累计，
+    由保存线程每 node_profile_save_interval 秒合并保存一次。
+    """
+
+    def __init__(self, profile_file=None, max_tracked=1000):
+        self.profile_file = profile_file or _profile_file
+        self.max_tracked = max_tracked
+        self.lock = threading.Lock()
+        # prompt_id: 执行中的任务信息
+        self.tracked = collections.OrderedDict()
+        self.stats: dict = {}
+        self.thread = None
+        # 已开始接收事件（/ws 或 comfy_bridge）
+        self.started = False
+        # 统计已修改还没有保存
+        self.dirty = False
+        self.save_thread = None
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.profile_file):
+            return
+        try:
+            with open(self.profile_file, 'r', encoding='utf-8') as f:
+                self.stats = json.loads(f.read())
+        except Exception as e:
+            print(f"节点耗时统计读取失败：{e}")
+            self.stats = {}
+
+    def _save(self):
+        with self.lock:
+            self.dirty = False
+            data = json.dumps(self.stats, ensure_ascii=False)
+        try:
+            os.makedirs(os.path.dirname(self.profile_file), exist_ok=True)
+            tmp_file = self.profile_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_file, self.profile_file)
+        except Exception as e:
+            print(f"节点耗时统计保存失败：{e}")
+
+    def _request_save(self):
+        """标记统计已修改，由保存线程延迟合并保存（调用时已持有 self.lock）"""
+        self.dirty = True
+        if self.save_thread is None or not self.save_thread.is_alive():
+            self.save_thread = threading.Thread(
+                target=self._save_loop,
+                name='Node-Profiler-Save-Thread',
+                daemon=True
+            )
+            self.save_thread.start()
+
+    def _save_loop(self):
+        while True:
+            time.sleep(get_config('node_profile_save_interval'))
+            with self.lock:
+                if not self.dirty:
+                    self.save_thread = None
+                    return
+            self._save()
+
+    def flush(self):
+        """立即保存未保存的统计（停止服务器时）"""
+        with self.lock:
+            dirty = self.dirty
+        if dirty:
+            self._save()
+
+    def track(self, prompt_id, prompt, workflow, bucket):
+        """
+        登记提交到ComfyUI的任务
+
+        Args:
+            prompt: 工作流（API格式）
+            workflow: 工作流名称
+            bucket: 参数分组，如 {'resolution': '832x480', 'step': 4, 'seconds': 5}
+        """
+        with self.lock:
+            self.tracked.pop(prompt_id, None)
+            self.tracked[prompt_id] = {
+                'workflow': workflow,
+                'bucket': bucket,
+                'structure': get_structure_hash(prompt),
+                'class_types': {str(node_id): node.get('class_type', '') for node_id, node in prompt.items()},
+                'started': None,
+                'current': None,
+                'nodes': {},
+                'cached': set(),
+            }
+            while len(self.tracked) > self.max_tracked:
+                self.tracked.popitem(last=False)
+
+    def _enter_node(self, run, node_id, now):
+        if run['started'] is None:
+            run['started'] = now
+        if run['current'] is not None:
+            current, since = run['current']
+            run['nodes'][current] = run['nodes'].get(current, 0.0) + (now - since) * 1000
+        run['current'] = (node_id, now) if node_id is not None else None
+
+    def handle_message(self, message, now=None):
+        """
+        处理ComfyUI推送的一条消息
+
+        Args:
+            message: {'type': ..., 'data': {...}}
+            now: 收到消息的时间（秒），默认为当前时间
+        """
+        now = time.monotonic() if now is None else now
+        data = message.get('data') or {}
+        prompt_id = data.get('prompt_id')
+        message_type = message.get('type')
+        finished = None
+        with self.lock:
+            run = self.tracked.get(prompt_id)
+            if run is None:
+                return
+            if message_type == 'execution_start':
+                run['started'] = now
+            elif message_type == 'execution_cached':
+                run['cached'].update(str(node_id) for node_id in data.get('nodes') or [])
+            elif message_type == 'executing':
+                node_id = data.get('node')
+                self._enter_node(run, str(node_id) if node_id is not None else None, now)
+                if node_id is None:
+                    finished = self.tracked.pop(prompt_id)
+            elif message_type == 'execution_success':
+                self._enter_node(run, None, now)
+                finished = self.tracked.pop(prompt_id)
+            elif message_type in ('execution_error', 'execution_interrupted'):
+                # 失败或中断的任务耗时不完整，不计入统计
+                self.tracked.pop(prompt_id)
+            if finished is not None and finished['started'] is not None:
+                self._add_run(finished, now)
+                self._request_save()
+
+    def _add_run(self, run, now):
+        bucket = run['bucket'] or {}
+        key = json.dumps([run['workflow'], run['structure'], bucket], ensure_ascii=False, sort_keys=True)
+        entry = self.stats.get(key)
+        if entry is None:
+            entry = {
+                'workflow': run['workflow'],
+                'structure': run['structure'],
+                'bucket': bucket,
+                'count': 0,
+                'total_ms': 0.0,
+                'nodes': {},
+            }
+            self.stats[key] = entry
+        entry['count'] += 1
+        entry['total_ms'] += (now - run['started']) * 1000
+        entry['updated'] = int(time.time() * 1000)
+        for node_id in set(run['nodes']) | run['cached']:
+            node = entry['nodes'].setdefault(node_id, {
+                'class_type': run['class_types'].get(node_id, ''),
+                'count': 0,
+                'cached': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+            })
+            ms = run['nodes'].get(node_id)
+            if ms is None:
+                node['cached'] += 1
+                continue
+            node['count'] += 1
+            node['total_ms'] += ms
+            node['max_ms'] = max(node['max_ms'], ms)
+
+    def summary(self, workflow=None):
+        """
+        按分组返回统计，节点按平均耗时从大到小排列，并按 class_type 汇总
+
+        返回值:
+            list: 按工作流、最近更新时间排列
+        """
+        with self.lock:
+            entries = [json.loads(json.dumps(entry)) for entry in self.stats.values()
+                       if workflow is None or entry['workflow'] == workflow]
+        results = []
+        for entry in entries:
+            count = entry['count']
+            total_ms = entry['total_ms']
+            nodes = []
+            class_types = {}
+            for node_id, node in entry['nodes'].items():
+                node_total = node['total_ms']
+                nodes.append({
+                    'node': node_id,
+                    'class_type': node['class_type'],
+                    'count': node['count'],
+                    'cached': node['cached'],
+                    'mean_ms': round(node_total / count, 1) if count > 0 else 0.0,
+                    'max_ms': round(node['max_ms'], 1),
+                    'share': round(node_total / total_ms, 4) if total_ms > 0 else 0.0,
+                })
+                class_types[node['class_type']] = class_types.get(node['class_type'], 0.0) + node_total
+            nodes.sort(key=lambda x: -x['mean_ms'])
+            results.append({
+                'workflow': entry['workflow'],
+                'structure': entry['structure'],
+                'bucket': entry['bucket'],
+                'count': count,
+                'mean_ms': round(total_ms / count, 1) if count > 0 else 0.0,
+                'updated': entry.get('updated'),
+                'nodes': nodes,
+                'class_types': [
+                    {'class_type': class_type, 'mean_ms': round(ms / count, 1) if count > 0 else 0.0,
+                     'share': round(ms / total_ms, 4) if total_ms > 0 else 0.0}
+                    for class_type, ms in sorted(class_types.items(), key=lambda x: -x[1])
+                ],
+            })
+        results.sort(key=lambda x: (x['workflow'] or '', -(x['updated'] or 0)))
+        return results
+
+    def start(self, address_func, client_id, add_listener=None):
+        """
+        开始接收执行事件：在ComfyUI进程中时登记事件监听，否则在后台线程中连接ComfyUI的 /ws，断开后自动重连
+
+        重复调用不会重复登记
+
+        Args:
+            address_func: 获取ComfyUI地址（host:port）
+            client_id: 提交任务时使用的 client_id，ComfyUI只向它推送这些任务的事件
+            add_listener: 登记ComfyUI执行事件的监听函数（comfy_bridge.add_listener），为None时连接 /ws
+        """
+        if not get_config('node_profile_enabled'):
+            return
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        if add_listener is not None:
+            add_listener(self.handle_message)
+            return
+        self.thread = threading.Thread(
+            target=self._run,
+            args=(address_func, client_id),
+            name='Node-Profiler-Thread',
+            daemon=True
+        )
+        self.thread.start()
+
+    def _run(self, address_func, client_id):
+        try:
+            from websockets.sync.client import connect
+        except ImportError:
+            print("未安装 websockets，节点耗时统计不可用")
+            return
+        while True:
+            try:
+                with connect(f"ws://{address_func()}/ws?clientId={client_id}", max_size=None) as ws:
+                    for message in ws:
+                        # 二进制消息是预览图像
+                        if isinstance(message, str):
+                            self.handle_message(json.loads(message))
+            except Exception as e:
+                print(f"ComfyUI事件连接断开：{e}")
+            time.sleep(_RECONNECT_INTERVAL)
@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+
+from server_config import get_config
+
+# 从输入目录加载的文件输入（值为输入目录中的文件名）
+_input_file_keys = {
+    'LoadImage': 'image',
+    'LoadImageMask': 'image',
+}
+
+
+def _get_combo_options(spec):
+    """获取下拉框的选项，非下拉框返回None"""
+    if len(spec) == 0:
+        return None
+    if isinstance(spec[0], list):
+        return spec[0]
+    if spec[0] == 'COMBO' and len(spec) > 1 and isinstance(spec[1], dict):
+        return spec[1].get('options')
+    return None
+
+
+def _is_link(value):
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+
+def _validate_value(node_id, class_type, key, value, spec, errors, refreshable):
+    if _is_link(value):
+        return
+    options = _get_combo_options(spec)
+    if options is not None:
+        if value not in options:
+            errors.append(f"{node_id}({class_type}).{key}: '{value}' 不在可选值中")
+            refreshable.append(True)
+        return
+
+    input_type = spec[0] if len(spec) > 0 else None
+    options = spec[1] if len(spec) > 1 and isinstance(spec[1], dict) else {}
+    if input_type in ('INT', 'FLOAT'):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            errors.append(f"{node_id}({class_type}).{key}: {value!r} 不是数值")
+            return
+        if input_type == 'INT' and isinstance(value, float) and not value.is_integer():
+            errors.append(f"{node_id}({class_type}).{key}: {value!r} 不是整数")
+        if 'min' in options and value < options['min']:
+            errors.append(f"{node_id}({class_type}).{key}: {value} 小于最小值 {options['min']}")
+        if 'max' in options and value > options['max']:
+            errors.append(f"{node_id}({class_type}).{key}: {value} 大于最大值 {options['max']}")
+    elif input_type == 'STRING':
+        if not isinstance(value, str):
+            errors.append(f"{node_id}({class_type}).{key}: {value!r} 不是字符串")
+    elif input_type == 'BOOLEAN':
+        if not isinstance(value, bool):
+            errors.append(f"{node_id}({class_type}).{key}: {value!r} 不是布尔值")
+
+
+def _get_executed_nodes(prompt, object_info):
+    """与ComfyUI一致，只有输出节点及其上游节点会被执行和校验"""
+    outputs = [x for x, node in prompt.items()
+               if object_info.get(node.get('class_type'), {}).get('output_node', False)]
+    if len(outputs) == 0:
+        return list(prompt.keys())
+    visited = set()
+    stack = list(outputs)
+    while stack:
+        x = stack.pop()
+        if x in visited or x not in prompt:
+            continue
+        visited.add(x)
+        for value in prompt[x].get('inputs', {}).values():
+            if _is_link(value):
+                stack.append(value[0])
+    return [x for x in prompt if x in visited]
+
+
+def validate_prompt(prompt, object_info, input_dir=None):
+    """
+    按 object_info 在本地校验工作流
+
+    返回值:
+        (errors, refreshable): 错误列表，以及是否存在刷新 object_info 后可能消失的错误（未知节点、下拉框值）
+    """
+    errors = []
+    refreshable = []
+    unknown = [x for x, node in prompt.items() if node.get('class_type') not in object_info]
+    for node_id in unknown:
+        errors.append(f"{node_id}: 未知的节点类型 {prompt[node_id].get('class_type')}")
+        refreshable.append(True)
+
+    for node_id in _get_executed_nodes(prompt, object_info):
+        if node_id in unknown:
+            continue
+        node = prompt[node_id]
+        class_type = node.get('class_type')
+        inputs = node.get('inputs', {})
+
+        input_specs = object_info[class_type].get('input', {})
+        required = input_specs.get('required', {})
+        optional = input_specs.get('optional', {})
+        for key in required:
+            if key not in inputs:
+                errors.append(f"{node_id}({class_type}): 缺少输入 {key}")
+
+        for key, value in inputs.items():
+            if _is_link(value):
+                if value[0] not in prompt:
+                    errors.append(f"{node_id}({class_type}).{key}: 连接的节点 {value[0]} 不存在")
+                continue
+            if input_dir is not None and _input_file_keys.get(class_type) == key:
+                # 上传后 object_info 中的列表不会更新，直接检查输入目录（带 [output] 等标注的路径交给ComfyUI处理）
+                if isinstance(value, str) and value.endswith(']'):
+                    continue
+                if not isinstance(value, str) or not os.path.isfile(os.path.join(input_dir, value)):
+                    errors.append(f"{node_id}({class_type}).{key}: 输入文件 {value} 不存在")
+                continue
+            spec = required.get(key, optional.get(key))
+            if spec is not None:
+                _validate_value(node_id, class_type, key, value, spec, errors, refreshable)
+    return errors, len(refreshable) > 0
+
+
+class PromptValidator:
+    """
+    提交前校验
+
+    缓存ComfyUI的 object_info，校验节点类型、下拉框取值、数值范围、连线和输入文件。
+    出现未知节点或下拉框值时（可能是新增了模型），按最小间隔刷新一次缓存后重新校验。
+    """
+
+    def __init__(self, fetch_func):
+        """
+        Args:
+            fetch_func: 获取ComfyUI的 object_info
+        """
+        self.fetch_func = fetch_func
+        self.lock = threading.Lock()
+        self.object_info = None
+        self.fetched_at = 0
+
+    def get_object_info(self, refresh=False):
+        with self.lock:
+            now = time.monotonic()
+            expired = now - self.fetched_at > get_config('object_info_ttl')
+            can_refresh = now - self.fetched_at > get_config('object_info_min_refresh_interval')
+            if self.object_info is None or expired or (refresh and can_refresh):
+                try:
+                    self.object_info = self.fetch_func()
+                    self.fetched_at = now
+                except Exception as e:
+                    print(f"获取object_info失败：{e}")
+            return self.object_info
+
+    def validate(self, prompt, input_dir=None):
+        """
+        返回值:
+            list: 错误列表，无法获取 object_info 时不校验，返回空列表
+        """
+        if not get_config('preflight_enabled'):
+            return []
+        object_info = self.get_object_info()
+        if object_info is None:
+            return []
+        errors, refreshable = validate_prompt(prompt, object_info, input_dir)
+        if len(errors) > 0 and refreshable:
+            refreshed = self.get_object_info(refresh=True)
+            if refreshed is not object_info:
+                errors, _ = validate_prompt(prompt, refreshed, input_dir)
+        return errors
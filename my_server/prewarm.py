@@ -0,0 +1,230 @@
+import collections
+import json
+import os
+import threading
+import time
+import uuid
+
+from scheduler import get_model_key
+from server_config import get_config
+
+_cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
+_enqueue_log_file = os.path.join(_cache_dir, 'enqueue_log.jsonl')
+
+# 检查是否空闲的间隔（秒）
+_CHECK_INTERVAL = 1.0
+
+
+class RequestMix:
+    """
+    请求构成统计
+
+    每次提交追加一条 (时间, 工作流, 模型) 到提交日志，启动时读取最近的记录，
+    按时间衰减加权统计各 工作流+模型 的请求比例。
+    """
+
+    def __init__(self, log_file=None, max_entries=1000):
+        self.log_file = log_file or _enqueue_log_file
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = collections.deque(maxlen=max_entries)
+        self.lines = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.log_file):
+            return
+        try:
+            with open(self.log_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries.append((entry['time'], entry['workflow'], entry.get('model')))
+                    self.lines += 1
+        except Exception as e:
+            print(f"提交日志读取失败：{e}")
+
+    def _rewrite(self):
+        """日志行数超过保留条数的2倍时只保留最近的记录"""
+        try:
+            tmp_file = self.log_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                for t, workflow, model in self.entries:
+                    f.write(json.dumps({'time': t, 'workflow': workflow, 'model': model}, ensure_ascii=False) + '\n')
+            os.replace(tmp_file, self.log_file)
+            self.lines = len(self.entries)
+        except Exception as e:
+            print(f"提交日志整理失败：{e}")
+
+    def record(self, workflow, model, t=None):
+        t = time.time() if t is None else t
+        with self.lock:
+            self.entries.append((t, workflow, model))
+            try:
+                os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
+                with open(self.log_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'time': t, 'workflow': workflow, 'model': model}, ensure_ascii=False) + '\n')
+                self.lines += 1
+            except Exception as e:
+                print(f"提交日志保存失败：{e}")
+            if self.lines > self.max_entries * 2:
+                self._rewrite()
+
+    def ranking(self, now=None, half_life=None):
+        """
+        返回值:
+            list: [((工作流, 模型), 权重)]，按权重从大到小
+        """
+        now = time.time() if now is None else now
+        half_life = get_config('prewarm_half_life') if half_life is None else half_life
+        scores = {}
+        with self.lock:
+            for t, workflow, model in self.entries:
+                weight = 0.5 ** (max(0.0, now - t) / half_life)
+                scores[(workflow, model)] = scores.get((workflow, model), 0.0) + weight
+        return sorted(scores.items(), key=lambda x: -x[1])
+
+
+class ModelPrewarmer:
+    """
+    空闲时预热模型
+
+    ComfyUI和调度器都空闲 prewarm_idle_seconds 秒后，按请求构成选出最可能的下一个 工作流+模型，
+    提交一个最小的预热任务（低分辨率、1步），让ComfyUI提前加载模型。
+    当前已加载的就是该模型时不预热；每小时最多预热 prewarm_max_per_hour 次；
+    预热期间有使用其他模型的任务提交时立即取消预热。
+    """
+
+    def __init__(self, mix, scheduler, build_func, submit_func, cancel_func, finish_func):
+        """
+        Args:
+            mix: RequestMix
+            scheduler: PromptScheduler，用于判断是否空闲和记录当前加载的模型
+            build_func: 生成预热用的工作流，参数为 (工作流, 模型)，不能预热时返回None
+            submit_func: 提交预热任务，参数为 (prompt_id, 工作流)
+            cancel_func: 取消预热任务，参数为 prompt_id
+            finish_func: 预热任务结束后的清理（删除ComfyUI中的历史），参数为 prompt_id
+        """
+        self.mix = mix
+        self.scheduler = scheduler
+        self.build_func = build_func
+        self.submit_func = submit_func
+        self.cancel_func = cancel_func
+        self.finish_func = finish_func
+        self.lock = threading.Lock()
+        self.warm_prompt_id = None
+        self.warm_model_key = None
+        self.warm_times = collections.deque()
+        self.idle_since = None
+        self.last_activity = time.monotonic()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(
+                target=self._run,
+                name='Model-Prewarm-Thread',
+                daemon=True
+            )
+            self.thread.start()
+
+    def on_enqueue(self, workflow, model, model_key):
+        """有新任务提交：记录请求构成，使用其他模型时取消正在进行的预热"""
+        self.mix.record(workflow, model)
+        with self.lock:
+            self.last_activity = time.monotonic()
+            self.idle_since = None
+            prompt_id = self.warm_prompt_id
+            cancel = prompt_id is not None and self.warm_model_key != model_key
+            if cancel:
+                self.warm_model_key = None
+        if cancel:
+            try:
+                self.cancel_func(prompt_id)
+            except Exception as e:
+                print(f"取消预热任务失败：{prompt_id} {e}")
+
+    def select(self):
+        """
+        选出要预热的 工作流+模型
+
+        返回值:
+            (prompt, model_key)，最可能的模型已经加载或无法预热时返回None
+        """
+        for (workflow, model), _ in self.mix.ranking():
+            prompt = self.build_func(workflow, model)
+            if prompt is None:
+                continue
+            model_key = get_model_key(prompt)
+            if model_key == self.scheduler.last_model_key:
+                return None
+            return prompt, model_key
+        return None
+
+    def _check(self):
+        try:
+            queue_size = self.scheduler.queue_size_func()
+        except Exception:
+            return
+        now = time.monotonic()
+        finished = None
+        with self.lock:
+            if self.warm_prompt_id is not None:
+                if queue_size > 0:
+                    return
+                finished = self.warm_prompt_id
+                self.warm_prompt_id = None
+                self.idle_since = now
+            elif queue_size > 0 or not self.scheduler.is_idle():
+                self.idle_since = None
+                return
+            elif self.idle_since is None:
+                self.idle_since = now
+        if finished is not None:
+            try:
+                self.finish_func(finished)
+            except Exception as e:
+                print(f"预热任务清理失败：{finished} {e}")
+            return
+
+        with self.lock:
+            if now - max(self.idle_since, self.last_activity) < get_config('prewarm_idle_seconds'):
+                return
+            while len(self.warm_times) > 0 and now - self.warm_times[0] > 3600:
+                self.warm_times.popleft()
+            if len(self.warm_times) >= get_config('prewarm_max_per_hour'):
+                return
+
+        selected = self.select()
+        if selected is None:
+            return
+        prompt, model_key = selected
+        prompt_id = str(uuid.uuid4())
+        with self.lock:
+            # 选择期间有任务提交时放弃
+            if self.last_activity > now or self.idle_since is None:
+                return
+            self.warm_prompt_id = prompt_id
+            self.warm_model_key = model_key
+            self.warm_times.append(now)
+        try:
+            self.submit_func(prompt_id, prompt)
+            self.scheduler.last_model_key = model_key
+            print(f"预热模型：{model_key}")
+        except Exception as e:
+            print(f"预热任务提交失败：{e}")
+            with self.lock:
+                self.warm_prompt_id = None
+                self.warm_model_key = None
+
+    def _run(self):
+        while True:
+            time.sleep(_CHECK_INTERVAL)
+            if not get_config('prewarm_enabled'):
+                continue
+            try:
+                self._check()
+            except Exception as e:
+                print(f"预热检查失败：{e}")
@@ -0,0 +1,61 @@
+import json
+import os
+import threading
+
+_cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
+_aliases_file = os.path.join(_cache_dir, 'request_id_aliases.json')
+
+
+class RequestIdAliases:
+    """
+    请求ID别名
+
+    参数ID改为按规范化参数计算后，旧结果的文件名中仍是按原始参数计算的请求ID。
+    提交时发现旧ID下已有结果，就记录 新请求ID -> 旧请求ID，之后按新ID查找结果时同时查找旧ID，
+    已生成的结果不需要重新生成，也不需要重命名文件。
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file or _aliases_file
+        self.lock = threading.Lock()
+        self.aliases: dict = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                self.aliases = json.loads(f.read())
+        except Exception as e:
+            print(f"请求ID别名读取失败：{e}")
+            self.aliases = {}
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp_file = self.cache_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(self.aliases))
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            print(f"请求ID别名保存失败：{e}")
+
+    def resolve(self, request_id):
+        """返回请求ID及其旧ID"""
+        with self.lock:
+            legacy_ids = self.aliases.get(request_id, [])
+        return [request_id] + [x for x in legacy_ids if x != request_id]
+
+    def add(self, request_id, legacy_request_id):
+        if request_id == legacy_request_id:
+            return
+        with self.lock:
+            legacy_ids = self.aliases.setdefault(request_id, [])
+            if legacy_request_id in legacy_ids:
+                return
+            legacy_ids.append(legacy_request_id)
+            self._save()
+
+
+request_aliases = RequestIdAliases()
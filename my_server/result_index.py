@@ -0,0 +1,190 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+import folder_paths
+from PIL import Image
+
+_cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
+_index_file = os.path.join(_cache_dir, 'result_index.jsonl')
+
+
+def get_media_type(filename):
+    return "video/mp4" if filename.endswith(".mp4") else "image/png"
+
+
+class ResultIndex:
+    """
+    结果索引
+
+    记录每个请求的全部输出文件（相对输出目录的路径和大小），追加写入 JSONL 文件，
+    启动时按顺序读取，同一请求ID的后一条记录覆盖前一条。
+    每条记录带有递增的序号，作为按时间倒序分页的游标，新增记录不影响已返回的游标。
+    """
+
+    def __init__(self, index_file=None):
+        self.index_file = index_file or _index_file
+        self.lock = threading.Lock()
+        self.entries: dict = {}
+        # 按序号排列的 (序号, 请求ID)，None 为全部，('workflow', x) / ('media', x) 为按条件分组，用于分页
+        self.orders: dict = {None: []}
+        self.next_seq = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.index_file):
+            return
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if len(line) == 0:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 写入中断留下的不完整行
+                        continue
+                    entry.setdefault('seq', self.next_seq)
+                    self.next_seq = max(self.next_seq, entry['seq'] + 1)
+                    self.entries.pop(entry['request_id'], None)
+                    if not entry.get('removed', False):
+                        self.entries[entry['request_id']] = entry
+                        self._add_order(entry)
+        except Exception as e:
+            print(f"结果索引读取失败：{e}")
+
+    def _add_order(self, entry):
+        item = (entry['seq'], entry['request_id'])
+        self.orders[None].append(item)
+        for key in [('workflow', entry.get('workflow')), ('media', entry.get('media_type'))]:
+            self.orders.setdefault(key, []).append(item)
+
+    def _append(self, entry):
+        try:
+            os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+            with open(self.index_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        except Exception as e:
+            print(f"结果索引保存失败：{e}")
+
+    def add(self, request_id, prompt_id, files, workflow=None, parameters=None):
+        """
+        记录请求的输出文件
+
+        Args:
+            request_id: 请求ID（输出文件名中的ID）
+            prompt_id: 参数ID
+            files: 输出文件的完整路径，按输出顺序
+            workflow: 工作流名称
+            parameters: 请求参数
+        """
+        output_dir = folder_paths.get_output_directory()
+        items = []
+        for file_path in files:
+            media_type = get_media_type(str(file_path))
+            width, height = None, None
+            if media_type.startswith('image/'):
+                try:
+                    # 只读取文件头
+                    with Image.open(file_path) as image:
+                        width, height = image.size
+                except Exception as e:
+                    print(f"读取图像尺寸失败：{file_path} {e}")
+            items.append({
+                'name': os.path.basename(file_path),
+                'path': os.path.relpath(file_path, output_dir).replace(os.sep, '/'),
+                'size': os.path.getsize(file_path),
+                'media_type': media_type,
+                'width': width,
+                'height': height,
+            })
+        entry = {
+            'request_id': request_id,
+            'prompt_id': prompt_id,
+            'workflow': workflow,
+            'media_type': items[0]['media_type'] if len(items) > 0 else None,
+            'created': int(time.time() * 1000),
+            'files': items,
+            'parameters': parameters,
+        }
+        with self.lock:
+            entry['seq'] = self.next_seq
+            self.next_seq += 1
+            self.entries.pop(request_id, None)
+            self.entries[request_id] = entry
+            self._add_order(entry)
+            self._append(entry)
+        return entry
+
+    def remove(self, request_id):
+        with self.lock:
+            if self.entries.pop(request_id, None) is not None:
+                self._append({'request_id': request_id, 'removed': True, 'seq': self.next_seq})
+                self.next_seq += 1
+
+    def page(self, cursor=None, limit=50, workflow=None, media=None):
+        """
+        按时间从新到旧分页
+
+        Args:
+            cursor: 上一页返回的游标（序号），None 为第一页
+            limit: 每页数量
+            workflow / media: 只返回指定工作流 / 媒体类型（image、video 或完整的 media_type）的结果
+
+        返回值:
+            (entries, next_cursor): 没有下一页时 next_cursor 为None
+        """
+        if media is not None and '/' not in media:
+            media = {'image': 'image/png', 'video': 'video/mp4'}.get(media, media)
+        with self.lock:
+            if workflow is not None:
+                order = self.orders.get(('workflow', workflow), [])
+            elif media is not None:
+                order = self.orders.get(('media', media), [])
+            else:
+                order = self.orders[None]
+            # 序号递增，二分查找游标位置，每页只访问本页的记录（以及被覆盖/删除的旧记录）
+            i = len(order) if cursor is None else bisect.bisect_left(order, (cursor,))
+            entries = []
+            while i > 0 and len(entries) < limit:
+                i -= 1
+                seq, request_id = order[i]
+                entry = self.entries.get(request_id)
+                if entry is None or entry['seq'] != seq:
+                    continue
+                if media is not None and entry.get('media_type') != media:
+                    continue
+                entries.append(entry)
+            next_cursor = entries[-1]['seq'] if len(entries) == limit and i > 0 else None
+        return entries, next_cursor
+
+    def get(self, request_id):
+        with self.lock:
+            return self.entries.get(request_id)
+
+    def get_files(self, request_id):
+        """
+        返回值:
+            list: (完整路径, 文件信息)，记录不存在或文件已被删除时返回空列表
+        """
+        entry = self.get(request_id)
+        if entry is None:
+            return []
+        output_dir = folder_paths.get_output_directory()
+        files = []
+        for item in entry['files']:
+            file_path = os.path.join(output_dir, item['path'])
+            if not os.path.isfile(file_path):
+                return []
+            files.append((file_path, item))
+        return files
+
+    def request_ids(self):
+        with self.lock:
+            return set(self.entries.keys())
+
+
+result_index = ResultIndex()
@@ -0,0 +1,198 @@
+import threading
+import time
+import urllib.error
+
+from server_config import get_config
+
+# 加载模型的节点输入（用于判断两个任务是否使用相同模型）
+_model_input_keys = ['ckpt_name', 'unet_name', 'model_name', 'clip_name', 'vae_name', 'lora_name']
+
+
+def get_model_key(prompt):
+    """提取工作流中加载器节点及其模型文件名，作为模型亲和的分组键"""
+    models = []
+    for node in prompt.values():
+        class_type = node.get('class_type', '')
+        if 'Loader' not in class_type:
+            continue
+        inputs = node.get('inputs', {})
+        for key in _model_input_keys:
+            if key in inputs and isinstance(inputs[key], str):
+                models.append((class_type, key, inputs[key]))
+    return tuple(sorted(models))
+
+
+def count_model_switches(model_keys):
+    """统计按顺序执行时的模型切换次数"""
+    switches = 0
+    last = None
+    for key in model_keys:
+        if last is not None and key != last:
+            switches += 1
+        last = key
+    return switches
+
+
+class ScheduledJob:
+    def __init__(self, prompt_id, prompt, client_id, workflow=None):
+        self.prompt_id = prompt_id
+        self.prompt = prompt
+        self.client_id = client_id
+        self.workflow = workflow
+        self.model_key = get_model_key(prompt)
+        self.enqueued_at = time.monotonic()
+        # 第一次被后到的任务插队的时间
+        self.bypassed_at = None
+
+
+def select_next(jobs, last_model_key, now, window, max_wait):
+    """
+    从待提交任务中选出下一个任务
+
+    只在前 window 个任务内重排：优先选择与上一个任务模型相同的任务，没有则按到达顺序提交。
+    任务第一次被插队后，最多再等待 max_wait 秒就会被优先提交。
+    """
+    if len(jobs) == 0:
+        return None
+    candidates = jobs[:max(1, window)]
+    oldest = candidates[0]
+    if oldest.bypassed_at is not None and now - oldest.bypassed_at >= max_wait:
+        return oldest
+    for i, job in enumerate(candidates):
+        if job.model_key == last_model_key:
+            for skipped in candidates[:i]:
+                if skipped.bypassed_at is None:
+                    skipped.bypassed_at = now
+            return job
+    return oldest
+
+
+class PromptScheduler:
+    """
+    提交调度器
+
+    任务先进入本地等待队列，ComfyUI队列中的任务少于 scheduler_max_inflight 时，
+    按模型亲和从重排窗口内选择下一个任务提交，减少大模型的反复加载。
+    """
+
+    def __init__(self, submit_func, queue_size_func):
+        """
+        Args:
+            submit_func: 提交任务到ComfyUI，参数为 ScheduledJob
+            queue_size_func: 获取ComfyUI当前的任务数（运行中+排队）
+        """
+        self.submit_func = submit_func
+        self.queue_size_func = queue_size_func
+        self.condition = threading.Condition()
+        self.jobs: list[ScheduledJob] = []
+        self.errors: dict = {}
+        self.submitting = set()
+        self.last_model_key = None
+        self.submitted_model_keys = []
+        self.thread = None
+
+    def schedule(self, job: ScheduledJob):
+        """加入等待队列；未启用重排时直接提交"""
+        if get_config('scheduler_window') <= 0:
+            return self._submit(job)
+        with self.condition:
+            self.jobs.append(job)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._run,
+                    name='Prompt-Scheduler-Thread',
+                    daemon=True
+                )
+                self.thread.start()
+            self.condition.notify()
+        return True
+
+    def is_pending(self, prompt_id):
+        with self.condition:
+            if prompt_id in self.submitting:
+                return True
+            return any(job.prompt_id == prompt_id for job in self.jobs)
+
+    def pending_ids(self):
+        """等待提交的任务（按加入顺序）"""
+        with self.condition:
+            return list(self.submitting) + [job.prompt_id for job in self.jobs]
+
+    def is_idle(self):
+        """等待队列为空且没有正在提交的任务"""
+        with self.condition:
+            return len(self.jobs) == 0 and len(self.submitting) == 0
+
+    def get_position(self, prompt_id):
+        """任务在等待队列中的位置，不在队列中时返回None"""
+        with self.condition:
+            for i, job in enumerate(self.jobs):
+                if job.prompt_id == prompt_id:
+                    return i
+        return None
+
+    def remove(self, prompt_id):
+        """从等待队列中移除任务，返回被移除的任务"""
+        with self.condition:
+            for job in self.jobs:
+                if job.prompt_id == prompt_id:
+                    self.jobs.remove(job)
+                    return job
+        return None
+
+    def notify(self):
+        """ComfyUI队列有空位时唤醒调度线程"""
+        with self.condition:
+            self.condition.notify()
+
+    def pop_error(self, prompt_id):
+        with self.condition:
+            return self.errors.pop(prompt_id, None)
+
+    def _submit(self, job):
+        try:
+            self.submit_func(job)
+            self.last_model_key = job.model_key
+            self.submitted_model_keys.append(job.model_key)
+            del self.submitted_model_keys[:-1000]
+            return True
+        except urllib.error.HTTPError as e:
+            error = e.read().decode('utf-8', errors='replace')
+            print(f"任务提交失败：{job.prompt_id} {e.code} {error}")
+            with self.condition:
+                self.errors[job.prompt_id] = error
+        except Exception as e:
+            print(f"任务提交失败：{job.prompt_id} {e}")
+            with self.condition:
+                self.errors[job.prompt_id] = str(e)
+        return False
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while len(self.jobs) == 0:
+                    self.condition.wait()
+
+            try:
+                queue_size = self.queue_size_func()
+            except Exception as e:
+                print(f"获取ComfyUI队列失败：{e}")
+                queue_size = None
+
+            if queue_size is None or queue_size >= get_config('scheduler_max_inflight'):
+                with self.condition:
+                    self.condition.wait(get_config('scheduler_poll_interval'))
+                continue
+
+            with self.condition:
+                job = select_next(self.jobs, self.last_model_key, time.monotonic(),
+                                  get_config('scheduler_window'), get_config('scheduler_max_wait'))
+                if job is None:
+                    continue
+                self.jobs.remove(job)
+                self.submitting.add(job.prompt_id)
+            try:
+                self._submit(job)
+            finally:
+                with self.condition:
+                    self.submitting.discard(job.prompt_id)
@@ -0,0 +1,107 @@
+import json
+import os
+
+_config_file = os.path.join(os.path.dirname(__file__), 'config.json')
+
+# 默认配置，可在 my_server/config.json 中覆盖
+_defaults = {
+    # 按模型重排的窗口大小（0表示按提交顺序直接转发给ComfyUI）
+    'scheduler_window': 8,
+    # 任务被插队后的最长等待时间（秒），超过后不再为了模型亲和而推迟
+    'scheduler_max_wait': 30.0,
+    # ComfyUI中允许同时存在的任务数（运行中+排队）
+    'scheduler_max_inflight': 2,
+    # 调度线程轮询ComfyUI队列的间隔（秒）
+    'scheduler_poll_interval': 0.5,
+    # UltimateSDUpscale 分块规划使用的显存预算（MB），分块达到模型系列的边长上限后更大的预算不再改变规划
+    'upscale_memory_budget_mb': 6144,
+    # 批量提交的最大任务数
+    'batch_max_items': 1000,
+    # 提交前按 object_info 校验工作流
+    'preflight_enabled': True,
+    # object_info 缓存时间（秒）
+    'object_info_ttl': 600,
+    # 遇到未知节点/下拉框值时刷新 object_info 的最小间隔（秒）
+    'object_info_min_refresh_interval': 10,
+    # 取消正在执行的任务后，等待其结束并清理输出的最长时间（秒）
+    'cancel_cleanup_timeout': 300,
+    # 空闲时按请求构成预热模型
+    'prewarm_enabled': False,
+    # ComfyUI和调度器空闲多久（秒）后开始预热
+    'prewarm_idle_seconds': 30,
+    # 每小时最多预热次数
+    'prewarm_max_per_hour': 6,
+    # 统计请求构成时的半衰期（秒），越近的请求权重越大
+    'prewarm_half_life': 3600,
+    # 结果转移后删除ComfyUI中的任务历史
+    'history_prune_enabled': True,
+    # 删除前保留的时间（秒），同一个ComfyUI的其他客户端和调试时仍可以读取历史
+    'history_retention_seconds': 300,
+    # 每次删除的任务数
+    'history_prune_batch_size': 100,
+    # 批量删除的间隔（秒）
+    'history_prune_interval': 10,
+    # 重新扫描输入目录计算感知哈希的最小间隔（秒）
+    'phash_refresh_interval': 30,
+    # 记录请求（提交、状态、下载、上传）到 JSONL，用于重放
+    'traffic_record_enabled': False,
+    # 请求记录文件，默认为 my_server/cache/traffic.jsonl
+    'traffic_record_file': None,
+    # 统计各节点的执行耗时（连接ComfyUI的 /ws，在ComfyUI进程中时直接接收事件）
+    'node_profile_enabled': True,
+    # 节点耗时统计合并保存的间隔（秒），不在每个任务结束时写文件
+    'node_profile_save_interval': 10,
+    # 在ComfyUI进程中运行时直接操作其任务队列，不经过HTTP（进程外运行时自动使用HTTP）
+    'comfy_bridge_enabled': True,
+    # 执行时间模型中旧样本的权重衰减（每个新样本乘一次）
+    'eta_decay': 0.98,
+    # 没有任何样本时假定的执行时间（秒）
+    'eta_default_seconds': 60,
+    # 计算预计完成时间时ComfyUI队列的缓存时间（秒）
+    'eta_queue_cache_seconds': 1.0,
+    # 按负载降低 allow_degrade 请求的质量（需要开启，请求的 allow_degrade 不能代替服务器的设置）
+    'slo_enabled': False,
+    # 预计等待时间超过该值（秒）时降低质量
+    'slo_max_wait_seconds': 60,
+    # 长轮询（/api/jobs 的 wait 参数）在服务器内检查任务状态的间隔（秒），在ComfyUI进程中时由执行事件唤醒
+    'jobs_long_poll_interval': 0.25,
+    # 上传后在后台规范化输入图像（按EXIF方向旋转、缩小），生成时使用规范化的图像（需要开启）
+    'upload_normalize_enabled': False,
+    # 规范化缩小到的像素（百万），为None时取输入图像的工作流 defaultParameters 中最大的 megapixels
+    'upload_normalize_megapixels': None,
+    # 规范化的线程数
+    'upload_normalize_workers': 2,
+    # 生成时输入图像还在规范化的最长等待时间（秒），超时后使用原图
+    'upload_normalize_wait_seconds': 10,
+    # 没有ComfyUI任务结束事件（进程外运行）时，后台检查任务并执行后续处理的间隔（秒）
+    'job_watch_interval': 1.0,
+    # 放大请求的基础图像还没有生成时，先提交基础图像，完成后再提交只执行放大阶段的任务（基础图像可以先下载）
+    'upscale_chain_enabled': True,
+}
+
+__config: dict = {}
+__config_stamp = None
+
+
+def get_config(key, default=None):
+    """读取配置项，config.json 修改后自动重新加载"""
+    global __config, __config_stamp
+    stamp = None
+    if os.path.isfile(_config_file):
+        st = os.stat(_config_file)
+        stamp = (st.st_mtime_ns, st.st_size)
+    if stamp != __config_stamp:
+        config = {}
+        if stamp is not None:
+            try:
+                with open(_config_file, 'r', encoding='utf-8') as f:
+                    config = json.loads(f.read())
+            except Exception as e:
+                print(f"配置文件读取失败：{e}")
+        __config = config
+        __config_stamp = stamp
+    if key in __config:
+        return __config[key]
+    if key in _defaults:
+        return _defaults[key]
+    return default
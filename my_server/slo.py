@@ -0,0 +1,80 @@
+import math
+
+from eta import get_eta_features
+
+
+def plan_degradation(workflow, workflow_list, params, overload, predict_func=None):
+    """
+    按负载降低请求的质量
+
+    工作流在 model_map.json 的 degrade 中设置可以降低的范围：
+        fallback / fallbackAt: 预计等待时间超过上限的 fallbackAt 倍时改用更快的工作流（使用其默认模型、步数和CFG）
+        dropUpscale: 取消放大
+        minStep: 最少步数
+        minScale: 分辨率最小缩放比例（宽高按64取整）
+        minMegapixels: 最小像素（百万，按 megapixels 控制输出尺寸的工作流）
+    工作量按 1/overload 缩减，依次取消放大、减少步数、降低分辨率，每项都不超出设置的范围。
+
+    Args:
+        params: 规范化的请求参数（canonicalize_params 的结果）
+        overload: 预计等待时间 / 等待时间上限（大于1）
+        predict_func: 预计执行时间 (workflow, features) -> 毫秒，用于估算取消放大节省的时间
+
+    返回值:
+        (updates, changes): 请求字段的修改，以及 {字段: [原值, 新值]}；不能降低时都为空
+    """
+    workflow_info = workflow_list.get(workflow) or {}
+    spec = workflow_info.get('degrade')
+    if spec is None or overload <= 1:
+        return {}, {}
+
+    fallback = spec.get('fallback')
+    if fallback is not None and fallback in workflow_list and overload >= spec.get('fallbackAt', 2.0):
+        return {'workflow': fallback, 'model': None, 'step': None, 'cfg': None}, {'workflow': [workflow, fallback]}
+
+    def predict(p):
+        return predict_func(workflow, get_eta_features(p)) if predict_func is not None else None
+
+    factor = 1.0 / overload
+    updates = {}
+    changes = {}
+    current = dict(params)
+
+    upscale_factor = params.get('upscale_factor') or 1
+    if spec.get('dropUpscale', False) and upscale_factor > 1:
+        before = predict(current)
+        current['upscale_factor'] = 1
+        after = predict(current)
+        updates['upscale_factor'] = None
+        changes['upscale_factor'] = [upscale_factor, None]
+        # 取消放大节省的部分从需要缩减的工作量中扣除，无法估算时不再做其他降低
+        factor = factor * before / after if before and after else 1.0
+
+    step = params.get('step')
+    if factor < 1 and spec.get('minStep') and step:
+        new_step = max(spec['minStep'], math.ceil(step * factor))
+        if new_step < step:
+            updates['step'] = new_step
+            changes['step'] = [step, new_step]
+            factor = factor * step / new_step
+
+    width, height = params.get('width'), params.get('height')
+    if factor < 1 and spec.get('minScale') and width and height:
+        scale = max(spec['minScale'], math.sqrt(factor))
+        new_width = max(64, round(width * scale / 64) * 64)
+        new_height = max(64, round(height * scale / 64) * 64)
+        if new_width * new_height < width * height:
+            updates['img_width'] = new_width
+            updates['img_height'] = new_height
+            changes['img_width'] = [width, new_width]
+            changes['img_height'] = [height, new_height]
+            factor = factor * width * height / (new_width * new_height)
+
+    megapixels = params.get('megapixels')
+    if factor < 1 and spec.get('minMegapixels') and megapixels:
+        new_megapixels = max(spec['minMegapixels'], round(megapixels * factor, 2))
+        if new_megapixels < megapixels:
+            updates['megapixels'] = new_megapixels
+            changes['megapixels'] = [megapixels, new_megapixels]
+
+    return updates, changes
@@ -0,0 +1,103 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tile_planner import get_max_tile_edge, get_model_family, model_families, plan_tiles  # noqa: E402
+
+# (宽, 高, 放大倍数, 模型系列, 显存预算MB) -> (分块宽, 分块高, 列数, 行数, padding, mask_blur)
+PLAN_CASES = [
+    # 目标能放进一个分块时不切分
+    ((512, 512, 1.5, 'sd15', 6144), (768, 768, 1, 1, 48, 12)),
+    ((512, 768, 2.0, 'sd15', 6144), (1024, 768, 1, 2, 64, 16)),
+    ((1024, 1024, 2.0, 'sd15', 6144), (1024, 1024, 2, 2, 64, 16)),
+    ((1024, 1024, 4.0, 'sd15', 6144), (1024, 1024, 4, 4, 64, 16)),
+    ((720, 480, 2.0, 'sd15', 6144), (768, 960, 2, 1, 64, 16)),
+    # 显存不足时分块变小
+    ((1024, 1024, 2.0, 'sd15', 1024), (704, 704, 3, 3, 48, 12)),
+    ((640, 640, 2.0, 'sdxl', 6144), (1280, 1280, 1, 1, 80, 20)),
+    ((1024, 1024, 2.0, 'sdxl', 2048), (704, 704, 3, 3, 48, 12)),
+    ((1024, 1024, 4.0, 'sdxl', 16384), (1408, 1408, 3, 3, 88, 22)),
+    ((720, 480, 2.0, 'wan', 6144), (768, 960, 2, 1, 64, 16)),
+    ((1024, 1024, 2.0, 'wan', 1024), (384, 384, 6, 6, 32, 8)),
+    # 未知的系列按 sd15 规划
+    ((512, 512, 2.0, 'unknown', 6144), (1024, 1024, 1, 1, 64, 16)),
+]
+
+# 模型系列 -> 各显存预算（MB）下的最大分块边长
+EDGE_BUDGETS = [512, 1024, 2048, 4096, 6144, 8192, 16384]
+EDGE_CASES = {
+    'sd15': [512, 704, 1024, 1024, 1024, 1024, 1024],
+    'sdxl': [384, 576, 768, 1088, 1344, 1536, 1536],
+    'wan': [256, 384, 576, 896, 1088, 1216, 1280],
+}
+
+# 模型文件名 -> 模型系列
+FAMILY_CASES = [
+    ('v1-5-pruned-emaonly.safetensors', 'sd15'),
+    ('sd_xl_base_1.0.safetensors', 'sdxl'),
+    ('juggernautXL_v9_rdphoto2.safetensors', 'sdxl'),
+    ('ponyDiffusionV6.safetensors', 'sdxl'),
+    ('SDXL/illustriousXL_v01.safetensors', 'sdxl'),
+    ('wan2.2_t2v_low_noise_14B_fp8.safetensors', 'wan'),
+    (None, 'sd15'),
+]
+
+
+class PlanTilesTest(unittest.TestCase):
+
+    def test_plans(self):
+        for args, expected in PLAN_CASES:
+            with self.subTest(args=args):
+                plan = plan_tiles(*args)
+                self.assertEqual((plan['tile_width'], plan['tile_height'], plan['columns'], plan['rows'],
+                                  plan['tile_padding'], plan['mask_blur']), expected)
+
+    def test_tiles_cover_target(self):
+        for args, _ in PLAN_CASES:
+            with self.subTest(args=args):
+                width, height, factor = args[:3]
+                plan = plan_tiles(*args)
+                self.assertEqual(plan['tile_width'] % 64, 0)
+                self.assertEqual(plan['tile_height'] % 64, 0)
+                self.assertGreaterEqual(plan['tile_width'] * plan['columns'], round(width * factor))
+                self.assertGreaterEqual(plan['tile_height'] * plan['rows'], round(height * factor))
+                # 没有多余的行、列
+                self.assertLess(plan['tile_width'] * (plan['columns'] - 1), round(width * factor))
+                self.assertLess(plan['tile_height'] * (plan['rows'] - 1), round(height * factor))
+
+    def test_max_tile_edge(self):
+        for family, edges in EDGE_CASES.items():
+            for budget, expected in zip(EDGE_BUDGETS, edges):
+                with self.subTest(family=family, budget=budget):
+                    self.assertEqual(get_max_tile_edge(family, budget), expected)
+
+    def test_tile_fits_budget(self):
+        for family, info in model_families.items():
+            for budget in EDGE_BUDGETS:
+                with self.subTest(family=family, budget=budget):
+                    edge = get_max_tile_edge(family, budget)
+                    if edge <= 256:
+                        continue
+                    padding = plan_tiles(edge, edge, 1.0, family, budget)['tile_padding']
+                    self.assertLessEqual((edge + padding * 2) ** 2 / 1e6 * info['mb_per_mpx'], budget)
+                    self.assertLessEqual(edge, info['max_edge'])
+
+    def test_budget_above_max_edge_has_no_effect(self):
+        # 分块达到 max_edge 后更大的预算不改变规划
+        for args in [(1024, 1024, 2.0), (512, 768, 4.0)]:
+            with self.subTest(args=args):
+                plans = [plan_tiles(*args, 'sd15', budget) for budget in (4096, 8192, 16384)]
+                self.assertEqual(plans[0], plans[1])
+                self.assertEqual(plans[0], plans[2])
+
+    def test_model_family(self):
+        for model_name, expected in FAMILY_CASES:
+            with self.subTest(model_name=model_name):
+                self.assertEqual(get_model_family(model_name), expected)
+        self.assertEqual(get_model_family('unknown.safetensors', 'wan'), 'wan')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import math
+import os
+
+from server_config import get_config
+
+# 各模型系列的分块参数
+#   max_edge: 分块边长上限（超过训练分辨率太多会出现重复内容）
+#   mb_per_mpx: 每百万像素分块（含padding）的显存占用估算（MB）
+#   keywords: 按模型文件名识别系列的关键字（小写子串）
+# 分块达到 max_edge 后显存预算不再起作用：sd15 约2GB、sdxl 约7.5GB、wan 约8.3GB 以上的预算规划结果相同
+model_families = {
+    'sd15': {'max_edge': 1024, 'mb_per_mpx': 1500, 'keywords': []},
+    'sdxl': {'max_edge': 1536, 'mb_per_mpx': 2500,
+             'keywords': ['sdxl', 'sd_xl', '_xl', '-xl', 'xl_', 'xl-', 'pony', 'illustrious', 'noobai']},
+    'wan': {'max_edge': 1280, 'mb_per_mpx': 4000, 'keywords': ['wan2', 'wan_']},
+}
+
+_ALIGN = 64
+_MIN_TILE_EDGE = 256
+_MIN_PADDING = 32
+_MAX_PADDING = 128
+_MIN_MASK_BLUR = 8
+_MAX_MASK_BLUR = 64
+
+
+def _align_up(value, align=_ALIGN):
+    return int(math.ceil(value / align) * align)
+
+
+def _get_padding(tile_edge):
+    """padding按分块边长的1/16计算，对齐到8"""
+    padding = int(round(tile_edge / 16 / 8)) * 8
+    return max(_MIN_PADDING, min(_MAX_PADDING, padding))
+
+
+def _get_mask_blur(padding):
+    return max(_MIN_MASK_BLUR, min(_MAX_MASK_BLUR, padding // 4))
+
+
+def get_model_family(model_name, default='sd15'):
+    """按模型文件名中的关键字识别模型系列，识别不出时返回 default"""
+    if model_name:
+        name = os.path.basename(str(model_name)).lower()
+        for family, info in model_families.items():
+            if any(keyword in name for keyword in info['keywords']):
+                return family
+    return default
+
+
+def get_max_tile_edge(model_family, memory_budget_mb):
+    """
+    在显存预算内可用的最大分块边长（已扣除padding）
+
+    返回值:
+        int: 对齐到64的分块边长
+    """
+    family = model_families.get(model_family, model_families['sd15'])
+    max_area = memory_budget_mb / family['mb_per_mpx'] * 1000 * 1000
+    edge = min(family['max_edge'], int(math.sqrt(max_area)) // _ALIGN * _ALIGN)
+    while edge > _MIN_TILE_EDGE:
+        padding = _get_padding(edge)
+        if (edge + padding * 2) ** 2 <= max_area:
+            break
+        edge -= _ALIGN
+    return max(edge, _MIN_TILE_EDGE)
+
+
+def plan_tiles(width, height, upscale_factor, model_family='sd15', memory_budget_mb=None):
+    """
+    规划 UltimateSDUpscale 的分块
+
+    目标图像能放进一个分块时不切分（避免接缝），否则按显存预算切分成尽量少的均匀分块。
+    显存预算只在分块边长受显存限制时起作用，分块达到模型系列的 max_edge 后更大的预算结果相同。
+
+    参数:
+        width, height: 放大前的图像尺寸
+        upscale_factor: 放大倍数
+        model_family: 模型系列（sd15 / sdxl / wan）
+        memory_budget_mb: 显存预算（MB），默认读取配置 upscale_memory_budget_mb
+
+    返回值:
+        dict: mask_blur、tile_padding、tile_width、tile_height、columns、rows
+    """
+    if memory_budget_mb is None:
+        memory_budget_mb = get_config('upscale_memory_budget_mb')
+    target_width = int(round(width * upscale_factor))
+    target_height = int(round(height * upscale_factor))
+
+    max_edge = get_max_tile_edge(model_family, memory_budget_mb)
+    columns = max(1, math.ceil(target_width / max_edge))
+    rows = max(1, math.ceil(target_height / max_edge))
+    tile_width = min(_align_up(target_width / columns), max_edge)
+    tile_height = min(_align_up(target_height / rows), max_edge)
+    # 对齐后可能覆盖不到边缘，补一行/列
+    columns = math.ceil(target_width / tile_width)
+    rows = math.ceil(target_height / tile_height)
+
+    tile_padding = _get_padding(max(tile_width, tile_height))
+    mask_blur = _get_mask_blur(tile_padding)
+    return {
+        'mask_blur': mask_blur,
+        'tile_padding': tile_padding,
+        'tile_width': tile_width,
+        'tile_height': tile_height,
+        'columns': columns,
+        'rows': rows,
+    }
+
@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+
+from server_config import get_config
+
+_cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
+_traffic_file = os.path.join(_cache_dir, 'traffic.jsonl')
+
+# 记录的接口（路径前缀），以及需要记录请求体的接口（用于重放）
+_recorded_prefixes = ('/api/enqueue', '/api/jobs/', '/api/download/', '/api/upload', '/api/cancel',
+                      '/api/interrupt', '/api/results', '/api/thumbnail/')
+_body_prefixes = ('/api/enqueue', '/api/cancel', '/api/interrupt')
+
+
+def is_recorded_path(path):
+    return path.startswith(_recorded_prefixes)
+
+
+def is_body_recorded_path(path):
+    return path.startswith(_body_prefixes)
+
+
+class TrafficRecorder:
+    """
+    请求记录
+
+    每个请求写一行 JSONL（键名尽量短）：
+        t: 收到请求的时间（秒）  m: 方法  p: 路径（含查询参数）  s: 状态码  d: 耗时（毫秒）
+        b: 请求体（只记录提交/取消等JSON请求）  z: 请求体大小  o: 响应大小
+    """
+
+    def __init__(self, record_file=None):
+        self.record_file = record_file
+        self.lock = threading.Lock()
+        self.file = None
+        self.file_path = None
+
+    def _get_file(self):
+        path = self.record_file or get_config('traffic_record_file') or _traffic_file
+        if self.file is None or self.file_path != path:
+            if self.file is not None:
+                self.file.close()
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.file = open(path, 'a', encoding='utf-8')
+            self.file_path = path
+        return self.file
+
+    def is_enabled(self):
+        return self.record_file is not None or get_config('traffic_record_enabled')
+
+    def record(self, started, method, path, status, duration, body=None, request_size=None, response_size=None):
+        entry = {
+            't': round(started, 3),
+            'm': method,
+            'p': path,
+            's': status,
+            'd': round(duration * 1000, 1),
+        }
+        if body is not None:
+            entry['b'] = body
+        if request_size is not None:
+            entry['z'] = request_size
+        if response_size is not None:
+            entry['o'] = response_size
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self.lock:
+            try:
+                f = self._get_file()
+                f.write(line)
+                f.flush()
+            except Exception as e:
+                print(f"请求记录失败：{e}")
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def load_traffic(path):
+    """读取请求记录，按时间排序"""
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    entries.sort(key=lambda x: x['t'])
+    return entries
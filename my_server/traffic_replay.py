@@ -0,0 +1,415 @@
+"""
+按请求记录重放流量
+
+在本进程中启动 AIImageServer（输出、输入目录和各种缓存都放在临时目录中）和一个模拟的ComfyUI，
+按记录中的时间间隔（可按倍速缩放）重新发送提交、状态、下载、上传等请求，
+对比记录时和重放时各接口的耗时，用于在真实流量形态下检查性能改动。
+
+用法（在ComfyUI根目录下，或用 --comfyui-root 指定）:
+    python custom_nodes/<插件目录>/my_server/traffic_replay.py my_server/cache/traffic.jsonl --speed 4
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_workflow_dir = os.path.join(os.path.dirname(__file__), 'workflows')
+
+
+def _build_object_info():
+    """按工作流模板中出现的节点生成 object_info（不声明输入，只用于通过提交前校验）"""
+    object_info = {}
+    for filename in os.listdir(_workflow_dir):
+        if not filename.endswith('.json') or filename == 'model_map.json':
+            continue
+        with open(os.path.join(_workflow_dir, filename), 'r', encoding='utf-8') as f:
+            workflow = json.loads(f.read())
+        for node in workflow.values():
+            class_type = node.get('class_type')
+            if class_type is None:
+                continue
+            object_info[class_type] = {
+                'input': {'required': {}, 'optional': {}},
+                'output_node': any(x in class_type for x in ('Preview', 'Save', 'VideoCombine')),
+            }
+    object_info['LoadImage'] = {'input': {'required': {}, 'optional': {}}, 'output_node': False}
+    return object_info
+
+
+def _png_bytes():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (128, 128, 128)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class MockComfyUI:
+    """
+    模拟的ComfyUI
+
+    实现服务器用到的接口（/prompt、/queue、/interrupt、/history、/api/jobs、/view、/object_info），
+    按提交顺序逐个“执行”任务，执行时间取 durations[prompt_id]（没有时为 default_duration），再除以 speed。
+    """
+
+    def __init__(self, output_dir, durations=None, default_duration=5.0, speed=1.0):
+        self.output_dir = output_dir
+        self.durations = durations or {}
+        self.default_duration = default_duration
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.pending = []
+        self.running = None
+        self.jobs = {}
+        self.object_info = _build_object_info()
+        self.png = _png_bytes()
+        self.httpd = None
+
+    def _execute(self, job):
+        started = int(time.time() * 1000)
+        duration = self.durations.get(job['prompt_id'], self.default_duration) / self.speed
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline and not job.get('interrupted'):
+            time.sleep(0.01)
+        outputs = {}
+        if not job.get('interrupted'):
+            if any('VideoCombine' in node.get('class_type', '') for node in job['prompt'].values()):
+                video_path = os.path.join(self.output_dir, f"{job['prompt_id']}.mp4")
+                with open(video_path, 'wb') as f:
+                    f.write(b'\0' * 1024)
+                outputs['1'] = {'gifs': [{'fullpath': video_path}]}
+            else:
+                outputs['1'] = {'images': [{'filename': f"{job['prompt_id']}.png", 'subfolder': '', 'type': 'temp'}]}
+        return {
+            'status': 'cancelled' if job.get('interrupted') else 'completed',
+            'outputs': outputs,
+            'execution_start_time': started,
+            'execution_end_time': int(time.time() * 1000),
+        }
+
+    def _worker(self):
+        while True:
+            with self.lock:
+                job = self.pending.pop(0) if self.running is None and len(self.pending) > 0 else None
+                if job is not None:
+                    self.running = job
+                    self.jobs[job['prompt_id']] = {'status': 'in_progress', 'outputs': {}}
+            if job is None:
+                time.sleep(0.01)
+                continue
+            result = self._execute(job)
+            with self.lock:
+                self.jobs[job['prompt_id']] = result
+                self.running = None
+
+    def _get(self, path):
+        with self.lock:
+            if path == '/prompt':
+                return {'exec_info': {'queue_remaining': len(self.pending) + (1 if self.running else 0)}}
+            if path == '/queue':
+                running = [[0, self.running['prompt_id'], {}, {}, []]] if self.running else []
+                pending = [[i + 1, job['prompt_id'], {}, {}, []] for i, job in enumerate(self.pending)]
+                return {'queue_running': running, 'queue_pending': pending}
+            if path == '/object_info':
+                return self.object_info
+            if path.startswith('/api/jobs/'):
+                prompt_id = path.rsplit('/', 1)[-1]
+                if any(job['prompt_id'] == prompt_id for job in self.pending):
+                    return {'status': 'pending', 'outputs': {}}
+                return self.jobs.get(prompt_id)
+        return None
+
+    def _post(self, path, body):
+        with self.lock:
+            if path == '/prompt':
+                self.pending.append({'prompt_id': body['prompt_id'], 'prompt': body['prompt']})
+                return {'prompt_id': body['prompt_id'], 'number': len(self.pending)}
+            if path == '/queue':
+                delete = set(body.get('delete', []))
+                self.pending = [job for job in self.pending if job['prompt_id'] not in delete]
+                return {}
+            if path == '/interrupt':
+                if self.running is not None and body.get('prompt_id') in (None, self.running['prompt_id']):
+                    self.running['interrupted'] = True
+                return {}
+            if path == '/history':
+                for prompt_id in body.get('delete', []):
+                    self.jobs.pop(prompt_id, None)
+                return {}
+        return None
+
+    def start(self, port=0):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, data, content_type='application/json'):
+                if data is None:
+                    self.send_response(404)
+                    data, content_type = b'{}', 'application/json'
+                else:
+                    self.send_response(200)
+                    if not isinstance(data, bytes):
+                        data = json.dumps(data).encode('utf-8')
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                path = urllib.parse.urlparse(self.path).path
+                if path == '/view':
+                    return self._reply(mock.png, 'image/png')
+                self._reply(mock._get(path))
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                self._reply(mock._post(urllib.parse.urlparse(self.path).path, body))
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        threading.Thread(target=self.httpd.serve_forever, name='Mock-ComfyUI-Thread', daemon=True).start()
+        threading.Thread(target=self._worker, name='Mock-ComfyUI-Worker', daemon=True).start()
+        return self.httpd.server_address[1]
+
+
+def _get_kind(entry):
+    """接口类别，用于汇总耗时"""
+    path = entry['p'].split('?', 1)[0]
+    for prefix in ('/api/enqueue/batch', '/api/enqueue', '/api/jobs/', '/api/download/', '/api/upload',
+                   '/api/cancel', '/api/interrupt', '/api/results', '/api/thumbnail/'):
+        if path.startswith(prefix):
+            return prefix.strip('/').replace('api/', '')
+    return path
+
+
+def estimate_durations(entries, get_prompt_id):
+    """
+    按记录估算每个任务的执行时间
+
+    任务在第一次下载成功前最后一次状态查询（看到完成）和它之前的一次查询之间完成，取两者的中点作为完成时间；
+    任务按完成顺序串行执行，执行时间为完成时间减去提交时间和上一个任务完成时间中较晚者。
+
+    Args:
+        get_prompt_id: 由提交请求体计算 prompt_id
+    """
+    enqueued = {}
+    polls = {}
+    completed = {}
+    for entry in entries:
+        path = entry['p'].split('?', 1)[0]
+        if path == '/api/enqueue' and entry.get('b') is not None:
+            try:
+                enqueued.setdefault(get_prompt_id(entry['b']), entry['t'])
+            except Exception:
+                continue
+        elif path.startswith('/api/jobs/'):
+            prompt_id = path.rsplit('/', 1)[-1]
+            polls[prompt_id] = (polls.get(prompt_id, (None, None))[1], entry['t'])
+        elif path.startswith('/api/download/') and entry['s'] == 200:
+            prompt_id = path.rsplit('/', 1)[-1]
+            if prompt_id in enqueued and prompt_id not in completed:
+                before, last = polls.get(prompt_id, (None, None))
+                if last is None:
+                    completed[prompt_id] = entry['t']
+                else:
+                    completed[prompt_id] = (max(before or enqueued[prompt_id], enqueued[prompt_id]) + last) / 2
+    durations = {}
+    previous = None
+    for prompt_id, t in sorted(completed.items(), key=lambda x: x[1]):
+        started = enqueued[prompt_id] if previous is None else max(enqueued[prompt_id], previous)
+        durations[prompt_id] = max(0.0, t - started)
+        previous = t
+    return durations
+
+
+def _send_entry(conn, entry):
+    """按记录发送一个请求，返回状态码"""
+    headers = {}
+    body = None
+    if entry['m'] == 'POST' and entry['p'].startswith('/api/upload'):
+        # 上传内容没有记录，按记录的大小生成
+        boundary = uuid.uuid4().hex
+        size = min(entry.get('z') or 1024, 20 * 1024 * 1024)
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="replay_{uuid.uuid4().hex[:8]}.png"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8') + os.urandom(size) + \
+               f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+    elif entry['m'] == 'POST':
+        body = json.dumps(entry.get('b') or {}).encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+    conn.request(entry['m'], entry['p'], body=body, headers=headers)
+    response = conn.getresponse()
+    response.read()
+    return response.status
+
+
+def _wait_completed(conn, prompt_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        conn.request('GET', f'/api/jobs/{prompt_id}')
+        response = conn.getresponse()
+        data = response.read()
+        if response.status == 200 and json.loads(data).get('status') in ('completed', 'failed', 'cancelled'):
+            return
+        time.sleep(0.05)
+
+
+def replay(entries, host, port, speed=1.0, workers=32):
+    """
+    按记录的时间间隔（除以 speed）发送请求
+
+    返回值:
+        list: [(记录, 重放状态码, 重放耗时毫秒)]
+    """
+    local = threading.local()
+    results = []
+    results_lock = threading.Lock()
+
+    def run(entry):
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = http.client.HTTPConnection(host, port, timeout=120)
+            local.conn = conn
+        try:
+            if entry['p'].startswith('/api/download/') and entry['s'] == 200:
+                # 记录中下载成功说明客户端已看到任务完成，重放时同样等任务完成后再下载（等待时间不计入耗时）
+                _wait_completed(conn, entry['p'].split('?', 1)[0].rsplit('/', 1)[-1])
+        except Exception as e:
+            print(f"等待任务完成失败：{entry['p']} {e}")
+        t0 = time.perf_counter()
+        try:
+            status = _send_entry(conn, entry)
+        except Exception as e:
+            print(f"重放失败：{entry['p']} {e}")
+            conn.close()
+            local.conn = None
+            status = None
+        with results_lock:
+            results.append((entry, status, (time.perf_counter() - t0) * 1000))
+
+    if len(entries) == 0:
+        return results
+    start = time.monotonic()
+    t0 = entries[0]['t']
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for entry in entries:
+            delay = (entry['t'] - t0) / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(run, entry)
+    return results
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    if len(values) == 0:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def print_report(results, wall_time):
+    kinds = {}
+    for entry, status, duration in results:
+        kinds.setdefault(_get_kind(entry), []).append((entry, status, duration))
+    print(f"重放 {len(results)} 个请求，用时 {wall_time:.1f}s")
+    print(f"{'接口':16s} {'数量':>6s} {'记录p50':>9s} {'记录p95':>9s} {'重放p50':>9s} {'重放p95':>9s} {'状态不同':>8s}")
+    for kind, items in sorted(kinds.items()):
+        recorded = [entry['d'] for entry, _, _ in items]
+        replayed = [duration for _, _, duration in items]
+        mismatched = sum(1 for entry, status, _ in items if status != entry['s'])
+        print(f"{kind:16s} {len(items):6d} {_percentile(recorded, 50):9.1f} {_percentile(recorded, 95):9.1f} "
+              f"{_percentile(replayed, 50):9.1f} {_percentile(replayed, 95):9.1f} {mismatched:8d}")
+
+
+def _find_free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按请求记录重放流量（使用模拟的ComfyUI）')
+    parser.add_argument('traffic_file', help='请求记录（traffic.jsonl）')
+    parser.add_argument('--speed', type=float, default=1.0, help='重放倍速，1为原速')
+    parser.add_argument('--default-duration', type=float, default=5.0, help='无法从记录估算时的任务执行时间（秒）')
+    parser.add_argument('--limit', type=int, default=0, help='只重放前N条记录')
+    parser.add_argument('--comfyui-root', default=os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')),
+                        help='ComfyUI根目录（需要 folder_paths 等模块）')
+    parser.add_argument('--record', default=None, help='把重放时的请求记录到该文件')
+    args = parser.parse_args()
+
+    sys.path.insert(0, args.comfyui_root)
+    import folder_paths
+    import ai_image_server
+    from image_hash import PerceptualIndex
+    from prewarm import RequestMix
+    from request_aliases import RequestIdAliases
+    from result_index import ResultIndex
+    from traffic import TrafficRecorder, load_traffic
+
+    entries = load_traffic(args.traffic_file)
+    if args.limit > 0:
+        entries = entries[:args.limit]
+
+    # 所有输出和缓存都放在临时目录中，不影响正式数据
+    work_dir = tempfile.mkdtemp(prefix='traffic_replay_')
+    output_dir = os.path.join(work_dir, 'output')
+    input_dir = os.path.join(work_dir, 'input')
+    cache_dir = os.path.join(work_dir, 'cache')
+    for d in (output_dir, input_dir, cache_dir):
+        os.makedirs(d, exist_ok=True)
+    folder_paths.set_output_directory(output_dir)
+    folder_paths.set_input_directory(input_dir)
+    ai_image_server.common_functions['get_today_output_directory'] = lambda: output_dir
+    ai_image_server.result_index = ResultIndex(os.path.join(cache_dir, 'result_index.jsonl'))
+    ai_image_server.request_aliases = RequestIdAliases(os.path.join(cache_dir, 'request_id_aliases.json'))
+
+    def get_prompt_id(body):
+        return ai_image_server.get_request_prompt_id(ai_image_server.AIImageServer.QueueRequest(**body))
+
+    mock = MockComfyUI(output_dir, estimate_durations(entries, get_prompt_id), args.default_duration, args.speed)
+    ai_image_server.server_address = f"127.0.0.1:{mock.start()}"
+
+    server = ai_image_server.AIImageServer(port=_find_free_port(), local_ip='127.0.0.1')
+    server.phash_index = PerceptualIndex(folder_paths.get_input_directory, os.path.join(cache_dir, 'input_phash.json'))
+    server.prewarmer.mix = RequestMix(os.path.join(cache_dir, 'enqueue_log.jsonl'))
+    server.traffic_recorder = TrafficRecorder(args.record or os.path.join(cache_dir, 'traffic.jsonl'))
+    if not server.start() or not _wait_port(server.actual_port):
+        print("服务器启动失败")
+        return 1
+
+    started = time.monotonic()
+    results = replay(entries, '127.0.0.1', server.actual_port, args.speed)
+    print_report(results, time.monotonic() - started)
+    print(f"临时目录：{work_dir}")
+    server.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,9 @@
+import functools
 import json
 import os
 
+from tile_planner import get_model_family, plan_tiles
+
 __prompt_json_path = os.path.join(os.path.dirname(__file__), 'workflows')
 __upscale_prompt_suffix = '.upscale'
 
@@ -15,6 +18,15 @@ def __get_prompt_file(filename, upscale=False):
     return __get_prompt_file(ori_filename, False)
 
 
+def __get_file_stamp(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+__template_cache: dict = {}
+__REMOVED = object()
+
+
 def __precheck(workflow_x, class_type, key):
     return ('class_type' in workflow_x and
             class_type in workflow_x['class_type'] and
@@ -22,332 +34,430 @@ def __precheck(workflow_x, class_type, key):
             key in workflow_x['inputs'])
 
 
-def __get_condition_x(workflow, condition, class_type='Sampler', key='text'):
-    if condition not in ['positive', 'negative']:
-        return None
-
-    for x in workflow:
-        if __precheck(workflow[x], class_type, condition):
-            x0 = workflow[x]['inputs'][condition][0]
-            while True:
-                if __precheck(workflow[x0], 'TextEncode', key):
-                    return x0
-                _sub_class_type = workflow[x0]['class_type']
-                if __precheck(workflow[x0], _sub_class_type, condition):
-                    return workflow[x0]['inputs'][condition][0]
-                x0 = workflow[x0]['inputs'][condition][0]
-    return None
-
-
-def __set_prompt_input(workflow, class_type, key, value, x=None):
-    if x is not None and x in workflow:
-        if __precheck(workflow[x], class_type, key):
-            workflow[x]['inputs'][key] = value
-        return
-
-    for x in workflow:
-        if __precheck(workflow[x], class_type, key):
-            workflow[x]['inputs'][key] = value
-
-
-def __get_prompt_input(workflow, class_type, key, x=None):
-    if x is not None and x in workflow:
-        if __precheck(workflow[x], class_type, key):
-            return workflow[x]['inputs'][key]
-
-    for x in workflow:
-        if __precheck(workflow[x], class_type, key):
-            return workflow[x]['inputs'][key]
-
-    return None
-
-
-def __remove_prompt_input(workflow, class_type, key, x=None):
-    if x is not None and x in workflow:
-        if __precheck(workflow[x], class_type, key):
-            del workflow[x]['inputs'][key]
-            return
-
-    for x in workflow:
-        if __precheck(workflow[x], class_type, key):
-            del workflow[x]['inputs'][key]
-
-
-def __get_upscale_params(width, height, upscale_factor):
-    default_mask_blur = 8
-    default_tile_padding = 32
-    mask_blur = default_mask_blur * upscale_factor
-    tile_padding = default_tile_padding * upscale_factor
-    tile_width = (width * upscale_factor) // 2
-    tile_height = (height * upscale_factor) // 2
-    return mask_blur, tile_padding, tile_width, tile_height
-
-
-def __set_node_input(workflow, node, key, value):
-    if node in workflow and 'inputs' in workflow[node] and key in workflow[node]['inputs']:
-        workflow[node]['inputs'][key] = value
-
-
-def t2i(**kwargs):
-    model = kwargs['model'] if 'model' in kwargs else None
-    prompt_p = kwargs['prompt_p'] if 'prompt_p' in kwargs else ''
-    prompt_n = kwargs['prompt_n'] if 'prompt_n' in kwargs else ''
-    width = kwargs['width'] if 'width' in kwargs else 512
-    height = kwargs['height'] if 'height' in kwargs else 512
-    seed = kwargs['seed'] if 'seed' in kwargs else 0
-    step = kwargs['step'] if 'step' in kwargs else 20
-    cfg = kwargs['cfg'] if 'cfg' in kwargs else 8.0
-    upscale_factor = kwargs['upscale_factor'] if 'upscale_factor' in kwargs else 1.0
-    try:
-        json_path = __get_prompt_file('t2i', upscale_factor > 1.0)
-        with open(json_path, 'r', encoding='utf-8') as f:
-            workflow = json.loads(f.read())
-        if model is not None and model != "":
-            __set_prompt_input(workflow, 'CheckpointLoaderSimple', 'ckpt_name', model)
-        if prompt_p is not None and prompt_p != "":
-            _x = __get_condition_x(workflow, 'positive')
-            __set_prompt_input(workflow, 'CLIPTextEncode', 'text', prompt_p, x=_x)
-        if width > 5:
-            __set_prompt_input(workflow, 'EmptyLatentImage', 'width', width)
-        if height > 5:
-            __set_prompt_input(workflow, 'EmptyLatentImage', 'height', height)
-        if seed != 0:
-            __set_prompt_input(workflow, 'KSampler', 'seed', seed)
-            __set_prompt_input(workflow, 'UltimateSDUpscale', 'seed', seed)
-        if step != 0:
-            __set_prompt_input(workflow, 'KSampler', 'steps', step)
-        if cfg != 0.0:
-            __set_prompt_input(workflow, 'KSampler', 'cfg', cfg)
-            __set_prompt_input(workflow, 'UltimateSDUpscale', 'cfg', cfg)
-        if upscale_factor > 1.0:
-            __set_prompt_input(workflow, 'UltimateSDUpscale', 'upscale_by', upscale_factor)
-            s = __get_prompt_input(workflow, 'KSampler', 'seed')
-            __set_prompt_input(workflow, 'UltimateSDUpscale', 'seed', s)
-            w = __get_prompt_input(workflow, 'EmptyLatentImage', 'width')
-            h = __get_prompt_input(workflow, 'EmptyLatentImage', 'height')
-            mask_blur, tile_padding, tile_width, tile_height = __get_upscale_params(w, h, upscale_factor)
-            __set_prompt_input(workflow, 'UltimateSDUpscale', 'mask_blur', mask_blur)
-            __set_prompt_input(workflow, 'UltimateSDUpscale', 'tile_padding', tile_padding)
-            __set_prompt_input(workflow, 'UltimateSDUpscale', 'tile_width', tile_width)
-            __set_prompt_input(workflow, 'UltimateSDUpscale', 'tile_height', tile_height)
-        return workflow
-    except Exception as e:
-        print(f"t2i. e: {e}")
-        return None
-
-
-def t2i_wan22(**kwargs):
-    prompt_p = kwargs['prompt_p'] if 'prompt_p' in kwargs else ''
-    prompt_n = kwargs['prompt_n'] if 'prompt_n' in kwargs else ''
-    width = kwargs['width'] if 'width' in kwargs else 512
-    height = kwargs['height'] if 'height' in kwargs else 512
-    seed = kwargs['seed'] if 'seed' in kwargs else 0
-    step = kwargs['step'] if 'step' in kwargs else 10
-    cfg = kwargs['cfg'] if 'cfg' in kwargs else 1.0
-    upscale_factor = kwargs['upscale_factor'] if 'upscale_factor' in kwargs else 1.0
-    try:
-        json_path = __get_prompt_file('t2i_wan22', upscale_factor > 1.0)
-        with open(json_path, 'r', encoding='utf-8') as f:
-            prompt = json.loads(f.read())
-        if prompt_p is not None and prompt_p != "":
-            _x = __get_condition_x(prompt, 'positive')
-            __set_prompt_input(prompt, 'CLIPTextEncode', 'text', prompt_p, x=_x)
-        if width > 5:
-            __set_prompt_input(prompt, 'WanImageToVideo', 'width', width)
-        if height > 5:
-            __set_prompt_input(prompt, 'WanImageToVideo', 'height', height)
-        if seed != 0:
-            __set_prompt_input(prompt, 'KSamplerAdvanced', 'noise_seed', seed)
-        if step != 0:
-            __set_prompt_input(prompt, 'KSamplerAdvanced', 'steps', step)
-        if cfg != 0.0:
-            __set_prompt_input(prompt, 'KSamplerAdvanced', 'cfg', cfg)
-        if upscale_factor > 1.0:
-            __set_prompt_input(prompt, 'UltimateSDUpscale', 'upscale_by', upscale_factor)
-            s = __get_prompt_input(prompt, 'KSamplerAdvanced', 'noise_seed')
-            __set_prompt_input(prompt, 'UltimateSDUpscale', 'seed', s)
-            w = __get_prompt_input(prompt, 'WanImageToVideo', 'width')
-            h = __get_prompt_input(prompt, 'WanImageToVideo', 'height')
-            mask_blur, tile_padding, tile_width, tile_height = __get_upscale_params(w, h, upscale_factor)
-            __set_prompt_input(prompt, 'UltimateSDUpscale', 'mask_blur', mask_blur)
-            __set_prompt_input(prompt, 'UltimateSDUpscale', 'tile_padding', tile_padding)
-            __set_prompt_input(prompt, 'UltimateSDUpscale', 'tile_width', tile_width)
-            __set_prompt_input(prompt, 'UltimateSDUpscale', 'tile_height', tile_height)
-        return prompt
-    except Exception as e:
-        print(f"t2i. e: {e}")
-        return None
-
-
-def t2v_wan22(**kwargs):
-    prompt_p = kwargs['prompt_p'] if 'prompt_p' in kwargs else ''
-    prompt_n = kwargs['prompt_n'] if 'prompt_n' in kwargs else ''
-    width = kwargs['width'] if 'width' in kwargs else 512
-    height = kwargs['height'] if 'height' in kwargs else 512
-    seed = kwargs['seed'] if 'seed' in kwargs else 0
-    step = kwargs['step'] if 'step' in kwargs else 10
-    cfg = kwargs['cfg'] if 'cfg' in kwargs else 1.0
-    seconds = kwargs['seconds'] if 'seconds' in kwargs else 1
-    length = 16 * seconds + 1
-    try:
-        json_path = __get_prompt_file('t2v_wan22')
+def __compile_template(workflow):
+    """
+    编译工作流模板：建立 class_type -> 节点ID 索引，
+    查找结果（节点、正负提示词节点）在模板上缓存，同一模板只计算一次
+    """
+    class_index = {}
+    for x, node in workflow.items():
+        if 'class_type' in node and 'inputs' in node:
+            class_index.setdefault(node['class_type'], []).append(x)
+    return {
+        'workflow': workflow,
+        'order': {x: i for i, x in enumerate(workflow)},
+        'class_index': class_index,
+        'targets': {},
+        'conditions': {},
+    }
+
+
+def __load_template(filename, upscale=False):
+    """读取并编译工作流模板，按文件修改时间缓存，返回新的构建上下文"""
+    json_path = __get_prompt_file(filename, upscale)
+    stamp = __get_file_stamp(json_path)
+    cached = __template_cache.get(json_path)
+    if cached is None or cached[0] != stamp:
         with open(json_path, 'r', encoding='utf-8') as f:
-            prompt = json.loads(f.read())
-        if prompt_p is not None and prompt_p != "":
-            _x = __get_condition_x(prompt, 'positive', "WanImageToVideo")
-            __set_prompt_input(prompt, 'CLIPTextEncode', 'text', prompt_p, x=_x)
-        if width > 5:
-            __set_prompt_input(prompt, 'WanImageToVideo', 'width', width)
-        if height > 5:
-            __set_prompt_input(prompt, 'WanImageToVideo', 'height', height)
-        if length > 1:
-            __set_prompt_input(prompt, 'WanImageToVideo', 'length', length)
-        if seed != 0:
-            __set_prompt_input(prompt, 'WanMoeKSampler', 'seed', seed)
-        if step != 0:
-            __set_prompt_input(prompt, 'WanMoeKSampler', 'steps', step)
-        if cfg != 0.0:
-            __set_prompt_input(prompt, 'WanMoeKSampler', 'cfg_high_noise', cfg)
-            __set_prompt_input(prompt, 'WanMoeKSampler', 'cfg_low_noise', cfg)
-        return prompt
-    except Exception as e:
-        print(f"t2i. e: {e}")
+            cached = (stamp, __compile_template(json.loads(f.read())))
+        __template_cache[json_path] = cached
+    return {'template': cached[1], 'changes': {}}
+
+
+def __finish_build(build):
+    """
+    一次性应用所有修改，生成提交用的工作流
+
+    只复制被修改的节点，其余节点与缓存的模板共享，只在本模块内使用；build_workflow 返回前会整体复制。
+    """
+    workflow = dict(build['template']['workflow'])
+    for x, changes in build['changes'].items():
+        node = dict(workflow[x])
+        inputs = dict(node['inputs'])
+        for key, value in changes.items():
+            if value is __REMOVED:
+                inputs.pop(key, None)
+            else:
+                inputs[key] = value
+        node['inputs'] = inputs
+        workflow[x] = node
+    return workflow
+
+
+def __copy_workflow(value):
+    """复制工作流（只有dict、list和不可变的值），比 copy.deepcopy 快"""
+    if isinstance(value, dict):
+        return {key: __copy_workflow(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [__copy_workflow(item) for item in value]
+    return value
+
+
+def __find_nodes(build, class_type, key):
+    """查找 class_type（子串匹配）且包含指定输入的节点，按模板中的顺序返回"""
+    template = build['template']
+    targets = template['targets'].get((class_type, key))
+    if targets is None:
+        workflow = template['workflow']
+        targets = []
+        for _class_type, ids in template['class_index'].items():
+            if class_type in _class_type:
+                targets.extend(x for x in ids if key in workflow[x]['inputs'])
+        targets.sort(key=lambda x: template['order'][x])
+        template['targets'][(class_type, key)] = targets
+    return targets
+
+
+def __has_node_input(build, x, class_type, key):
+    workflow = build['template']['workflow']
+    return x in workflow and __precheck(workflow[x], class_type, key)
+
+
+def __get_condition_x(build, condition, class_type='Sampler', key='text'):
+    if condition not in ['positive', 'negative']:
         return None
 
-
-def t2v_wan22_lite(**kwargs):
-    prompt_p = kwargs['prompt_p'] if 'prompt_p' in kwargs else ''
-    prompt_n = kwargs['prompt_n'] if 'prompt_n' in kwargs else ''
-    width = kwargs['width'] if 'width' in kwargs else 512
-    height = kwargs['height'] if 'height' in kwargs else 512
-    seed = kwargs['seed'] if 'seed' in kwargs else 0
-    step = kwargs['step'] if 'step' in kwargs else 10
-    cfg = kwargs['cfg'] if 'cfg' in kwargs else 1.0
-    seconds = kwargs['seconds'] if 'seconds' in kwargs else 1
-    length = 16 * seconds + 1
-    try:
-        json_path = __get_prompt_file('t2v_wan22_lite')
-        with open(json_path, 'r', encoding='utf-8') as f:
-            prompt = json.loads(f.read())
-        if prompt_p is not None and prompt_p != "":
-            _x = __get_condition_x(prompt, 'positive', "WanImageToVideo")
-            __set_prompt_input(prompt, 'CLIPTextEncode', 'text', prompt_p, x=_x)
-        if width > 5:
-            __set_prompt_input(prompt, 'WanImageToVideo', 'width', width)
-        if height > 5:
-            __set_prompt_input(prompt, 'WanImageToVideo', 'height', height)
-        if length > 1:
-            __set_prompt_input(prompt, 'WanImageToVideo', 'length', length)
-        if seed != 0:
-            __set_prompt_input(prompt, 'KSampler', 'seed', seed)
-        if step != 0:
-            __set_prompt_input(prompt, 'KSampler', 'steps', step)
-        if cfg != 0.0:
-            __set_prompt_input(prompt, 'KSampler', 'cfg', cfg)
-        return prompt
-    except Exception as e:
-        print(f"t2i. e: {e}")
+    template = build['template']
+    cache_key = (condition, class_type, key)
+    if cache_key in template['conditions']:
+        return template['conditions'][cache_key]
+
+    workflow = template['workflow']
+    found = None
+    samplers = __find_nodes(build, class_type, condition)
+    if len(samplers) > 0:
+        # 沿条件连线向上查找文本编码节点，遇到环或缺失节点时停止
+        x0 = workflow[samplers[0]]['inputs'][condition][0]
+        visited = set()
+        while x0 in workflow and x0 not in visited:
+            visited.add(x0)
+            if __precheck(workflow[x0], 'TextEncode', key):
+                found = x0
+                break
+            if not __precheck(workflow[x0], workflow[x0]['class_type'], condition):
+                break
+            x0 = workflow[x0]['inputs'][condition][0]
+    template['conditions'][cache_key] = found
+    return found
+
+
+def __get_node_value(build, x, key):
+    changes = build['changes'].get(x)
+    if changes is not None and key in changes and changes[key] is not __REMOVED:
+        return changes[key]
+    return build['template']['workflow'][x]['inputs'][key]
+
+
+def __derive_upscale_tiles(width, height, upscale_factor, model_family='sd15', model_name=None):
+    """model_name 指定时按模型文件名识别模型系列，识别不出时使用 model_family"""
+    plan = plan_tiles(width, height, upscale_factor, get_model_family(model_name, model_family))
+    return {
+        'mask_blur': plan['mask_blur'],
+        'tile_padding': plan['tile_padding'],
+        'tile_width': plan['tile_width'],
+        'tile_height': plan['tile_height'],
+    }
+
+
+def __derive_video_length(seconds):
+    return 16 * seconds + 1
+
+
+# model_map.json 中 "derive" 可用的派生函数
+derive_functions: dict = {
+    'upscale_tiles': __derive_upscale_tiles,
+    'video_length': __derive_video_length,
+}
+
+
+def __check_condition(when, value):
+    """
+    判断绑定条件，支持的条件：
+        set: 非None且非空字符串；notNone / isNone；gt / ne: 数值比较
+    """
+    if 'set' in when and (value is not None and value != "") != when['set']:
+        return False
+    if 'notNone' in when and (value is not None) != when['notNone']:
+        return False
+    if 'isNone' in when and (value is None) != when['isNone']:
+        return False
+    if 'gt' in when and not (value is not None and value > when['gt']):
+        return False
+    if 'ne' in when and value == when['ne']:
+        return False
+    return True
+
+
+def __compile_source(build, source):
+    """
+    预先解析绑定的值来源：请求参数（字符串）、常量（const）、
+    节点输入（class_type/node + key）或多个来源组成的字典
+    """
+    if isinstance(source, str):
+        return 'field', source
+    if 'const' in source:
+        return 'const', source['const']
+    if 'key' in source:
+        if 'node' in source:
+            x = source['node'] if __has_node_input(build, source['node'], '', source['key']) else None
+        else:
+            nodes = __find_nodes(build, source['class_type'], source['key'])
+            x = nodes[0] if len(nodes) > 0 else None
+        return 'node', (x, source['key'])
+    return 'dict', [(name, __compile_source(build, s)) for name, s in source.items()]
+
+
+def __compile_target(build, target):
+    """预先解析绑定目标对应的节点ID"""
+    key = target['key']
+    if 'node' in target:
+        nodes = [target['node']] if __has_node_input(build, target['node'], '', key) else []
+    else:
+        x = None
+        if 'condition' in target:
+            x = __get_condition_x(build, target['condition'], target.get('sampler', 'Sampler'), key)
+        if x is not None and x in build['template']['workflow']:
+            nodes = [x] if __has_node_input(build, x, target['class_type'], key) else []
+        else:
+            nodes = __find_nodes(build, target['class_type'], key)
+    return [(x, key, target.get('output')) for x in nodes]
+
+
+def __compile_bindings(build, workflow_key, bindings):
+    """
+    将 model_map.json 的参数绑定编译为执行计划（节点ID已解析），
+    按 工作流+模板 缓存，模板或model_map.json修改后重新编译
+    """
+    plans = build['template'].setdefault('plans', {})
+    cached = plans.get(workflow_key)
+    if cached is not None and cached[0] is bindings:
+        return cached[1]
+
+    plan = []
+    for binding in bindings:
+        when = binding.get('when')
+        plan.append((
+            __compile_source(build, binding['from']),
+            derive_functions[binding['derive']] if 'derive' in binding else None,
+            when,
+            when.get('field') if when is not None else None,
+            [t for target in binding.get('set', []) for t in __compile_target(build, target)],
+            [t for target in binding.get('remove', []) for t in __compile_target(build, target)],
+        ))
+    plans[workflow_key] = (bindings, plan)
+    return plan
+
+
+def __read_source(build, params, source):
+    kind, data = source
+    if kind == 'field':
+        return params.get(data)
+    if kind == 'const':
+        return data
+    if kind == 'node':
+        x, key = data
+        return __get_node_value(build, x, key) if x is not None else None
+    return {name: __read_source(build, params, s) for name, s in data}
+
+
+def __run_plan(build, params, plan):
+    """按执行计划一次性记录所有修改"""
+    changes = build['changes']
+    for source, derive, when, when_field, set_targets, remove_targets in plan:
+        value = __read_source(build, params, source)
+        if derive is not None:
+            value = derive(**value) if isinstance(value, dict) else derive(value)
+        if when is not None:
+            if not __check_condition(when, params.get(when_field) if when_field is not None else value):
+                continue
+        for x, key, output in set_targets:
+            changes.setdefault(x, {})[key] = value[output] if output is not None else value
+        for x, key, _ in remove_targets:
+            changes.setdefault(x, {})[key] = __REMOVED
+
+
+def __get_params(workflow_info, kwargs):
+    """
+    合并请求参数和工作流的默认值（model_map.json 的 defaultParameters），值为None的参数使用默认值，
+    字符串参数去掉首尾空白
+
+    默认值参与 canonicalize_params，修改默认值会改变省略该参数的请求的 prompt_id
+    """
+    params = dict(workflow_info.get('defaultParameters', {}))
+    for key, value in kwargs.items():
+        if isinstance(value, str):
+            value = value.strip()
+        if value is not None or key not in params:
+            params[key] = value
+    return params
+
+
+def __get_source_fields(source):
+    """绑定来源中引用的请求参数"""
+    if isinstance(source, str):
+        return [source]
+    if 'const' in source or 'key' in source:
+        return []
+    return [field for s in source.values() for field in __get_source_fields(s)]
+
+
+def __is_binding_active(binding, params):
+    """判断绑定是否生效，条件依赖节点值（无法只凭请求参数判断）时视为生效"""
+    when = binding.get('when')
+    if when is None:
+        return True
+    if 'field' in when:
+        return __check_condition(when, params.get(when['field']))
+    if not isinstance(binding['from'], str):
+        return True
+    value = params.get(binding['from'])
+    if 'derive' in binding:
+        try:
+            value = derive_functions[binding['derive']](value)
+        except Exception:
+            return True
+    return __check_condition(when, value)
+
+
+def __normalize_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def canonicalize_params(key, **kwargs):
+    """
+    生成请求参数的规范形式，用于计算参数ID
+
+    值为None的参数使用工作流的默认值，字符串去掉首尾空白，整数值的浮点数转为整数；
+    只保留工作流绑定中实际生效的参数，不影响结果的参数（如图像工作流的 seconds、
+    upscale_factor 不大于1）不参与计算，生成相同工作流的请求得到相同的规范形式。
+
+    返回值:
+        dict: 规范化的参数，工作流不存在时返回None
+    """
+    workflow_info = workflow_list.get(key)
+    if workflow_info is None:
         return None
-
-
-def t2i_SDXL_turbo(**kwargs):
-    prompt_p = kwargs['prompt_p'] if 'prompt_p' in kwargs else ''
-    prompt_n = kwargs['prompt_n'] if 'prompt_n' in kwargs else ''
-    width = kwargs['width'] if 'width' in kwargs else 512
-    height = kwargs['height'] if 'height' in kwargs else 512
-    seed = kwargs['seed'] if 'seed' in kwargs else 0
-    step = kwargs['step'] if 'step' in kwargs else 4
-    cfg = kwargs['cfg'] if 'cfg' in kwargs else 1.0
-    upscale_factor = kwargs['upscale_factor'] if 'upscale_factor' in kwargs else 1.0
-    try:
-        json_path = __get_prompt_file('t2i_SDXL_turbo', upscale_factor > 1.0)
-        with open(json_path, 'r', encoding='utf-8') as f:
-            prompt = json.loads(f.read())
-        if prompt_p is not None and prompt_p != "":
-            _x = __get_condition_x(prompt, 'positive')
-            __set_prompt_input(prompt, 'CLIPTextEncode', 'text', prompt_p, x=_x)
-        if width > 5:
-            __set_prompt_input(prompt, 'EmptySD3LatentImage', 'width', width)
-        if height > 5:
-            __set_prompt_input(prompt, 'EmptySD3LatentImage', 'height', height)
-        if seed != 0:
-            __set_prompt_input(prompt, 'SamplerCustom', 'noise_seed', seed)
-        if step != 0:
-            __set_prompt_input(prompt, 'SDTurboScheduler', 'steps', step)
-        if cfg != 0.0:
-            __set_prompt_input(prompt, 'SamplerCustom', 'cfg', cfg)
-        if upscale_factor > 1.0:
-            __set_prompt_input(prompt, 'UltimateSDUpscale', 'upscale_by', upscale_factor)
-            s = __get_prompt_input(prompt, 'SamplerCustom', 'noise_seed')
-            __set_prompt_input(prompt, 'UltimateSDUpscale', 'seed', s)
-            w = __get_prompt_input(prompt, 'EmptySD3LatentImage', 'width')
-            h = __get_prompt_input(prompt, 'EmptySD3LatentImage', 'height')
-            mask_blur, tile_padding, tile_width, tile_height = __get_upscale_params(w, h, upscale_factor)
-            __set_prompt_input(prompt, 'UltimateSDUpscale', 'mask_blur', mask_blur)
-            __set_prompt_input(prompt, 'UltimateSDUpscale', 'tile_padding', tile_padding)
-            __set_prompt_input(prompt, 'UltimateSDUpscale', 'tile_width', tile_width)
-            __set_prompt_input(prompt, 'UltimateSDUpscale', 'tile_height', tile_height)
-        return prompt
-    except Exception as e:
-        print(f"t2i. e: {e}")
+    params = __get_params(workflow_info, kwargs)
+    fields = set()
+    if __is_upscale(workflow_info, params):
+        fields.add(workflow_info['upscaleWhen']['field'])
+    for binding in workflow_info.get('bindings', []):
+        if not __is_binding_active(binding, params):
+            continue
+        fields.update(__get_source_fields(binding['from']))
+        when = binding.get('when')
+        if when is not None and 'field' in when:
+            fields.add(when['field'])
+    return {field: __normalize_value(params.get(field)) for field in sorted(fields)}
+
+
+def __is_upscale(workflow_info, params):
+    upscale_when = workflow_info.get('upscaleWhen')
+    return upscale_when is not None and __check_condition(upscale_when, params.get(upscale_when['field']))
+
+
+def __get_output_nodes(workflow):
+    """没有被其他节点引用的节点（PreviewImage、SaveImage等）"""
+    linked = set()
+    for node in workflow.values():
+        for value in node.get('inputs', {}).values():
+            if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str):
+                linked.add(value[0])
+    return [x for x in workflow if x not in linked]
+
+
+def __apply_upscale_stage(build, workflow, stage, base_image):
+    """
+    只保留放大阶段：放大节点的图像输入改为加载已有的基础图像，
+    删除不再被输出节点使用的节点（采样、解码等）
+    """
+    targets = __find_nodes(build, stage['class_type'], stage['key'])
+    if len(targets) == 0:
         return None
-
-
-def i2i_qwen_image_edit_2509(**kwargs):
-    model = kwargs['model'] if 'model' in kwargs else None
-    prompt_p = kwargs['prompt_p'] if 'prompt_p' in kwargs else ''
-    image1 = kwargs['image1'] if 'image1' in kwargs else None
-    image2 = kwargs['image2'] if 'image2' in kwargs else None
-    image3 = kwargs['image3'] if 'image3' in kwargs else None
-    seed = kwargs['seed'] if 'seed' in kwargs else 0
-    step = kwargs['step'] if 'step' in kwargs else 4
-    cfg = kwargs['cfg'] if 'cfg' in kwargs else 1.0
-    megapixels = kwargs['megapixels'] if 'megapixels' in kwargs else 1.0
+    outputs = __get_output_nodes(build['template']['workflow'])
+    load_x = str(max(int(x) for x in workflow if x.isdigit()) + 1)
+    workflow = dict(workflow)
+    workflow[load_x] = {
+        'class_type': 'LoadImage',
+        'inputs': {'image': base_image},
+        '_meta': {'title': 'Load Base Image'},
+    }
+    for x in targets:
+        node = dict(workflow[x])
+        node['inputs'] = dict(node['inputs'])
+        node['inputs'][stage['key']] = [load_x, 0]
+        workflow[x] = node
+
+    visited = set()
+    stack = list(outputs)
+    while stack:
+        x = stack.pop()
+        if x in visited or x not in workflow:
+            continue
+        visited.add(x)
+        for value in workflow[x].get('inputs', {}).values():
+            if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str):
+                stack.append(value[0])
+    return {x: node for x, node in workflow.items() if x in visited}
+
+
+def has_upscale_stage(key, **kwargs):
+    """请求是否会放大，且工作流支持从已有的基础图像开始放大"""
+    workflow_info = workflow_list.get(key)
+    if workflow_info is None or 'upscaleStage' not in workflow_info:
+        return False
+    return __is_upscale(workflow_info, __get_params(workflow_info, kwargs))
+
+
+def build_workflow(key, base_image=None, **kwargs):
+    """
+    按 model_map.json 中声明的模板和参数绑定生成工作流
+
+    参数:
+        key: 工作流名称（model_map.json 的键）
+        base_image: 已生成的基础图像（LoadImage 可用的路径），指定时只执行放大阶段（需要 upscaleStage）
+        kwargs: 请求参数（model、prompt_p、width、height、seed、step、cfg 等）
+
+    返回值:
+        dict: 提交给ComfyUI的工作流（不与缓存的模板共享节点，可以修改），失败时返回None
+    """
     try:
-        json_path = __get_prompt_file('i2i_qwen_image_edit_2509')
-        with open(json_path, 'r', encoding='utf-8') as f:
-            workflow = json.loads(f.read())
-        if model is not None:
-            __set_prompt_input(workflow, 'NunchakuQwenImageDiTLoader', 'model_name', model)
-        if prompt_p is not None and prompt_p != "":
-            _x = __get_condition_x(workflow, 'positive', key='prompt')
-            __set_prompt_input(workflow, 'TextEncodeQwenImageEditPlus', 'prompt', prompt_p, x=_x)
-        if image1 is None:
-            __remove_prompt_input(workflow, 'TextEncodeQwenImageEditPlus', 'image1')
-        else:
-            __set_node_input(workflow, '78', 'image', image1)
-        if image2 is None:
-            __remove_prompt_input(workflow, 'TextEncodeQwenImageEditPlus', 'image2')
-        else:
-            __set_node_input(workflow, '123', 'image', image2)
-        if image3 is None:
-            __remove_prompt_input(workflow, 'TextEncodeQwenImageEditPlus', 'image3')
-        else:
-            __set_node_input(workflow, '108', 'image', image3)
-        if seed != 0:
-            __set_prompt_input(workflow, 'KSampler', 'seed', seed)
-        if step != 0:
-            __set_prompt_input(workflow, 'KSampler', 'steps', step)
-        if cfg != 0.0:
-            __set_prompt_input(workflow, 'KSampler', 'cfg', cfg)
-        if megapixels > 1.0:
-            __set_prompt_input(workflow, 'ImageScaleToTotalPixels', 'megapixels', megapixels)
-        return workflow
+        workflow_info = workflow_list[key]
+        params = __get_params(workflow_info, kwargs)
+        upscale = __is_upscale(workflow_info, params)
+        build = __load_template(workflow_info.get('template', key), upscale)
+        plan = __compile_bindings(build, key, workflow_info.get('bindings', []))
+        __run_plan(build, params, plan)
+        workflow = __finish_build(build)
+        if base_image is not None and upscale and 'upscaleStage' in workflow_info:
+            workflow = __apply_upscale_stage(build, workflow, workflow_info['upscaleStage'], base_image)
+        if workflow is None:
+            return None
+        # 提交后ComfyUI的 on_prompt 处理器等可能就地修改节点，不能与模板共享
+        return __copy_workflow(workflow)
     except Exception as e:
-        print(f"t2i. e: {e}")
+        print(f"{key}. e: {e}")
         return None
 
 
 workflow_list: dict = {}
 workflow_func_map: dict = {}
+__workflow_list_stamp = None
 
 
-def load_workflows():
-    global workflow_list
-    workflow_list.clear()
-    with open(__get_prompt_file('model_map'), 'r', encoding='utf-8') as f:
+def load_workflows(force=False):
+    """读取model_map.json，文件未修改时直接使用已加载的结果"""
+    global workflow_list, __workflow_list_stamp
+    json_path = __get_prompt_file('model_map')
+    stamp = __get_file_stamp(json_path)
+    if not force and stamp == __workflow_list_stamp and len(workflow_func_map) > 0:
+        return
+    with open(json_path, 'r', encoding='utf-8') as f:
         workflow_list = json.loads(f.read())
+    __workflow_list_stamp = stamp
 
     workflow_func_map.clear()
     for key in workflow_list.keys():
-        workflow_func_map[key] = globals()[key]
+        workflow_func_map[key] = functools.partial(build_workflow, key)